@@ -0,0 +1,258 @@
+"""Бенчмарки эмулятора VFS на синтетических деревьях
+
+Генерирует дерево заданной глубины и ширины (в памяти и, при необходимости,
+на диске), замеряет загрузку, синхронизацию (reload) и основные команды и
+выводит результаты в JSON, чтобы сравнивать ревизии между собой.
+
+Примеры:
+  python benchmark.py
+  python benchmark.py --depth 4 --fanout 10 --files 80 --skip-host --json large.json
+  python benchmark.py --compare large.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from main import VFSEmulator
+from vfs_content import InlineContent
+from vfs_journal import Journal
+from vfs_output import OutputSink
+from vfs_tree import VFSTree
+
+
+def build_synthetic_tree(depth, fanout, files_per_dir, file_size):
+    """Дерево в памяти: у каждой директории fanout поддиректорий (до depth уровней)
+    и files_per_dir файлов по file_size байт"""
+    tree = VFSTree()
+    data = (b"line of synthetic content\n" * (file_size // 26 + 1))[:file_size]
+    level = [tree.root]
+    for current_depth in range(depth + 1):
+        next_level = []
+        for node in level:
+            for i in range(files_per_dir):
+                tree.add_file(node, f"file{i}.txt", InlineContent(data))
+            if current_depth < depth:
+                for i in range(fanout):
+                    next_level.append(tree.add_dir(node, f"dir{i}"))
+        level = next_level
+    return tree
+
+
+def generate_host_tree(root, depth, fanout, files_per_dir, file_size):
+    """То же дерево на диске (для замера загрузки --vfs-path)"""
+    data = (b"line of synthetic content\n" * (file_size // 26 + 1))[:file_size]
+    level = [root]
+    for current_depth in range(depth + 1):
+        next_level = []
+        for path in level:
+            for i in range(files_per_dir):
+                with open(os.path.join(path, f"file{i}.txt"), "wb") as f:
+                    f.write(data)
+            if current_depth < depth:
+                for i in range(fanout):
+                    child = os.path.join(path, f"dir{i}")
+                    os.mkdir(child)
+                    next_level.append(child)
+        level = next_level
+
+
+def deepest_dir(depth):
+    return "/" + "/".join("dir0" for _ in range(depth)) if depth else "/"
+
+
+def null_emulator(**kwargs):
+    """Эмулятор, вывод которого форматируется как обычно, но отбрасывается"""
+    sink = OutputSink(open(os.devnull, "w", encoding="utf-8"))
+    return VFSEmulator(output=sink, **kwargs)
+
+
+def measure(func, repeat):
+    """Время repeat вызовов: общее и лучшее"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    total = sum(timings)
+    return {
+        "repeat": repeat,
+        "total_s": total,
+        "best_s": min(timings),
+        "mean_s": total / repeat,
+        "ops_per_s": repeat / total if total else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    results = {}
+    params = {
+        "depth": args.depth,
+        "fanout": args.fanout,
+        "files": args.files,
+        "file_size": args.file_size,
+        "big_file_size": args.big_file_size,
+        "script_lines": args.script_lines,
+        "repeat": args.repeat,
+    }
+
+    started = time.perf_counter()
+    tree = build_synthetic_tree(args.depth, args.fanout, args.files, args.file_size)
+    results["generate_tree"] = {"seconds": time.perf_counter() - started, "nodes": tree.node_count}
+
+    emulator = null_emulator()
+    emulator._set_vfs(tree)
+    big = tree.add_file(tree.root, "big.log", InlineContent(b"log line with some text\n" * (args.big_file_size // 24)))
+    deep = deepest_dir(args.depth)
+    leaf = "file0.txt" if args.files else "big.log"
+
+    results["ls_root"] = measure(lambda: emulator.ls_command(["-l", "/"], "ls -l /"), args.repeat)
+    results["ls_deep"] = measure(lambda: emulator.ls_command([deep], "ls"), args.repeat)
+    # Отсортированный порядок хранится в директории: повторный ls -S не сортирует заново
+    results["ls_root_sorted"] = measure(lambda: emulator.ls_command(["-S", "/"], "ls -S /"), args.repeat)
+    results["ls_page"] = measure(lambda: emulator.ls_command(["--offset", "5", "--limit", "5", "/"], "ls"),
+                                 args.repeat)
+    results["ls_count_recursive"] = measure(lambda: emulator.ls_command(["-cR", "/"], "ls -cR /"), args.repeat)
+    results["cd_deep"] = measure(lambda: (emulator.cd_command([deep], "cd"), emulator.cd_command(["/"], "cd /")),
+                                 args.repeat)
+    results["find_name_exact"] = measure(lambda: emulator.find_command(["/", "-name", leaf], "find"), args.repeat)
+    results["find_name_glob"] = measure(lambda: emulator.find_command(["/", "-name", "file1*"], "find"), args.repeat)
+    results["find_substring"] = measure(lambda: emulator.find_command(["ile1", "/"], "find"), args.repeat)
+    results["find_type_maxdepth"] = measure(lambda: emulator.find_command(["/", "-type", "d", "-maxdepth", "2"],
+                                                                          "find"), args.repeat)
+    # Строки нет ни в одном файле: отбор по индексу; выражение без строк - просмотр всех файлов
+    results["grep_literal_miss"] = measure(lambda: emulator.grep_command(["-r", "no such line", "/"], "grep"),
+                                           args.repeat)
+    results["grep_regex_scan"] = measure(lambda: emulator.grep_command(["-r", "^[0-9]+$", "/"], "grep"),
+                                         args.repeat)
+    # Итоги поддеревьев хранятся в узлах: du -s / не обходит дерево
+    results["du_root"] = measure(lambda: emulator.du_command(["-s", "/"], "du -s /"), args.repeat)
+    results["tree_depth2"] = measure(lambda: emulator.tree_command(["-L", "2", "/"], "tree"), args.repeat)
+    results["cat_big"] = measure(lambda: emulator.cat_command(["/big.log"], "cat"), args.repeat)
+    results["tac_big"] = measure(lambda: emulator.tac_command(["/big.log"], "tac"), args.repeat)
+    results["cat_big"]["bytes"] = results["tac_big"]["bytes"] = big.content.size
+    # Конвейеры: head прерывает обход дерева, tail держит в памяти только последние строки
+    results["pipe_find_head"] = measure(lambda: emulator.execute_line("find / -type f | head -5"), args.repeat)
+    results["pipe_cat_tail"] = measure(lambda: emulator.execute_line("cat /big.log | tail -20"), args.repeat)
+
+    workdir = tempfile.mkdtemp(prefix="vfs_bench_")
+    try:
+        script_path = os.path.join(workdir, "bench_script.txt")
+        commands = ["pwd", f"cd {deep}", "ls", "cd /", f"find {leaf} {deep}", "# комментарий"]
+        with open(script_path, "w", encoding="utf-8") as f:
+            for i in range(args.script_lines):
+                f.write(commands[i % len(commands)] + "\n")
+
+        # Первый запуск разбирает скрипт, повторный берет разобранную форму из кеша
+        cold = measure(lambda: emulator.execute_script_file(script_path), 1)
+        warm = measure(lambda: emulator.execute_script_file(script_path), args.repeat)
+        for result in (cold, warm):
+            result["lines_per_s"] = args.script_lines / result["best_s"]
+        results["script_cold"] = cold
+        results["script_warm"] = warm
+
+        # Журнал: запись script_lines изменений и восстановление по нему при запуске
+        journal_path = os.path.join(workdir, "bench.journal")
+        journal = Journal(journal_path, checkpoint_every=0)
+        writer = null_emulator(journal=journal)
+        writer.mkdir_command(["/bench"], "mkdir")
+        started = time.perf_counter()
+        for i in range(args.script_lines):
+            writer.touch_command([f"/bench/f{i}"], "touch")
+        journal.close()
+        seconds = time.perf_counter() - started
+        results["journal_append"] = {"seconds": seconds, "records_per_s": args.script_lines / seconds}
+        journal = Journal(journal_path, checkpoint_every=0)
+        started = time.perf_counter()
+        null_emulator(journal=journal)
+        seconds = time.perf_counter() - started
+        journal.close()
+        results["journal_replay"] = {"seconds": seconds, "records_per_s": args.script_lines / seconds}
+
+        if not args.skip_host:
+            host_root = os.path.join(workdir, "host")
+            os.mkdir(host_root)
+            started = time.perf_counter()
+            generate_host_tree(host_root, args.depth, args.fanout, args.files, args.file_size)
+            results["generate_host_tree"] = {"seconds": time.perf_counter() - started}
+
+            for name, lazy in (("load_eager", False), ("load_lazy", True)):
+                started = time.perf_counter()
+                loaded = null_emulator(vfs_path=host_root, lazy=lazy, scan_workers=args.scan_workers)
+                seconds = time.perf_counter() - started
+                results[name] = {
+                    "seconds": seconds,
+                    "nodes": loaded.vfs.node_count,
+                    "entries_per_s": loaded.vfs.node_count / seconds,
+                }
+                if not lazy:
+                    # Синхронизация без изменений на диске: stat всех прочитанных директорий и файлов
+                    results["reload_idle"] = measure(loaded.resync_vfs, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+
+
+def compare(baseline_path, report):
+    """Отношение лучших времен текущего запуска к сохраненному (меньше 1 - быстрее)"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"Сравнение с {baseline_path} (ревизия {baseline.get('revision')}):", file=sys.stderr)
+    for name, result in report["results"].items():
+        old = baseline.get("results", {}).get(name)
+        key = "best_s" if "best_s" in result else "seconds"
+        if not old or key not in result or not old.get(key):
+            continue
+        print(f"  {name:20s} {old[key] * 1000:10.3f} мс -> {result[key] * 1000:10.3f} мс "
+              f"(x{result[key] / old[key]:.2f})", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки эмулятора VFS')
+    parser.add_argument('--depth', type=int, default=3, help='Глубина дерева (по умолчанию 3)')
+    parser.add_argument('--fanout', type=int, default=10, help='Поддиректорий в каждой директории')
+    parser.add_argument('--files', type=int, default=10, help='Файлов в каждой директории')
+    parser.add_argument('--file-size', type=int, default=256, help='Размер каждого файла в байтах')
+    parser.add_argument('--big-file-size', type=int, default=8 * 1024 * 1024, help='Размер файла для cat/tac')
+    parser.add_argument('--script-lines', type=int, default=10000, help='Число строк скрипта')
+    parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого замера')
+    parser.add_argument('--scan-workers', type=int, help='Потоков для загрузки с диска')
+    parser.add_argument('--skip-host', action='store_true', help='Не создавать дерево на диске')
+    parser.add_argument('--json', metavar='ФАЙЛ', help='Записать результаты в файл (иначе - в stdout)')
+    parser.add_argument('--compare', metavar='ФАЙЛ', help='Сравнить с ранее сохраненными результатами')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,176 @@
-import shlex
+import itertools
+import contextlib
 import sys
 import os
+import re
+import json
+import shlex
+import time
 import argparse
 
+from vfs_archive import ArchiveError, is_archive, load_archive
+from vfs_batch import find_scripts, run_scripts
+from vfs_content import iter_lines, iter_lines_reversed, iter_text
+from vfs_grep import GrepQuery, candidate_files
+from vfs_image import ImageError, expand_image, load_image, save_image
+from vfs_journal import DEFAULT_CHECKPOINT_EVERY, SYNC_MODES, Journal, JournalError, apply_record
+from vfs_output import OutputSink, open_output
+from vfs_path import PathResolver
+from vfs_pipe import FILTER_COMMANDS, OutputLines, PipeClosed, PipeError, PipeSink, parse_filter, parse_pipeline
+from vfs_scan import scan_host_directory
+from vfs_script import STEP_COMMAND, STEP_COMMENT, compile_script
+from vfs_server import VFSServer
+from vfs_stats import EmulatorStats, cprofile_hook, process_memory
+from vfs_sync import HostWatcher, apply_host_changes, exclusive_guard, scan_host_changes
+from vfs_tree import ORDER_KEYS, HostLoader, VFSTree
+
+FIND_OPTIONS = ("-name", "-regex", "-type", "-size", "-maxdepth")
+FIND_SIZE_UNITS = {"c": 1, "k": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+GREP_FLAGS = "rin"
+DU_FLAGS = "sh"
+LS_FLAGS = "lSrRc"
+LS_OPTIONS = ("--sort", "--offset", "--limit")
+ECHO_BATCH_LINES = 1024
+
+
+def _subdirectories(path, children):
+    """(путь, узел) поддиректорий из children - для обхода ls -R"""
+    prefix = path if path != "/" else ""
+    return ((f"{prefix}/{child.name}", child) for child in children if child.type == "dir")
+
+
+def _ls_next_page(rest, options, offset, end, limit):
+    """Подсказка для следующей страницы ls: те же путь, ключи и порядок"""
+    args = list(rest)
+    if "--sort" in options:
+        args += ["--sort", options["--sort"]]
+    args += ["--offset", str(end), "--limit", str(limit)]
+    return f"-- показаны элементы {offset + 1}-{end}, далее: ls {' '.join(shlex.quote(arg) for arg in args)}"
+
 
 class VFSEmulator:
-    def __init__(self, vfs_path=None, startup_script=None):
+    def __init__(self, vfs_path=None, startup_script=None, lazy=False, image_path=None, scan_workers=None,
+                 output=None, vfs=None, journal=None):
+        self.output = output if output is not None else OutputSink()
         self.vfs_name = "myvfs"
         self.current_path = "/"
         self.running = True
         self.vfs_path = vfs_path
         self.startup_script = startup_script
+        self.lazy = lazy
+        self.image_path = image_path
+        self.scan_workers = scan_workers
+        self.load_stats = None
+        self.stats = EmulatorStats()
+        # Необязательный профилировщик для одного запуска скрипта: script_file -> контекстный менеджер
+        self.script_profiler = None
+        # Необязательная блокировка общего дерева (режим сервера): имя команды -> контекстный менеджер
+        self.command_guard = None
+        # Именованные снимки дерева (snapshot/restore/diff)
+        self.snapshots = {}
+        # Итоги последнего скрипта: (успешных, ошибочных)
+        self.last_script_counts = (0, 0)
         self.command_history = []
-
-        # Загрузка VFS из директории или использование стандартной
-        if vfs_path:
-            self.load_vfs_from_directory(vfs_path)
+        # Кеш разрешения путей: (текущая директория, путь) -> (канонический путь, узел)
+        self.paths = PathResolver()
+        self.commands = self._build_command_table()
+        # Журнал изменений (--journal); сеансы сервера пишут в общий журнал
+        self.journal = journal
+        self.journal_summary = None
+        records = ()
+        # Контрольная точка журнала для VFS из директории на диске (ссылки на диск, см. vfs_image)
+        host_checkpoint = None
+        if journal is not None and vfs is None:
+            try:
+                checkpoint, records = journal.open()
+            except (OSError, JournalError) as e:
+                self.error(f"Ошибка: не удалось открыть журнал '{journal.path}': {e}")
+                self.journal = None
+            else:
+                host = journal.checkpoint_host
+                if checkpoint and host is None:
+                    # Контрольная точка уже содержит исходную VFS и все изменения до нее
+                    if vfs_path and not image_path:
+                        self.error(f"Предупреждение: --vfs-path '{vfs_path}' не используется: VFS "
+                                   f"восстанавливается из контрольной точки журнала (образ)")
+                    image_path = self.image_path = checkpoint
+                elif checkpoint and not image_path and os.path.abspath(vfs_path or host) == host:
+                    # Источник - директория: контрольная точка синхронизируется с ней
+                    vfs_path = self.vfs_path = host
+                    host_checkpoint = checkpoint
+                elif checkpoint:
+                    self.error(f"Ошибка: журнал '{journal.path}' ведется для директории '{host}', "
+                               f"журнал отключен")
+                    self.journal.close()
+                    self.journal = None
+
+        # Загрузка VFS из образа, директории или использование стандартной
+        started = time.perf_counter()
+        loaded = True
+        if vfs is not None:
+            # Сеанс сервера: дерево уже загружено и общее для всех сеансов
+            self.vfs = vfs
+        elif image_path:
+            loaded = self.load_vfs_from_image(image_path)
+        elif host_checkpoint:
+            loaded = self.load_vfs_from_checkpoint(host_checkpoint, vfs_path)
+        elif vfs_path:
+            loaded = self.load_vfs_from_directory(vfs_path)
         else:
             self._init_default_filesystem()
+            self.stats.record_load("default", time.perf_counter() - started, self.vfs.node_count)
 
-        print("=== Параметры запуска ===")
-        print(f"vfs_path: {self.vfs_path}")
-        print(f"startup_script: {self.startup_script}")
-        print(f"Загружено объектов: {len(self.filesystem)}")
-        print("========================")
-        print()
+        if self.journal is not None and vfs is None:
+            if not loaded:
+                self.error("Ошибка: VFS для применения журнала не загружена, журнал отключен")
+                self.journal.close()
+                self.journal = None
+            else:
+                self.replay_journal(records)
+
+        if vfs is None:
+            self.print_banner()
+
+    def print_banner(self):
+        self.echo("=== Параметры запуска ===")
+        self.echo(f"vfs_path: {self.vfs_path}")
+        if self.image_path:
+            self.echo(f"image: {self.image_path}")
+        self.echo(f"startup_script: {self.startup_script}")
+        self.echo(f"Загружено объектов: {self.vfs.node_count}")
+        if self.lazy and self.vfs_path:
+            self.echo("Режим загрузки: ленивый (по требованию)")
+        if self.load_stats:
+            self.echo(f"Загрузка: {self.load_stats.summary()}")
+        if self.journal_summary:
+            self.echo(f"Журнал: {self.journal_summary}")
+        self.echo("========================")
+        self.echo()
+
+    def echo(self, text=""):
+        """Обычный вывод команды"""
+        self.output.line(text)
+
+    def error(self, text):
+        """Сообщение об ошибке (выводится и в тихом режиме)"""
+        self.output.error(text)
+
+    def _echo_lines(self, lines):
+        """Вывод многих строк блоками по ECHO_BATCH_LINES (одна запись в OutputSink на блок)"""
+        lines = iter(lines)
+        batch = list(itertools.islice(lines, ECHO_BATCH_LINES))
+        while batch:
+            batch.append("")
+            self.output.write("\n".join(batch))
+            batch = list(itertools.islice(lines, ECHO_BATCH_LINES))
+
+    def _set_vfs(self, tree):
+        self.vfs = tree
+        self.vfs.report = self.error
 
     def _init_default_filesystem(self):
         """Стандартная файловая система с большей структурой"""
-        self.filesystem = {
+        self._set_vfs(VFSTree.from_paths({
             "/": {"type": "dir", "children": ["home", "etc", "var", "tmp"]},
             "/home": {"type": "dir", "children": ["user1", "user2", "guest"]},
             "/etc": {"type": "dir", "children": ["config.txt", "hosts"]},
@@ -50,188 +192,446 @@ class VFSEmulator:
             "/var/log/app.log": {"type": "file", "content": "App started\nProcessing data\n"},
             "/home/user1/documents/report.doc": {"type": "file", "content": "Отчет за январь\nВыполнены все задачи\n"},
             "/home/user1/documents/data.txt": {"type": "file", "content": "123\n456\n789\n"},
-        }
+        }))
 
     def load_vfs_from_directory(self, directory_path):
         """Загрузка VFS из директории на диске (Этап 3)"""
         if not os.path.exists(directory_path):
-            print(f"Ошибка: путь '{directory_path}' не существует")
+            self.error(f"Ошибка: путь '{directory_path}' не существует")
             self._init_default_filesystem()
             return False
 
+        if os.path.isfile(directory_path) and is_archive(directory_path):
+            return self.load_vfs_from_archive(directory_path)
+
         if not os.path.isdir(directory_path):
-            print(f"Ошибка: '{directory_path}' не является директорией")
+            self.error(f"Ошибка: '{directory_path}' не является директорией или архивом tar/zip")
             self._init_default_filesystem()
             return False
 
-        self.filesystem = {}
-        self._scan_directory(directory_path, "/")
-        print(f"VFS загружена из '{directory_path}'")
+        started = time.perf_counter()
+        self._set_vfs(VFSTree())
+        if self.lazy:
+            # Ленивый режим: регистрируем только корень, остальное читается по требованию
+            self.vfs.loader = HostLoader()
+            self.vfs.attach_lazy(self.vfs.root, directory_path)
+        else:
+            self.load_stats = scan_host_directory(self.vfs, directory_path, self.vfs.root, self.scan_workers,
+                                                  report=self.error)
+        self.stats.record_load(directory_path, time.perf_counter() - started, self.vfs.node_count)
+        self.echo(f"VFS загружена из '{directory_path}'")
         return True
 
-    def _scan_directory(self, real_path, vfs_path):
-        """Рекурсивное сканирование директории"""
+    def load_vfs_from_archive(self, archive_path):
+        """Загрузка VFS из архива tar/zip без распаковки на диск: содержимое читается из архива"""
+        started = time.perf_counter()
+        self._set_vfs(VFSTree())
         try:
-            # Создаем запись для текущей директории
-            self.filesystem[vfs_path] = {"type": "dir", "children": []}
+            self.load_stats = load_archive(self.vfs, archive_path, self.vfs.root, report=self.error)
+        except (OSError, ArchiveError) as e:
+            self.error(f"Ошибка: не удалось прочитать архив '{archive_path}': {e}")
+            self.load_stats = None
+            self._init_default_filesystem()
+            return False
+        # Структура архива читается целиком, а содержимое и так читается по требованию
+        self.lazy = False
+        self.stats.record_load(archive_path, time.perf_counter() - started, self.vfs.node_count)
+        self.echo(f"VFS загружена из архива '{archive_path}'")
+        return True
 
-            for item in os.listdir(real_path):
-                real_item_path = os.path.join(real_path, item)
-                vfs_item_path = f"{vfs_path}/{item}" if vfs_path != "/" else f"/{item}"
+    def load_vfs_from_image(self, image_path):
+        """Загрузка VFS из бинарного образа: узлы декодируются по требованию"""
+        started = time.perf_counter()
+        try:
+            tree, node_count = load_image(image_path)
+        except (OSError, ImageError) as e:
+            self.error(f"Ошибка: не удалось загрузить образ '{image_path}': {e}")
+            self.image_path = None
+            self._init_default_filesystem()
+            return False
 
-                if os.path.isdir(real_item_path):
-                    # Это директория
-                    self.filesystem[vfs_path]["children"].append(item)
-                    self._scan_directory(real_item_path, vfs_item_path)
-                else:
-                    # Это файл
-                    self.filesystem[vfs_path]["children"].append(item)
-                    try:
-                        with open(real_item_path, 'r', encoding='utf-8', errors='ignore') as f:
-                            content = f.read(10000)  # Читаем до 10000 символов
-                    except:
-                        content = "[бинарные данные]"
-                    self.filesystem[vfs_item_path] = {"type": "file", "content": content}
-        except Exception as e:
-            print(f"Ошибка сканирования {real_path}: {e}")
+        self._set_vfs(tree)
+        self.image_path = image_path
+        self.current_path = "/"
+        self.stats.record_load(image_path, time.perf_counter() - started, self.vfs.node_count)
+        self.echo(f"VFS загружена из образа '{image_path}' ({node_count} объектов)")
+        return True
+
+    def load_vfs_from_checkpoint(self, checkpoint_path, directory_path):
+        """Загрузка контрольной точки журнала для VFS из директории и синхронизация с ней
+
+        Образ хранит ссылки на диск, поэтому данные файлов читаются с диска, а
+        изменения на диске после контрольной точки применяются синхронизацией.
+        """
+        started = time.perf_counter()
+        try:
+            tree, node_count = load_image(checkpoint_path)
+            self._set_vfs(tree)
+            expand_image(tree)
+        except (OSError, ImageError) as e:
+            self.error(f"Ошибка: не удалось загрузить контрольную точку '{checkpoint_path}': {e}")
+            self._init_default_filesystem()
+            return False
+        stats = self.resync_vfs()
+        self.stats.record_load(checkpoint_path, time.perf_counter() - started, self.vfs.node_count)
+        self.echo(f"VFS загружена из '{directory_path}' по контрольной точке журнала ({node_count} объектов)")
+        if stats is not None:
+            self.echo(f"Изменения на диске после контрольной точки: {stats.summary()}")
+        return True
+
+    def replay_journal(self, records):
+        """Повтор записей журнала над загруженной VFS (восстановление после перезапуска)"""
+        started = time.perf_counter()
+        failed = 0
+        for record in records:
+            try:
+                apply_record(self.vfs, record)
+            except JournalError as e:
+                self.error(f"Журнал: запись {record.get('seq')} пропущена: {e}")
+                failed += 1
+        self.journal_summary = (f"{self.journal.path}, применено изменений: {len(records) - failed} "
+                                f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+        if self.journal.checkpoint_path:
+            self.journal_summary += f" (контрольная точка {os.path.basename(self.journal.checkpoint_path)})"
+
+    def log_change(self, record):
+        """Запись изменения в журнал; по достижении --checkpoint-every журнал сжимается"""
+        if self.journal is None:
+            return
+        try:
+            self.journal.append(record)
+        except OSError as e:
+            self.error(f"Ошибка: не удалось записать в журнал '{self.journal.path}': {e}")
+            return
+        if self.journal.checkpoint_due:
+            self.checkpoint_journal()
+
+    @property
+    def host_root(self):
+        """Директория на диске, из которой загружена VFS (reload, --watch); None - образ, архив или стандартная"""
+        root = self.vfs.root
+        if not self.vfs_path or self.image_path or (root.stamp is None and root.loaded):
+            return None
+        return os.path.abspath(self.vfs_path)
+
+    def checkpoint_journal(self):
+        """Контрольная точка: дерево сохраняется в образ (данные диска - ссылками), журнал очищается"""
+        if self.journal is None:
+            return None
+        try:
+            return self.journal.checkpoint(self.vfs, self.host_root)
+        except OSError as e:
+            self.error(f"Ошибка: не удалось создать контрольную точку журнала '{self.journal.path}': {e}")
+            return None
+
+    def save_vfs_image(self, image_path):
+        """Сохранение текущей VFS в бинарный образ"""
+        try:
+            count = save_image(self.vfs, image_path)
+        except OSError as e:
+            self.error(f"Ошибка: не удалось сохранить образ '{image_path}': {e}")
+            return False
+        self.echo(f"Образ VFS сохранен в '{image_path}' ({count} объектов)")
+        return True
+
+    def new_session(self, output):
+        """Новый сеанс над тем же деревом: своя текущая директория, история и вывод"""
+        return VFSEmulator(vfs_path=self.vfs_path, lazy=self.lazy, image_path=self.image_path, output=output,
+                           vfs=self.vfs, journal=self.journal)
+
+    def fork(self, output=None):
+        """Независимая копия эмулятора за O(1): дерево общее до первого изменения
+
+        Текущий путь и снимки копируются, история и статистика - новые; изменения
+        копии не пишутся в журнал.
+        """
+        other = VFSEmulator(vfs_path=self.vfs_path, lazy=self.lazy, image_path=self.image_path,
+                            output=output if output is not None else self.output, vfs=self.vfs.fork())
+        other.vfs.report = other.error
+        other.current_path = self.current_path
+        other.snapshots = dict(self.snapshots)
+        return other
+
+    def prompt_text(self):
+        return f"{self.vfs_name}:{self.current_path}$ "
 
     def print_prompt(self):
-        print(f"{self.vfs_name}:{self.current_path}$ ", end="", flush=True)
+        # Перед ожиданием ввода весь накопленный вывод сбрасывается на экран
+        self.output.flush()
+        sys.stdout.write(self.prompt_text())
+        sys.stdout.flush()
 
     def parse_input(self, user_input):
+        """Команды строки: [(команда, аргументы), ...], несколько - конвейер через '|'"""
         try:
-            parts = shlex.split(user_input.strip())
-            if not parts:
-                return None, []
-            return parts[0], parts[1:]
+            return parse_pipeline(user_input.strip())
         except ValueError as e:
-            print(f"Ошибка парсинга: {e}")
-            return None, []
+            self.error(f"Ошибка парсинга: {e}")
+            return []
+
+    def _build_command_table(self):
+        """Таблица команд: имя -> обработчик"""
+        return {
+            "exit": self.exit_command,
+            "ls": self.ls_command,
+            "cd": self.cd_command,
+            "conf-dump": self.conf_dump_command,
+            "run-script": self.run_script_command,
+            "list-scripts": self.list_scripts_command,
+            "pwd": self.pwd_command,
+            "mkdir": self.mkdir_command,
+            "touch": self.touch_command,
+            "mv": self.mv_command,
+            "save-image": self.save_image_command,
+            "load-image": self.load_image_command,
+            "history": self.history_command,
+            "cat": self.cat_command,  # Новая команда для Этапа 4
+            "find": self.find_command,  # Новая команда для Этапа 4
+            "tac": self.tac_command,  # Новая команда для Этапа 4
+            "grep": self.grep_command,
+            "du": self.du_command,
+            "tree": self.tree_command,
+            "stats": self.stats_command,
+            "mem": self.mem_command,
+            "snapshot": self.snapshot_command,
+            "restore": self.restore_command,
+            "diff": self.diff_command,
+            "reload": self.reload_command,
+            "checkpoint": self.checkpoint_command,
+            "head": self.head_command,
+            "tail": self.tail_command,
+            "wc": self.wc_command,
+            "sort": self.sort_command,
+            "uniq": self.uniq_command,
+        }
+
+    def execute_command(self, command, args, original_input, filters=()):
+        if filters:
+            return self.execute_pipeline(command, args, filters, original_input)
+        return self._invoke(self.commands.get(command), command, args, original_input)
+
+    def execute_pipeline(self, command, args, filters, original_input):
+        """Команда, вывод которой построчно проходит через фильтры (head, tail, wc, sort, uniq)"""
+        downstream = OutputLines(self.output)
+        for name, filter_args in reversed(filters):
+            if name not in FILTER_COMMANDS:
+                self.command_history.append(original_input)
+                self.error(f"{name}: команда не читает вывод конвейера (доступно: {', '.join(FILTER_COMMANDS)})")
+                return False
+            try:
+                make_filter, paths = parse_filter(name, filter_args)
+            except PipeError as e:
+                self.command_history.append(original_input)
+                self.error(f"{name}: {e}")
+                return False
+            if paths:
+                self.command_history.append(original_input)
+                self.error(f"{name}: в конвейере файлы не указываются: {' '.join(paths)}")
+                return False
+            downstream = make_filter(downstream)
 
-    def execute_command(self, command, args, original_input):
+        pipe = PipeSink(self.output, downstream)
+        saved_output, self.output = self.output, pipe
+        try:
+            success = self._invoke(self.commands.get(command), command, args, original_input)
+        finally:
+            self.output = saved_output
+        pipe.finish()
+        return success
+
+    def _invoke(self, handler, command, args, original_input):
         self.command_history.append(original_input)
 
-        if command == "exit":
-            return self.exit_command(args, original_input)
-        elif command == "ls":
-            return self.ls_command(args, original_input)
-        elif command == "cd":
-            return self.cd_command(args, original_input)
-        elif command == "conf-dump":
-            return self.conf_dump_command(args, original_input)
-        elif command == "run-script":
-            return self.run_script_command(args, original_input)
-        elif command == "list-scripts":
-            return self.list_scripts_command(args, original_input)
-        elif command == "pwd":
-            return self.pwd_command(args, original_input)
-        elif command == "mkdir":
-            return self.mkdir_command(args, original_input)
-        elif command == "touch":
-            return self.touch_command(args, original_input)
-        elif command == "history":
-            return self.history_command(args, original_input)
-        elif command == "cat":  # Новая команда для Этапа 4
-            return self.cat_command(args, original_input)
-        elif command == "find":  # Новая команда для Этапа 4
-            return self.find_command(args, original_input)
-        elif command == "tac":  # Новая команда для Этапа 4
-            return self.tac_command(args, original_input)
-        else:
-            print(f"{command}: команда не найдена")
+        if handler is None:
+            self.error(f"{command}: команда не найдена")
+            self.stats.record(command, 0.0, False)
             return False
 
+        started = time.perf_counter()
+        ok = False
+        try:
+            if self.command_guard is None:
+                ok = handler(args, original_input)
+            else:
+                with self.command_guard(command):
+                    ok = handler(args, original_input)
+            return ok
+        except PipeClosed:
+            # Следующей команде конвейера хватило строк: вывод прерван, команда выполнена
+            ok = True
+            return ok
+        finally:
+            self.stats.record(command, time.perf_counter() - started, ok)
+
     def exit_command(self, args, original_input):
         if len(args) > 1:
-            print("exit: слишком много аргументов")
+            self.error("exit: слишком много аргументов")
             return False
 
         if len(args) == 1:
             try:
                 int(args[0])
             except ValueError:
-                print("exit: неверный код выхода")
+                self.error("exit: неверный код выхода")
                 return False
 
         self.running = False
-        print("Выход из эмулятора VFS")
+        self.echo("Выход из эмулятора VFS")
         return True
 
     def _normalize_path(self, path):
-        """Нормализация пути"""
-        if not path or path == ".":
-            return self.current_path
-
-        if path.startswith("/"):
-            normalized = path
-        elif path == "..":
-            if self.current_path == "/":
-                return "/"
-            parts = [p for p in self.current_path.split("/") if p]
-            if parts:
-                parts.pop()
-                return "/" + "/".join(parts) if parts else "/"
-            return "/"
-        else:
-            if self.current_path == "/":
-                normalized = f"/{path}"
-            else:
-                normalized = f"{self.current_path}/{path}"
+        """Канонический абсолютный путь: '.', '..', '~' (корень VFS) и повторные '/' раскрываются"""
+        return self.paths.normalize(self.current_path, path)
 
-        # Убираем двойные слеши
-        while "//" in normalized:
-            normalized = normalized.replace("//", "/")
-
-        return normalized
+    def _resolve_path(self, path):
+        """Канонический путь и узел (None - нет такого пути); результат кешируется до изменения дерева"""
+        return self.paths.resolve(self.vfs, self.current_path, path)
 
     def ls_command(self, args, original_input):
-        long_format = False
-        target_path = self.current_path
-
-        if args:
-            if "-l" in args:
-                long_format = True
-                args = [arg for arg in args if arg != "-l"]
-
-            if args:
-                if len(args) > 1:
-                    print("ls: слишком много аргументов")
+        """Список директории: порядок (-S, --sort), страницы (--offset, --limit), -R, -c"""
+        options = {}
+        rest = []
+        i = 0
+        while i < len(args):
+            name, has_value, value = args[i].partition("=")
+            if name not in LS_OPTIONS:
+                rest.append(args[i])
+                i += 1
+                continue
+            if not has_value:
+                if i + 1 >= len(args):
+                    self.error(f"ls: отсутствует аргумент для '{name}'")
                     return False
-                target_path = self._normalize_path(args[0])
+                i += 1
+                value = args[i]
+            options[name] = value
+            i += 1
 
-        if target_path not in self.filesystem or self.filesystem[target_path]["type"] != "dir":
-            print(f"ls: невозможно получить доступ к '{target_path}': Нет такой директории")
+        flags, positional = self._parse_flags("ls", rest, LS_FLAGS)
+        if flags is None:
+            return False
+        if len(positional) > 1:
+            self.error("ls: слишком много аргументов")
+            self.error("Использование: ls [-l] [-S] [-r] [-R] [-c] [--sort name|size|type|none] "
+                       "[--offset N] [--limit N] [путь]")
+            return False
+
+        sort_key = options.get("--sort", "size" if "S" in flags else "none")
+        if sort_key not in ORDER_KEYS + ("none",):
+            self.error(f"ls: неизвестный порядок '{sort_key}', ожидается name, size, type или none")
+            return False
+        try:
+            offset = int(options.get("--offset", 0))
+            limit = int(options["--limit"]) if "--limit" in options else None
+        except ValueError:
+            offset = -1
+        if offset < 0 or (limit is not None and limit < 0):
+            self.error("ls: --offset и --limit должны быть неотрицательными числами")
+            return False
+        if limit == 0:
+            self.error("ls: --limit должен быть не меньше 1")
             return False
 
-        children = self.filesystem[target_path]["children"]
+        target_path, node = self._resolve_path(positional[0] if positional else ".")
+        if not node or node.type != "dir":
+            self.error(f"ls: невозможно получить доступ к '{target_path}': Нет такой директории")
+            return False
 
-        print(f"Содержимое директории {target_path}:")
+        recursive = "R" in flags
+        if "c" in flags:
+            return self._ls_count(target_path, node, recursive)
+
+        long_format = "l" in flags
+        piped = self.output.piped
+        sort_key = None if sort_key == "none" else sort_key
+        end = None if limit is None else offset + limit
+        if not recursive:
+            children = self.vfs.ordered_children(node, sort_key)
+            if "r" in flags:
+                children = reversed(children)
+            if not piped:
+                self.echo(f"Содержимое директории {target_path}:")
+            # Пропуск до страницы - в islice, без форматирования пропущенных элементов
+            line = self._ls_line
+            self._echo_lines(line(child, child.name, long_format) for child in itertools.islice(children, offset, end))
+            if end is not None and end < len(node.children) and not piped:
+                self.echo(_ls_next_page(rest, options, offset, end, limit))
+            return True
 
-        for item in children:
-            item_path = f"{target_path}/{item}" if target_path != "/" else f"/{item}"
-            if item_path not in self.filesystem:
+        entries = self._ls_entries(target_path, node, sort_key, "r" in flags)
+        index = 0
+        # Директория -R, заголовок которой уже выведен
+        header_path = None
+        for path, child in entries:
+            in_page = index >= offset and (end is None or index < end)
+            if not piped and in_page and path != header_path:
+                # Заголовок директории -R: в начале ее элементов или в начале страницы
+                if header_path is not None:
+                    self.echo()
+                self.echo(f"Содержимое директории {path}:")
+                header_path = path
+            if child is None:
                 continue
+            if end is not None and index >= end:
+                if not piped:
+                    self.echo(_ls_next_page(rest, options, offset, end, limit))
+                break
+            if in_page:
+                # В конвейер -R передаются полные пути: строки не зависят от заголовков
+                name = f"{path if path != '/' else ''}/{child.name}" if piped else child.name
+                self.echo(self._ls_line(child, name, long_format))
+            index += 1
+        return True
 
-            if long_format:
-                item_type = "d" if self.filesystem[item_path]["type"] == "dir" else "-"
-                size = len(self.filesystem[item_path].get("content", "")) if self.filesystem[item_path][
-                                                                                 "type"] == "file" else 0
-                print(f"{item_type}rw-r--r-- 1 user user {size:>6} Jan 15 12:00 {item}")
-            else:
-                item_suffix = "/" if self.filesystem[item_path]["type"] == "dir" else ""
-                print(f"  {item}{item_suffix}")
+    def _ls_line(self, child, name, long_format):
+        if long_format:
+            item_type = "d" if child.type == "dir" else "-"
+            size = self.vfs.file_size(child) if child.type == "file" else 0
+            return f"{item_type}rw-r--r-- 1 user user {size:>6} Jan 15 12:00 {name}"
+        item_suffix = "/" if child.type == "dir" else ""
+        return f"  {name}{item_suffix}"
+
+    def _ls_entries(self, path, node, sort_key, reverse):
+        """Элементы ls -R в порядке вывода: (путь директории, узел); перед
+        элементами каждой директории - (ее путь, None)
+
+        Поддиректории раскрываются по мере вывода: в памяти только итераторы по
+        уровням вложенности, поэтому ls -R | head не обходит все дерево.
+        """
+        stack = [iter(((path, node),))]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+                continue
+            dir_path, directory = item
+            children = self.vfs.ordered_children(directory, sort_key)
+            yield dir_path, None
+            yield from ((dir_path, child) for child in (reversed(children) if reverse else children))
+            stack.append(_subdirectories(dir_path, reversed(children) if reverse else children))
+
+    def _ls_count(self, path, node, recursive):
+        """ls -c: число элементов без вывода списка (-R - по итогам поддерева)"""
+        if recursive:
+            total, files, dirs = self.vfs.usage(node)
+            self.echo(f"Элементов в {path} и поддиректориях: {files + dirs} (директорий: {dirs}, файлов: {files})")
+            return True
+        self.vfs.ensure_loaded(node)
+        dirs = sum(1 for child in node.children.values() if child.type == "dir")
+        files = len(node.children) - dirs
+        self.echo(f"Элементов в {path}: {files + dirs} (директорий: {dirs}, файлов: {files})")
         return True
 
     def cd_command(self, args, original_input):
         if len(args) > 1:
-            print("cd: слишком много аргументов")
+            self.error("cd: слишком много аргументов")
             return False
 
         new_path = args[0] if args else "/"
-        target_path = self._normalize_path(new_path)
+        target_path, node = self._resolve_path(new_path)
 
-        if target_path not in self.filesystem or self.filesystem[target_path]["type"] != "dir":
-            print(f"cd: {new_path}: Нет такой директории")
+        if not node or node.type != "dir":
+            self.error(f"cd: {new_path}: Нет такой директории")
             return False
 
         self.current_path = target_path
@@ -240,136 +640,444 @@ class VFSEmulator:
     def cat_command(self, args, original_input):
         """Вывод содержимого файла (Этап 4)"""
         if len(args) < 1:
-            print("cat: требуется как минимум 1 аргумент")
-            print("Использование: cat файл1 [файл2 ...]")
+            self.error("cat: требуется как минимум 1 аргумент")
+            self.error("Использование: cat файл1 [файл2 ...]")
             return False
 
         success = True
         for filename in args:
-            file_path = self._normalize_path(filename)
-
-            if file_path not in self.filesystem:
-                print(f"cat: {filename}: Нет такого файла")
+            _, node = self._resolve_path(filename)
+            if not node:
+                self.error(f"cat: {filename}: Нет такого файла")
                 success = False
                 continue
 
-            if self.filesystem[file_path]["type"] != "file":
-                print(f"cat: {filename}: Не является файлом")
+            if node.type != "file":
+                self.error(f"cat: {filename}: Не является файлом")
                 success = False
                 continue
 
-            content = self.filesystem[file_path].get("content", "")
-            print(f"=== {filename} ===")
-            print(content)
-            if content and not content.endswith('\n'):
-                print()
+            # Содержимое выводится блоками, без загрузки файла целиком
+            if not self.output.piped:
+                self.echo(f"=== {filename} ===")
+            last_char = ""
+            try:
+                for text in iter_text(self.vfs.content_of(node)):
+                    self.output.write(text)
+                    last_char = text[-1]
+            except OSError as e:
+                self.error(f"\ncat: {filename}: ошибка чтения: {e}")
+                success = False
+                continue
+            if self.output.piped:
+                # В конвейер передаются только строки файла
+                if last_char and last_char != '\n':
+                    self.echo()
+                continue
+            self.echo()
+            if last_char and last_char != '\n':
+                self.echo()
 
         return success
 
+    def _parse_size_test(self, spec):
+        """Условие -size: [+|-]N[c|k|M|G], без суффикса - байты"""
+        sign = spec[:1] if spec[:1] in "+-" else ""
+        number = spec[len(sign):]
+        multiplier = 1
+        if number and number[-1] in FIND_SIZE_UNITS:
+            multiplier = FIND_SIZE_UNITS[number[-1]]
+            number = number[:-1]
+        limit = int(number) * multiplier
+        if sign == "+":
+            return lambda size: size > limit
+        if sign == "-":
+            return lambda size: size < limit
+        return lambda size: size == limit
+
     def find_command(self, args, original_input):
         """Поиск файлов (Этап 4)"""
         if len(args) < 1:
-            print("find: требуется как минимум 1 аргумент")
-            print("Использование: find имя [путь]")
+            self.error("find: требуется как минимум 1 аргумент")
+            self.error("Использование: find имя [путь]")
+            self.error("              find [путь] [-name шаблон] [-regex выражение] [-type f|d] [-size [+-]N[ckMG]] [-maxdepth N]")
             return False
 
-        name = args[0]
-        start_path = self.current_path
+        positional = []
+        options = {}
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in FIND_OPTIONS:
+                if i + 1 >= len(args):
+                    self.error(f"find: отсутствует аргумент для '{arg}'")
+                    return False
+                options[arg] = args[i + 1]
+                i += 2
+            else:
+                positional.append(arg)
+                i += 1
+
+        # Без опций сохраняется прежний формат: find имя [путь]
+        name = None
+        if not options:
+            name = positional.pop(0)
+        if len(positional) > 1:
+            self.error("find: слишком много аргументов")
+            return False
 
-        if len(args) > 1:
-            start_path = self._normalize_path(args[1])
+        start_path, node = self._resolve_path(positional[0] if positional else ".")
+        if not node or node.type != "dir":
+            self.error(f"find: {start_path}: Нет такой директории")
+            return False
 
-        if start_path not in self.filesystem or self.filesystem[start_path]["type"] != "dir":
-            print(f"find: {start_path}: Нет такой директории")
+        try:
+            regex = re.compile(options["-regex"]) if "-regex" in options else None
+            size_test = self._parse_size_test(options["-size"]) if "-size" in options else None
+            maxdepth = int(options["-maxdepth"]) if "-maxdepth" in options else None
+        except re.error as e:
+            self.error(f"find: неверное регулярное выражение: {e}")
+            return False
+        except ValueError:
+            self.error("find: неверное числовое значение")
             return False
 
-        found = []
-        for path in self.filesystem:
-            if path.startswith(start_path):
-                item_name = path.split("/")[-1]
-                if name in item_name:  # Простой поиск по подстроке
-                    found.append(path)
+        node_type = None
+        if "-type" in options:
+            if options["-type"] not in ("f", "d"):
+                self.error(f"find: неизвестный тип '{options['-type']}', ожидается f или d")
+                return False
+            node_type = "file" if options["-type"] == "f" else "dir"
 
-        print(f"Поиск '{name}' в {start_path}:")
-        if found:
-            for path in found:
-                item_type = "dir" if self.filesystem[path]["type"] == "dir" else "file"
-                print(f"  {path} ({item_type})")
-        else:
-            print("  Не найдено")
+        description = name if name is not None else " ".join(f"{k} {v}" for k, v in options.items())
+        if not self.output.piped:
+            self.echo(f"Поиск '{description}' в {start_path}:")
+
+        found = False
+        for path, item in self.vfs.find(node, start_path, substring=name, glob=options.get("-name"),
+                                        regex=regex, node_type=node_type, size_test=size_test,
+                                        maxdepth=maxdepth):
+            found = True
+            item_type = "dir" if item.type == "dir" else "file"
+            self.echo(f"  {path} ({item_type})")
+
+        if not found and not self.output.piped:
+            self.echo("  Не найдено")
 
         return True
 
     def tac_command(self, args, original_input):
         """Обратный вывод файла (Этап 4)"""
         if len(args) < 1:
-            print("tac: требуется как минимум 1 аргумент")
-            print("Использование: tac файл1 [файл2 ...]")
+            self.error("tac: требуется как минимум 1 аргумент")
+            self.error("Использование: tac файл1 [файл2 ...]")
             return False
 
         success = True
         for filename in args:
-            file_path = self._normalize_path(filename)
+            _, node = self._resolve_path(filename)
+            if not node:
+                self.error(f"tac: {filename}: Нет такого файла")
+                success = False
+                continue
 
-            if file_path not in self.filesystem:
-                print(f"tac: {filename}: Нет такого файла")
+            if node.type != "file":
+                self.error(f"tac: {filename}: Не является файлом")
                 success = False
                 continue
 
-            if self.filesystem[file_path]["type"] != "file":
-                print(f"tac: {filename}: Не является файлом")
+            # Файл читается блоками с конца, строки выводятся по мере нахождения
+            if not self.output.piped:
+                self.echo(f"=== {filename} (обратный порядок) ===")
+            try:
+                lines = iter_lines_reversed(self.vfs.content_of(node))
+                last_line = next(lines)
+                # Пустая "строка" после последнего перевода строки в конвейер не передается
+                if last_line or not self.output.piped:
+                    self.echo(last_line)
+                for line in lines:
+                    self.echo(line)
+            except OSError as e:
+                self.error(f"tac: {filename}: ошибка чтения: {e}")
                 success = False
                 continue
+            if last_line and not self.output.piped:
+                self.echo()
 
-            content = self.filesystem[file_path].get("content", "")
-            lines = content.split("\n")
+        return success
 
-            print(f"=== {filename} (обратный порядок) ===")
-            for line in reversed(lines):
-                print(line)
-            if lines and lines[-1]:
-                print()
+    def _human_size(self, size):
+        """Размер в байтах в виде 469, 1.5K, 23M (степени 1024)"""
+        if size < 1024:
+            return str(size)
+        for unit in "KMGTP":
+            size /= 1024
+            if size < 1024 or unit == "P":
+                return f"{size:.1f}{unit}" if size < 10 else f"{size:.0f}{unit}"
+
+    def _parse_flags(self, command, args, allowed):
+        """Разделение аргументов на флаги (-s, -sh) и остальные; после '--' флагов нет.
+        None - неизвестный флаг"""
+        flags = set()
+        positional = []
+        for i, arg in enumerate(args):
+            if arg == "--":
+                positional.extend(args[i + 1:])
+                break
+            if arg.startswith("-") and len(arg) > 1:
+                unknown = set(arg[1:]) - set(allowed)
+                if unknown:
+                    self.error(f"{command}: неизвестный ключ '-{''.join(sorted(unknown))}'")
+                    return None, None
+                flags.update(arg[1:])
+            else:
+                positional.append(arg)
+        return flags, positional
 
+    def grep_command(self, args, original_input):
+        """Поиск строк по регулярному выражению в файлах (кандидаты отбираются по индексу)"""
+        flags, positional = self._parse_flags("grep", args, GREP_FLAGS)
+        if flags is None:
+            return False
+        if not positional or len(positional) > 2:
+            self.error("Использование: grep [-r] [-i] [-n] шаблон [путь]")
+            return False
+        recursive = "r" in flags
+        if len(positional) == 1 and not recursive:
+            self.error("grep: требуется путь к файлу (или -r для поиска в текущей директории)")
+            return False
+
+        try:
+            query = GrepQuery(positional[0], ignore_case="i" in flags)
+        except re.error as e:
+            self.error(f"grep: неверное регулярное выражение: {e}")
+            return False
+
+        target = positional[1] if len(positional) > 1 else "."
+        target_path, node = self._resolve_path(target)
+        if not node:
+            self.error(f"grep: {target}: Нет такого файла или директории")
+            return False
+        if node.type == "dir" and not recursive:
+            self.error(f"grep: {target}: Является директорией")
+            return False
+
+        # Как в grep: имя файла выводится, если просматривается директория
+        with_path = node.type == "dir"
+        line_numbers = "n" in flags
+        success = True
+        for path, item in candidate_files(self.vfs, node, target_path, query):
+            prefix = f"{path}:" if with_path else ""
+            try:
+                for number, line in query.search_lines(self.vfs.content_of(item)):
+                    self.echo(f"{prefix}{number}:{line}" if line_numbers else f"{prefix}{line}")
+            except OSError as e:
+                self.error(f"grep: {path}: ошибка чтения: {e}")
+                success = False
         return success
 
+    def du_command(self, args, original_input):
+        """Объем файлов директорий (итоги поддеревьев хранятся в узлах и не пересчитываются)"""
+        flags, positional = self._parse_flags("du", args, DU_FLAGS)
+        if flags is None:
+            return False
+        if len(positional) > 1:
+            self.error("du: слишком много аргументов")
+            self.error("Использование: du [-s] [-h] [путь]")
+            return False
+
+        target_path, node = self._resolve_path(positional[0] if positional else ".")
+        if not node:
+            self.error(f"du: {target_path}: Нет такого файла или директории")
+            return False
+
+        show = self._human_size if "h" in flags else str
+        if node.type == "file":
+            self.echo(f"{show(self.vfs.file_size(node))}\t{target_path}")
+            return True
+        if "s" in flags:
+            self.echo(f"{show(self.vfs.usage(node)[0])}\t{target_path}")
+            return True
+
+        # Как du: поддиректории перед родителем, итог по path - последней строкой
+        stack = [(target_path, node, False)]
+        while stack:
+            path, item, listed = stack.pop()
+            if listed:
+                self.echo(f"{show(self.vfs.usage(item)[0])}\t{path}")
+                continue
+            self.vfs.ensure_loaded(item)
+            stack.append((path, item, True))
+            prefix = path if path != "/" else ""
+            stack.extend((f"{prefix}/{child.name}", child, False)
+                         for child in reversed(item.children.values()) if child.type == "dir")
+        return True
+
+    def tree_command(self, args, original_input):
+        """Дерево директории с размерами; итоги - по всему поддереву"""
+        max_depth = None
+        positional = []
+        i = 0
+        while i < len(args):
+            if args[i] == "-L":
+                if i + 1 >= len(args):
+                    self.error("tree: отсутствует аргумент для '-L'")
+                    return False
+                try:
+                    max_depth = int(args[i + 1])
+                except ValueError:
+                    max_depth = 0
+                if max_depth < 1:
+                    self.error("tree: глубина -L должна быть положительным числом")
+                    return False
+                i += 2
+            else:
+                positional.append(args[i])
+                i += 1
+        if len(positional) > 1:
+            self.error("tree: слишком много аргументов")
+            self.error("Использование: tree [-L глубина] [путь]")
+            return False
+
+        target_path, node = self._resolve_path(positional[0] if positional else ".")
+        if not node or node.type != "dir":
+            self.error(f"tree: {target_path}: Нет такой директории")
+            return False
+
+        self.vfs.ensure_loaded(node)
+        self.echo(target_path)
+        # Стек уровней: [дети, индекс следующего, отступ]
+        stack = [[list(node.children.values()), 0, ""]]
+        while stack:
+            level = stack[-1]
+            children, index, indent = level
+            if index == len(children):
+                stack.pop()
+                continue
+            level[1] += 1
+            child = children[index]
+            last = index == len(children) - 1
+            if child.type == "dir":
+                label = f"[{self._human_size(self.vfs.usage(child)[0]):>5}]  {child.name}/"
+            else:
+                label = f"[{self._human_size(self.vfs.file_size(child)):>5}]  {child.name}"
+            self.echo(f"{indent}{'└── ' if last else '├── '}{label}")
+            if child.type == "dir" and (max_depth is None or len(stack) < max_depth):
+                self.vfs.ensure_loaded(child)
+                stack.append([list(child.children.values()), 0, indent + ("    " if last else "│   ")])
+
+        total, files, dirs = self.vfs.usage(node)
+        self.echo()
+        self.echo(f"Директорий: {dirs}, файлов: {files}, всего {self._human_size(total)} ({total} байт)")
+        return True
+
+    def _filter_command(self, command, args):
+        """Фильтр над файлами: строки файлов подряд (как вывод cat в конвейере)"""
+        try:
+            make_filter, paths = parse_filter(command, args)
+        except PipeError as e:
+            self.error(f"{command}: {e}")
+            return False
+        if not paths:
+            self.error(f"{command}: требуется файл (или вывод другой команды: команда | {command})")
+            return False
+
+        line_filter = make_filter(OutputLines(self.output))
+        success = True
+        for filename in paths:
+            _, node = self._resolve_path(filename)
+            if not node or node.type != "file":
+                self.error(f"{command}: {filename}: Нет такого файла")
+                success = False
+                continue
+            try:
+                # head прекращает чтение, получив нужное число строк
+                more = all(line_filter.feed(line) for line in iter_lines(self.vfs.content_of(node)))
+            except OSError as e:
+                self.error(f"{command}: {filename}: ошибка чтения: {e}")
+                success = False
+                continue
+            if not more:
+                break
+        line_filter.finish()
+        return success
+
+    def head_command(self, args, original_input):
+        """Первые N строк (по умолчанию 10): head [-n N] файл..."""
+        return self._filter_command("head", args)
+
+    def tail_command(self, args, original_input):
+        """Последние N строк (по умолчанию 10); в памяти - только N строк"""
+        return self._filter_command("tail", args)
+
+    def wc_command(self, args, original_input):
+        """Число строк, слов и байт: wc [-l] [-w] [-c] файл..."""
+        return self._filter_command("wc", args)
+
+    def sort_command(self, args, original_input):
+        """Сортировка строк: sort [-r] [-n] [-u] файл..."""
+        return self._filter_command("sort", args)
+
+    def uniq_command(self, args, original_input):
+        """Удаление повторяющихся подряд строк: uniq [-c] файл..."""
+        return self._filter_command("uniq", args)
+
     def conf_dump_command(self, args, original_input):
         if len(args) > 0:
-            print("conf-dump: слишком много аргументов")
+            self.error("conf-dump: слишком много аргументов")
             return False
 
-        print("=== Конфигурация VFS ===")
-        print(f"Имя VFS: {self.vfs_name}")
-        print(f"Текущий путь: {self.current_path}")
-        print(f"VFS путь: {self.vfs_path}")
-        print(f"Стартовый скрипт: {self.startup_script}")
-        print(f"Размер файловой системы: {len(self.filesystem)} объектов")
-        print("========================")
+        self.echo("=== Конфигурация VFS ===")
+        self.echo(f"Имя VFS: {self.vfs_name}")
+        self.echo(f"Текущий путь: {self.current_path}")
+        self.echo(f"VFS путь: {self.vfs_path}")
+        if self.image_path:
+            self.echo(f"Образ VFS: {self.image_path}")
+        self.echo(f"Стартовый скрипт: {self.startup_script}")
+        self.echo(f"Размер файловой системы: {self.vfs.node_count} объектов")
+        logical, files = self.vfs.content_usage()
+        physical = self.vfs.blobs.physical_bytes
+        line = (f"Содержимое в памяти: {logical} байт в {files} файлах, хранится {physical} байт "
+                f"в {len(self.vfs.blobs)} уникальных блоках")
+        if self.snapshots:
+            line += " (включая данные снимков)"
+        elif physical < logical:
+            line += f", экономия {100 * (1 - physical / logical):.0f}%"
+        self.echo(line)
+        if len(self.vfs.text_index):
+            self.echo(f"Индекс содержимого (grep): {len(self.vfs.text_index)} объектов, "
+                      f"{self.vfs.text_index.trigram_count} триграмм")
+        if self.snapshots:
+            self.echo(f"Снимков: {len(self.snapshots)} ({', '.join(self.snapshots)})")
+        if self.lazy and self.vfs_path:
+            self.echo("Режим загрузки: ленивый (учитываются только прочитанные объекты)")
+        self.echo("========================")
         return True
 
     def list_scripts_command(self, args, original_input):
         if len(args) > 0:
-            print("list-scripts: слишком много аргументов")
+            self.error("list-scripts: слишком много аргументов")
             return False
 
-        print("Доступные скрипты (*.txt):")
-        print("-" * 40)
+        self.echo("Доступные скрипты (*.txt):")
+        self.echo("-" * 40)
 
         scripts = [f for f in os.listdir('.') if f.endswith('.txt')]
         if scripts:
             for i, script in enumerate(scripts, 1):
-                print(f"  {i}. {script}")
+                self.echo(f"  {i}. {script}")
         else:
-            print("  Скрипты не найдены")
-            print("  Создайте .txt файлы с командами в этой папке")
+            self.echo("  Скрипты не найдены")
+            self.echo("  Создайте .txt файлы с командами в этой папке")
 
-        print("-" * 40)
+        self.echo("-" * 40)
         return True
 
     def run_script_command(self, args, original_input):
         if len(args) != 1:
-            print("run-script: требуется ровно 1 аргумент - имя скрипта")
-            print("Использование: run-script имя_файла.txt")
-            print("Используйте 'list-scripts' чтобы увидеть доступные скрипты")
+            self.error("run-script: требуется ровно 1 аргумент - имя скрипта")
+            self.error("Использование: run-script имя_файла.txt")
+            self.error("Используйте 'list-scripts' чтобы увидеть доступные скрипты")
             return False
 
         script_file = args[0]
@@ -379,118 +1087,391 @@ class VFSEmulator:
         return self.execute_script_file(script_file)
 
     def execute_script_file(self, script_file):
+        # Профилировщик подключается только к одному (ближайшему) запуску скрипта
+        profiler, self.script_profiler = self.script_profiler, None
+        if profiler is None:
+            return self._execute_script_file(script_file)
+        with profiler(script_file):
+            return self._execute_script_file(script_file)
+
+    def _execute_script_file(self, script_file):
+        self.last_script_counts = (0, 0)
         if not os.path.exists(script_file):
-            print(f"Ошибка: скрипт '{script_file}' не найден")
-            print("Используйте 'list-scripts' чтобы увидеть доступные скрипты")
+            self.error(f"Ошибка: скрипт '{script_file}' не найден")
+            self.error("Используйте 'list-scripts' чтобы увидеть доступные скрипты")
             return False
 
-        print(f"Выполнение скрипта: {script_file}")
-        print("=" * 50)
+        self.echo(f"Выполнение скрипта: {script_file}")
+        self.echo("=" * 50)
 
         try:
-            with open(script_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
+            # Скрипт разбирается один раз, команды сразу связываются с обработчиками
+            steps = compile_script(script_file)
+            program = [(step, self.commands.get(step.command)) for step in steps]
 
             success_count = 0
             error_count = 0
 
-            for line_num, line in enumerate(lines, 1):
-                line = line.strip()
+            for step, handler in program:
+                line_num = step.line_num
 
-                if not line:
-                    continue
-                if line.startswith('#'):
-                    print(f"# {line[1:].strip()}")
+                if step.kind == STEP_COMMENT:
+                    self.echo(f"# {step.line}")
                     continue
 
-                print(f"[Строка {line_num}] {self.vfs_name}:{self.current_path}$ {line}")
+                line = step.line
+                self.echo(f"[Строка {line_num}] {self.vfs_name}:{self.current_path}$ {line}")
 
-                command, args = self.parse_input(line)
-
-                if command:
-                    success = self.execute_command(command, args, line)
+                if step.kind == STEP_COMMAND:
+                    if step.filters:
+                        success = self.execute_pipeline(step.command, step.args, step.filters, line)
+                    else:
+                        success = self._invoke(handler, step.command, step.args, line)
                     if success:
                         success_count += 1
                     else:
                         error_count += 1
-                        print(f"ОШИБКА в строке {line_num}")
+                        self.error(f"ОШИБКА в строке {line_num}")
                 else:
+                    self.error(f"Ошибка парсинга: {step.args[0]}")
                     error_count += 1
-                    print(f"ОШИБКА: Не удалось разобрать команду в строке {line_num}")
+                    self.error(f"ОШИБКА: Не удалось разобрать команду в строке {line_num}")
 
-                print()
+                self.echo()
 
-            print("=" * 50)
-            print(f"Скрипт '{script_file}' выполнен:")
-            print(f"  Успешных команд: {success_count}")
-            print(f"  Ошибочных команд: {error_count}")
+            self.output.summary("=" * 50)
+            self.output.summary(f"Скрипт '{script_file}' выполнен:")
+            self.output.summary(f"  Успешных команд: {success_count}")
+            self.output.summary(f"  Ошибочных команд: {error_count}")
 
+            self.last_script_counts = (success_count, error_count)
             return error_count == 0
 
         except Exception as e:
-            print(f"Критическая ошибка выполнения скрипта: {e}")
+            self.error(f"Критическая ошибка выполнения скрипта: {e}")
             return False
 
     def pwd_command(self, args, original_input):
         if len(args) > 0:
-            print("pwd: слишком много аргументов")
+            self.error("pwd: слишком много аргументов")
             return False
 
-        print(self.current_path)
+        self.echo(self.current_path)
         return True
 
+    def _split_new_path(self, name):
+        """Путь родительской директории, сама директория и имя для создаваемого узла"""
+        new_path = self._normalize_path(name)
+        parent_path, _, base_name = new_path.rpartition("/")
+        parent_path = parent_path or "/"
+        _, parent = self._resolve_path(parent_path)
+        if not parent or parent.type != "dir" or not base_name:
+            return parent_path, None, base_name
+        self.vfs.ensure_loaded(parent)
+        return parent_path, parent, base_name
+
     def mkdir_command(self, args, original_input):
         if len(args) != 1:
-            print("mkdir: требуется ровно 1 аргумент - имя директории")
+            self.error("mkdir: требуется ровно 1 аргумент - имя директории")
             return False
 
         dir_name = args[0]
-        new_path = f"{self.current_path}/{dir_name}" if self.current_path != "/" else f"/{dir_name}"
+        parent_path, parent, base_name = self._split_new_path(dir_name)
 
-        if new_path in self.filesystem:
-            print(f"mkdir: невозможно создать директорию '{dir_name}': Файл существует")
+        if parent is None:
+            self.error(f"mkdir: невозможно создать директорию '{dir_name}': Нет такой директории")
             return False
 
-        self.filesystem[new_path] = {"type": "dir", "children": []}
+        if base_name in parent.children:
+            self.error(f"mkdir: невозможно создать директорию '{dir_name}': Файл существует")
+            return False
 
-        parent = self.current_path if self.current_path != "/" else "/"
-        if parent in self.filesystem:
-            self.filesystem[parent]["children"].append(dir_name)
+        # Директория копируется, если она общая со снимком
+        self.vfs.add_dir(self.vfs.resolve(parent_path, for_write=True), base_name)
+        self.log_change({"op": "mkdir", "path": f"{parent_path.rstrip('/')}/{base_name}"})
 
-        print(f"Директория '{dir_name}' создана")
+        self.echo(f"Директория '{dir_name}' создана")
         return True
 
     def touch_command(self, args, original_input):
         if len(args) != 1:
-            print("touch: требуется ровно 1 аргумент - имя файла")
+            self.error("touch: требуется ровно 1 аргумент - имя файла")
             return False
 
         file_name = args[0]
-        file_path = f"{self.current_path}/{file_name}" if self.current_path != "/" else f"/{file_name}"
+        parent_path, parent, base_name = self._split_new_path(file_name)
+
+        if parent is None:
+            self.error(f"touch: невозможно создать '{file_name}': Нет такой директории")
+            return False
 
-        if file_path in self.filesystem:
-            print(f"Файл '{file_name}' уже существует")
+        if base_name in parent.children:
+            self.echo(f"Файл '{file_name}' уже существует")
             return True
 
-        self.filesystem[file_path] = {"type": "file", "content": ""}
+        self.vfs.add_file(self.vfs.resolve(parent_path, for_write=True), base_name)
+        self.log_change({"op": "touch", "path": f"{parent_path.rstrip('/')}/{base_name}"})
 
-        parent = self.current_path if self.current_path != "/" else "/"
-        if parent in self.filesystem:
-            self.filesystem[parent]["children"].append(file_name)
+        self.echo(f"Файл '{file_name}' создан")
+        return True
+
+    def mv_command(self, args, original_input):
+        """Перемещение/переименование файла или директории"""
+        if len(args) != 2:
+            self.error("mv: требуется ровно 2 аргумента")
+            self.error("Использование: mv источник назначение")
+            return False
 
-        print(f"Файл '{file_name}' создан")
+        source, target = args
+        source_path, node = self._resolve_path(source)
+        if not node or node is self.vfs.root:
+            self.error(f"mv: невозможно переместить '{source}': Нет такого файла или директории")
+            return False
+
+        target_path, destination = self._resolve_path(target)
+        if destination and destination.type == "dir":
+            # Перемещение внутрь существующей директории с прежним именем
+            new_parent_path, new_parent, new_name = target_path, destination, node.name
+            self.vfs.ensure_loaded(new_parent)
+        else:
+            new_parent_path, new_parent, new_name = self._split_new_path(target)
+            if new_parent is None:
+                self.error(f"mv: невозможно переместить в '{target}': Нет такой директории")
+                return False
+
+        # Пути канонические (без '.', '..' и повторных '/'), их можно сравнивать как строки
+        if f"{new_parent_path.rstrip('/')}/".startswith(f"{source_path}/"):
+            self.error(f"mv: невозможно переместить '{source}' в собственную поддиректорию")
+            return False
+
+        if new_name in new_parent.children and new_parent.children[new_name] is not node:
+            self.error(f"mv: '{target}': Файл существует")
+            return False
+
+        self.vfs.move(source_path, new_parent_path, new_name)
+        self.log_change({"op": "mv", "path": source_path, "to": new_parent_path, "name": new_name})
+        # Текущая директория могла переехать вместе с поддеревом
+        if self.current_path == source_path or self.current_path.startswith(f"{source_path}/"):
+            new_path = f"{new_parent_path.rstrip('/')}/{new_name}"
+            self.current_path = new_path + self.current_path[len(source_path):]
+        return True
+
+    def save_image_command(self, args, original_input):
+        if len(args) != 1:
+            self.error("save-image: требуется ровно 1 аргумент - имя файла образа")
+            return False
+        return self.save_vfs_image(args[0])
+
+    def load_image_command(self, args, original_input):
+        if len(args) != 1:
+            self.error("load-image: требуется ровно 1 аргумент - имя файла образа")
+            return False
+        if not os.path.exists(args[0]):
+            self.error(f"load-image: {args[0]}: Нет такого файла")
+            return False
+        if not self.load_vfs_from_image(args[0]):
+            return False
+        self.checkpoint_journal()
+        return True
+
+    def snapshot_command(self, args, original_input):
+        """Снимок текущего состояния VFS (копирование при записи, O(1))"""
+        if not args:
+            if not self.snapshots:
+                self.echo("Снимков нет")
+            for name, snapshot in self.snapshots.items():
+                self.echo(f"  {name} ({snapshot.node_count} объектов)")
+            return True
+        if len(args) != 1:
+            self.error("snapshot: требуется не больше 1 аргумента - имя снимка")
+            return False
+
+        self.snapshots[args[0]] = self.vfs.snapshot()
+        self.echo(f"Снимок '{args[0]}' создан ({self.vfs.node_count} объектов)")
+        return True
+
+    def _get_snapshot(self, command, args):
+        if len(args) != 1:
+            self.error(f"{command}: требуется ровно 1 аргумент - имя снимка")
+            return None
+        snapshot = self.snapshots.get(args[0])
+        if snapshot is None:
+            self.error(f"{command}: снимок '{args[0]}' не найден")
+        return snapshot
+
+    def restore_command(self, args, original_input):
+        snapshot = self._get_snapshot("restore", args)
+        if snapshot is None:
+            return False
+
+        self.vfs.restore(snapshot)
+        node = self.vfs.resolve(self.current_path)
+        if node is None or node.type != "dir":
+            self.current_path = "/"
+        # Снимки не попадают в журнал: восстановленное дерево сохраняется целиком (данные диска - ссылками)
+        self.checkpoint_journal()
+        self.echo(f"VFS восстановлена из снимка '{args[0]}'")
+        return True
+
+    def diff_command(self, args, original_input):
+        snapshot = self._get_snapshot("diff", args)
+        if snapshot is None:
+            return False
+
+        changes = self.vfs.diff(snapshot)
+        self.echo(f"Изменения относительно снимка '{args[0]}':")
+        for kind, path, node, old_path in changes:
+            suffix = "/" if node.type == "dir" else ""
+            if kind == ">":
+                self.echo(f"  > {old_path}{suffix} -> {path}{suffix}")
+            else:
+                self.echo(f"  {kind} {path}{suffix}")
+        self.echo(f"Всего изменений: {len(changes)}")
+        return True
+
+    def resync_vfs(self, full=False, guard=None):
+        """Синхронизация с директорией --vfs-path; None - VFS загружена не из директории
+
+        guard - command_guard, если команды могут выполняться параллельно (--watch,
+        сервер): диск проверяется по снимку дерева без блокировки, а она берется
+        только на снимок и на применение изменений.
+        """
+        lock = guard if guard is not None else (lambda command: contextlib.nullcontext())
+        with lock("reload"):
+            host_root = self.host_root
+            if host_root is None:
+                return None
+            tree = self.vfs
+            # Снимок нужен, только если дерево могут менять во время проверки
+            root = tree.snapshot().root if guard is not None else tree.root
+        changes = scan_host_changes(root, host_root, full, self.scan_workers, report=self.error)
+        if not changes:
+            return changes.stats
+        with lock("reload"):
+            if self.vfs is not tree:
+                # Дерево заменено во время проверки (load-image): изменения относятся к прежнему
+                return changes.stats
+            # Изменения с диска не пишутся в журнал: при запуске контрольная точка синхронизируется с диском
+            stats = apply_host_changes(tree, changes, self.lazy, self.scan_workers, report=self.error)
+            node = self.vfs.resolve(self.current_path)
+            if node is None or node.type != "dir":
+                self.current_path = "/"
+        return stats
+
+    def reload_command(self, args, original_input):
+        """Применение изменений с диска: перечитываются только изменившиеся директории"""
+        if args not in ([], ["--full"]):
+            self.error("reload: неверные аргументы")
+            self.error("Использование: reload [--full]")
+            return False
+
+        # Без блокировки команд (vfs_server.UNGUARDED_COMMANDS): resync_vfs берет ее сама на время изменений
+        stats = self.resync_vfs(full=bool(args), guard=self.command_guard)
+        if stats is None:
+            self.error("reload: VFS загружена не из директории на диске (--vfs-path)")
+            return False
+        self.echo(f"VFS синхронизирована с '{self.vfs_path}': {stats.summary()}")
+        return True
+
+    def checkpoint_command(self, args, original_input):
+        """Принудительное сжатие журнала изменений в контрольную точку"""
+        if args:
+            self.error("checkpoint: команда не принимает аргументов")
+            return False
+        if self.journal is None:
+            self.error("checkpoint: журнал изменений не включен (--journal)")
+            return False
+        records = self.journal.records_since_checkpoint
+        count = self.checkpoint_journal()
+        if count is None:
+            return False
+        self.echo(f"Контрольная точка '{self.journal.checkpoint_path}' создана ({count} объектов), "
+                  f"из журнала убрано записей: {records}")
+        return True
+
+    def stats_command(self, args, original_input):
+        """Статистика команд: вызовы, ошибки, задержки (p50/p95/p99)"""
+        if args == ["reset"]:
+            self.stats.reset()
+            self.echo("Статистика команд сброшена")
+            return True
+        if args:
+            self.error("stats: неверные аргументы")
+            self.error("Использование: stats [reset]")
+            return False
+
+        report = self.stats.to_dict(self.vfs.node_count)
+        vfs = report["vfs"]
+        self.echo("=== Статистика ===")
+        if vfs["load_s"] is not None:
+            self.echo(f"Загрузка VFS ({vfs['source']}): {vfs['load_s'] * 1000:.1f} мс, "
+                      f"{vfs['loaded_nodes']} объектов")
+        self.echo(f"Объектов в VFS сейчас: {vfs['nodes']}")
+        self.echo(f"Кеш путей: {len(self.paths)} записей, попаданий {self.paths.hits}, промахов {self.paths.misses}")
+        self.echo(f"{'команда':<14} {'вызовы':>7} {'ошибки':>7} {'p50, мс':>9} {'p95, мс':>9} "
+                  f"{'p99, мс':>9} {'макс, мс':>9}")
+        for name, item in report["commands"].items():
+            self.echo(f"{name:<14} {item['calls']:>7} {item['errors']:>7} {item['p50_s'] * 1000:>9.3f} "
+                      f"{item['p95_s'] * 1000:>9.3f} {item['p99_s'] * 1000:>9.3f} {item['max_s'] * 1000:>9.3f}")
+        self.echo("==================")
+        return True
+
+    def mem_command(self, args, original_input):
+        """Отчет о памяти: структура дерева по категориям, данные файлов, индексы, процесс"""
+        if args:
+            self.error("mem: команда не принимает аргументов")
+            return False
+
+        usage = self.vfs.memory_usage()
+        nodes = usage["dirs"] + usage["files"]
+        rows = [
+            ("Узлы", usage["nodes"]),
+            ("Словари детей", usage["children"]),
+            (f"Имена ({usage['unique_names']} уникальных)", usage["names"]),
+            ("Отметки и итоги", usage["stamps"]),
+            ("Объекты содержимого", usage["contents"]),
+            ("Индекс имен", usage["name_index"]),
+        ]
+        total = sum(size for label, size in rows)
+        self.echo("=== Память VFS ===")
+        self.echo(f"Объектов в памяти: {nodes} (директорий: {usage['dirs']}, файлов: {usage['files']})")
+        for label, size in rows:
+            self.echo(f"  {label:<28} {self._human_size(size):>7}")
+        self.echo(f"  {'Итого структура':<28} {self._human_size(total):>7} ({total / max(nodes, 1):.0f} байт на объект)")
+        self.echo(f"Данные файлов в памяти: {self._human_size(self.vfs.blobs.physical_bytes)} "
+                  f"в {len(self.vfs.blobs)} уникальных блоках")
+        if len(self.vfs.text_index):
+            self.echo(f"Индекс содержимого (grep): {self._human_size(self.vfs.text_index.memory_bytes())}")
+        rss = process_memory()
+        if rss is not None:
+            self.echo(f"Память процесса (RSS): {self._human_size(rss)}")
+        if self.snapshots:
+            self.echo("Узлы, которые есть только в снимках, не учитываются")
+        if self.vfs.unloaded_dirs:
+            self.echo(f"Не прочитано директорий: {self.vfs.unloaded_dirs} (учитывается только прочитанная часть)")
+        self.echo("==================")
+        return True
+
+    def dump_stats_json(self, path):
+        """Сохранение статистики в JSON (--stats-json)"""
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.stats.to_dict(self.vfs.node_count), f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            self.error(f"Ошибка: не удалось сохранить статистику в '{path}': {e}")
+            return False
         return True
 
     def history_command(self, args, original_input):
         if len(args) > 0:
-            print("history: слишком много аргументов")
+            self.error("history: слишком много аргументов")
             return False
 
-        print("История команд:")
-        print("-" * 40)
+        self.echo("История команд:")
+        self.echo("-" * 40)
         for i, cmd in enumerate(self.command_history[-10:], 1):
-            print(f"  {i:2d}. {cmd}")
-        print("-" * 40)
+            self.echo(f"  {i:2d}. {cmd}")
+        self.echo("-" * 40)
         return True
 
     def execute_startup_script(self):
@@ -501,43 +1482,57 @@ class VFSEmulator:
             self.startup_script += '.txt'
 
         if not os.path.exists(self.startup_script):
-            print(f"Ошибка: стартовый скрипт '{self.startup_script}' не найден")
+            self.error(f"Ошибка: стартовый скрипт '{self.startup_script}' не найден")
             return False
 
-        print(f"Запуск стартового скрипта: {self.startup_script}")
+        self.echo(f"Запуск стартового скрипта: {self.startup_script}")
         return self.execute_script_file(self.startup_script)
 
+    def print_welcome(self):
+        self.echo("Эмулятор VFS запущен")
+        self.echo(
+            "Доступные команды: ls, cd, pwd, mkdir, touch, mv, history, conf-dump, run-script, list-scripts, cat, find, tac, "
+            "grep, du, tree, head, tail, wc, sort, uniq, save-image, load-image, stats, mem, snapshot, restore, diff, reload, "
+            "checkpoint, exit")
+        self.echo("Используйте 'list-scripts' чтобы увидеть доступные .txt скрипты")
+        self.echo("Используйте 'run-script имя_файла' для запуска скрипта")
+        self.echo("Вывод команды можно передать фильтрам: find log / | sort | head -5")
+        self.echo("=" * 60)
+
+    def execute_line(self, user_input):
+        """Выполнение одной введенной строки (интерактивный режим и сеансы сервера)"""
+        user_input = user_input.strip()
+        if not user_input:
+            return None
+
+        stages = self.parse_input(user_input)
+        if not stages:
+            return False
+        (command, args), filters = stages[0], stages[1:]
+        success = self.execute_command(command, args, user_input, filters)
+        self.echo()
+        return success
+
     def run(self):
         if self.startup_script:
             if not self.execute_startup_script():
-                print("Не удалось выполнить стартовый скрипт")
+                self.error("Не удалось выполнить стартовый скрипт")
                 return
 
-        print("Эмулятор VFS запущен")
-        print(
-            "Доступные команды: ls, cd, pwd, mkdir, touch, history, conf-dump, run-script, list-scripts, cat, find, tac, exit")
-        print("Используйте 'list-scripts' чтобы увидеть доступные .txt скрипты")
-        print("Используйте 'run-script имя_файла' для запуска скрипта")
-        print("=" * 60)
+        self.print_welcome()
 
         while self.running:
             try:
                 self.print_prompt()
-                user_input = input().strip()
-
-                if not user_input:
-                    continue
-
-                command, args = self.parse_input(user_input)
-                if command:
-                    self.execute_command(command, args, user_input)
-                    print()
+                self.execute_line(input())
 
             except (EOFError, KeyboardInterrupt):
-                print("\nВыход из эмулятора VFS...")
+                self.echo("\nВыход из эмулятора VFS...")
                 break
             except Exception as e:
-                print(f"Неожиданная ошибка: {e}")
+                self.error(f"Неожиданная ошибка: {e}")
+
+        self.output.flush()
 
 
 def main():
@@ -551,17 +1546,66 @@ def main():
   python vfs_emulator.py --run-script test.txt             # Выполнить скрипт
   python vfs_emulator.py --startup-script auto.txt         # Автозапуск скрипта
   python vfs_emulator.py --vfs-path ./test_vfs --run-script setup.txt
+  python vfs_emulator.py --vfs-path ./test_vfs --save-image vfs.img --run-script setup.txt
+  python vfs_emulator.py --vfs-path fixtures.tar.gz --run-script setup.txt
+  python vfs_emulator.py --load-image vfs.img --run-script setup.txt
         '''
     )
 
-    parser.add_argument('--vfs-path', help='Путь к VFS (директория для загрузки)')
+    parser.add_argument('--vfs-path', help='Путь к VFS (директория или архив tar/zip для загрузки)')
+    parser.add_argument('--lazy', action='store_true',
+                        help='Ленивая загрузка --vfs-path: директории и файлы читаются по требованию')
+    parser.add_argument('--scan-workers', type=int, metavar='N',
+                        help='Число потоков для полной загрузки --vfs-path (по умолчанию - по числу CPU)')
+    parser.add_argument('--load-image', help='Загрузить VFS из бинарного образа (вместо --vfs-path)')
+    parser.add_argument('--save-image', help='Сохранить загруженную VFS в бинарный образ')
     parser.add_argument('--startup-script', help='Стартовый скрипт (txt файл)')
     parser.add_argument('--run-script', help='Запустить конкретный скрипт и выйти')
+    parser.add_argument('--run-scripts', metavar='ШАБЛОН',
+                        help='Выполнить все скрипты по шаблону (например, "tests/*.txt") параллельно и выйти')
+    parser.add_argument('--jobs', type=int, metavar='N',
+                        help='Число процессов для --run-scripts (по умолчанию - по числу CPU)')
     parser.add_argument('--list-scripts', action='store_true',
                         help='Показать доступные скрипты и выйти')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Тихий режим: выводить только ошибки и итоги скриптов')
+    parser.add_argument('--output', metavar='ФАЙЛ', help='Записывать вывод команд в файл')
+    parser.add_argument('--watch', type=float, metavar='СЕКУНДЫ',
+                        help='Синхронизировать VFS с --vfs-path каждые СЕКУНДЫ (интерактивный режим и --serve)')
+    parser.add_argument('--serve', metavar='АДРЕС',
+                        help='Режим сервера: сеансы по сокету (хост:порт или путь к Unix-сокету) над одной VFS')
+    parser.add_argument('--serve-workers', type=int, metavar='N',
+                        help='Число потоков для выполнения команд сеансов (по умолчанию - по числу CPU)')
+    parser.add_argument('--journal', metavar='ФАЙЛ',
+                        help='Журнал изменений VFS: при запуске применяется к контрольной точке, новые изменения '
+                             'дописываются')
+    parser.add_argument('--journal-sync', choices=SYNC_MODES, default='batch',
+                        help='Сброс журнала на диск: always - каждая запись, batch - пачками (по умолчанию), '
+                             'none - без fsync')
+    parser.add_argument('--checkpoint-every', type=int, metavar='N', default=DEFAULT_CHECKPOINT_EVERY,
+                        help=f'Сжимать журнал в контрольную точку каждые N записей (0 - только командой '
+                             f'checkpoint; по умолчанию {DEFAULT_CHECKPOINT_EVERY})')
+    parser.add_argument('--stats-json', metavar='ФАЙЛ', help='Сохранить статистику команд в JSON при выходе')
+    parser.add_argument('--profile', metavar='ФАЙЛ',
+                        help='Профилировать запуск --run-script через cProfile (результат - файл pstats)')
 
     args = parser.parse_args()
 
+    if args.scan_workers is not None and args.scan_workers < 1:
+        parser.error("--scan-workers должно быть не меньше 1")
+    if args.serve_workers is not None and args.serve_workers < 1:
+        parser.error("--serve-workers должно быть не меньше 1")
+    if args.watch is not None and args.watch <= 0:
+        parser.error("--watch должно быть больше 0")
+    if args.watch is not None and (not args.vfs_path or not os.path.isdir(args.vfs_path)):
+        parser.error("--watch требует --vfs-path с директорией")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs должно быть не меньше 1")
+    if args.checkpoint_every < 0:
+        parser.error("--checkpoint-every должно быть не меньше 0")
+    if args.run_script and args.run_scripts:
+        parser.error("--run-script и --run-scripts нельзя использовать вместе")
+
     if args.list_scripts:
         scripts = [f for f in os.listdir('.') if f.endswith('.txt')]
         print("Доступные скрипты (*.txt) в текущей директории:")
@@ -576,17 +1620,79 @@ def main():
         print("=" * 50)
         return
 
-    if args.run_script:
-        emulator = VFSEmulator(vfs_path=args.vfs_path)
-        success = emulator.execute_script_file(args.run_script)
-        sys.exit(0 if success else 1)
-
-    emulator = VFSEmulator(
-        vfs_path=args.vfs_path,
-        startup_script=args.startup_script
-    )
-    emulator.run()
-
+    try:
+        output = open_output(args.output, quiet=args.quiet)
+    except OSError as e:
+        parser.error(f"не удалось открыть файл вывода '{args.output}': {e}")
+
+    journal = None
+    if args.journal:
+        journal = Journal(args.journal, sync=args.journal_sync, checkpoint_every=args.checkpoint_every)
+
+    emulator = None
+    try:
+        if args.run_script:
+            emulator = VFSEmulator(vfs_path=args.vfs_path, lazy=args.lazy, image_path=args.load_image,
+                                   scan_workers=args.scan_workers, output=output, journal=journal)
+            if args.save_image and not emulator.save_vfs_image(args.save_image):
+                sys.exit(1)
+            if args.profile:
+                emulator.script_profiler = cprofile_hook(args.profile)
+            success = emulator.execute_script_file(args.run_script)
+            sys.exit(0 if success else 1)
+
+        if args.run_scripts:
+            scripts = find_scripts(args.run_scripts)
+            if not scripts:
+                output.error(f"Ошибка: нет скриптов по шаблону '{args.run_scripts}'")
+                sys.exit(1)
+            emulator = VFSEmulator(vfs_path=args.vfs_path, lazy=args.lazy, image_path=args.load_image,
+                                   scan_workers=args.scan_workers, output=output, journal=journal)
+            if args.save_image and not emulator.save_vfs_image(args.save_image):
+                sys.exit(1)
+            success = run_scripts(emulator, scripts, args.jobs, quiet=args.quiet)
+            sys.exit(0 if success else 1)
+
+        if args.serve:
+            emulator = VFSEmulator(vfs_path=args.vfs_path, startup_script=args.startup_script, lazy=args.lazy,
+                                   image_path=args.load_image, scan_workers=args.scan_workers, output=output,
+                                   journal=journal)
+            if args.save_image and not emulator.save_vfs_image(args.save_image):
+                sys.exit(1)
+            # Стартовый скрипт выполняется один раз над общим деревом до приема соединений
+            if args.startup_script and not emulator.execute_startup_script():
+                sys.exit(1)
+            server = VFSServer(emulator, args.serve, args.serve_workers)
+            if args.watch and emulator.host_root is None:
+                output.error("Предупреждение: --watch не действует: VFS загружена не из директории на диске")
+            if args.watch:
+                HostWatcher(emulator, args.watch, server.lock.guard).start()
+            server.run()
+            return
+
+        emulator = VFSEmulator(
+            vfs_path=args.vfs_path,
+            startup_script=args.startup_script,
+            lazy=args.lazy,
+            image_path=args.load_image,
+            scan_workers=args.scan_workers,
+            output=output,
+            journal=journal
+        )
+        if args.save_image and not emulator.save_vfs_image(args.save_image):
+            sys.exit(1)
+        if args.watch and emulator.host_root is None:
+            output.error("Предупреждение: --watch не действует: VFS загружена не из директории на диске")
+        if args.watch:
+            emulator.command_guard = exclusive_guard()
+            HostWatcher(emulator, args.watch, emulator.command_guard).start()
+        emulator.run()
+    finally:
+        if emulator is not None and args.stats_json:
+            emulator.dump_stats_json(args.stats_json)
+        if journal is not None:
+            journal.close()
+        output.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""Проверка find: обход только поддерева, фильтры и поиск по индексу имен
+
+Запуск: python -m unittest test_vfs_find  (или python -m pytest)
+"""
+import io
+import unittest
+
+from main import VFSEmulator
+from vfs_output import OutputSink
+from vfs_tree import VFSTree
+
+TREE = {
+    "/": {"type": "dir", "children": ["home", "homework", "log"]},
+    "/home": {"type": "dir", "children": ["notes.txt", "src"]},
+    "/home/notes.txt": {"type": "file", "content": "short"},
+    "/home/src": {"type": "dir", "children": ["main.py", "notes.txt"]},
+    "/home/src/main.py": {"type": "file", "content": "print('hello, world')\n" * 10},
+    "/home/src/notes.txt": {"type": "file", "content": ""},
+    "/homework": {"type": "dir", "children": ["task.txt"]},
+    "/homework/task.txt": {"type": "file", "content": "2 + 2"},
+    "/log": {"type": "dir", "children": []},
+}
+
+
+class FindTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.emulator = VFSEmulator(vfs=VFSTree.from_paths(TREE), output=OutputSink(self.stream))
+
+    def find(self, line):
+        """Найденные пути (без заголовка) в порядке вывода"""
+        self.stream.seek(0)
+        self.stream.truncate()
+        self.assertTrue(self.emulator.execute_line(line), line)
+        self.emulator.output.flush()
+        return [line.split()[0] for line in self.stream.getvalue().splitlines() if line.startswith("  /")]
+
+    def test_start_path_does_not_match_sibling_prefix(self):
+        self.assertEqual(sorted(self.find("find /home -name *.txt")), ["/home/notes.txt", "/home/src/notes.txt"])
+        self.assertEqual(self.find("find task /home"), [])
+        self.assertEqual(self.find("find task /homework"), ["/homework/task.txt"])
+
+    def test_filters(self):
+        self.assertEqual(self.find("find / -type d -maxdepth 1"), ["/", "/home", "/homework", "/log"])
+        self.assertEqual(self.find("find / -regex .*/src/.*[.]py"), ["/home/src/main.py"])
+        self.assertEqual(self.find("find / -type f -size +100c"), ["/home/src/main.py"])
+        self.assertEqual(self.find("find / -type f -size 0"), ["/home/src/notes.txt"])
+        self.assertEqual(self.find("find /home -name notes.txt -maxdepth 1"), ["/home/notes.txt"])
+
+    def test_index_follows_changes(self):
+        self.assertTrue(self.emulator.execute_line("touch /log/notes.txt"))
+        self.assertTrue(self.emulator.execute_line("mv /home/src /homework"))
+        self.assertEqual(sorted(self.find("find / -name notes.txt")),
+                         ["/home/notes.txt", "/homework/src/notes.txt", "/log/notes.txt"])
+        self.assertEqual(self.find("find main /home"), [])
+        self.assertEqual(self.find("find main /"), ["/homework/src/main.py"])
+
+    def test_errors(self):
+        self.assertFalse(self.emulator.execute_line("find / -type x"))
+        self.assertFalse(self.emulator.execute_line("find / -regex ("))
+        self.assertFalse(self.emulator.execute_line("find x /nope"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+"""Проверка fork и снимков: версии дерева с общими (в том числе ленивыми) узлами не мешают друг другу
+
+Запуск: python -m unittest test_vfs_fork  (или python -m pytest)
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from main import VFSEmulator
+from vfs_image import save_image
+from vfs_output import OutputSink
+
+
+def _make_host(root):
+    os.makedirs(os.path.join(root, "a", "b"))
+    for name, text in (("a/f1.txt", "one\n"), ("a/b/noeol", "two")):
+        with open(os.path.join(root, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+class ForkLazyTest(unittest.TestCase):
+    """Директория, прочитанная через одну версию, не ломает индекс имен другой"""
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix="vfs_fork_test_")
+        self.host = os.path.join(self.work, "host")
+        _make_host(self.host)
+
+    def tearDown(self):
+        shutil.rmtree(self.work, ignore_errors=True)
+
+    def _emulator(self):
+        return VFSEmulator(vfs_path=self.host, lazy=True, output=OutputSink(io.StringIO()))
+
+    def _found(self, emulator, pattern):
+        return sorted(path for path, node in emulator.vfs.find(emulator.vfs.root, "/", glob=pattern))
+
+    def _check_isolation(self, emulator):
+        self.assertTrue(emulator.execute_line("ls /"))
+        fork = emulator.fork()
+        self.assertTrue(fork.execute_line("ls /a"))
+
+        self.assertTrue(emulator.execute_line("mv /a/f1.txt /moved.txt"))
+        self.assertTrue(emulator.execute_line("touch /a/b/zz"))
+        self.assertEqual(self._found(emulator, "*"), ["/a", "/a/b", "/a/b/noeol", "/a/b/zz", "/moved.txt"])
+        self.assertEqual(self._found(fork, "*"), ["/a", "/a/b", "/a/b/noeol", "/a/f1.txt"])
+
+        self.assertTrue(fork.execute_line("mv /a/b /b2"))
+        self.assertEqual(self._found(fork, "*"), ["/a", "/a/f1.txt", "/b2", "/b2/noeol"])
+        self.assertEqual(self._found(emulator, "no*"), ["/a/b/noeol"])
+        self.assertEqual(emulator.vfs.node_count, 6)
+        self.assertEqual(fork.vfs.node_count, 5)
+
+    def test_lazy_host_directory(self):
+        self._check_isolation(self._emulator())
+
+    def test_image(self):
+        image = os.path.join(self.work, "vfs.img")
+        save_image(self._emulator().vfs, image)
+        self._check_isolation(VFSEmulator(image_path=image, output=OutputSink(io.StringIO())))
+
+    def test_fork_changes_stay_in_fork(self):
+        emulator = self._emulator()
+        fork = emulator.fork()
+        self.assertTrue(fork.execute_line("mkdir /a/new"))
+        self.assertTrue(fork.execute_line("mv /a/f1.txt /a/new"))
+        self.assertIsNone(emulator.vfs.resolve("/a/new"))
+        self.assertIsNotNone(emulator.vfs.resolve("/a/f1.txt"))
+        self.assertIsNotNone(fork.vfs.resolve("/a/new/f1.txt"))
+
+
+class SnapshotCommandsTest(unittest.TestCase):
+    """snapshot/restore/diff на стандартной VFS: снимок не меняется вместе с деревом"""
+
+    def test_diff_and_restore(self):
+        stream = io.StringIO()
+        emulator = VFSEmulator(output=OutputSink(stream))
+        for line in ("snapshot base", "mkdir /tmp/new", "mv /etc/hosts /tmp/new", "cd /tmp/new"):
+            self.assertTrue(emulator.execute_line(line), line)
+
+        self.assertEqual([kind for kind, path, node, old_path in emulator.vfs.diff(emulator.snapshots["base"])],
+                         ["+", ">"])
+        stream.truncate(0)
+        stream.seek(0)
+        self.assertTrue(emulator.execute_line("diff base"))
+        emulator.output.flush()
+        self.assertIn("  > /etc/hosts -> /tmp/new/hosts\n", stream.getvalue())
+        self.assertIn("Всего изменений: 2", stream.getvalue())
+
+        self.assertTrue(emulator.execute_line("restore base"))
+        self.assertEqual(emulator.current_path, "/")
+        self.assertIsNotNone(emulator.vfs.resolve("/etc/hosts"))
+        self.assertIsNone(emulator.vfs.resolve("/tmp/new"))
+        self.assertEqual(emulator.vfs.diff(emulator.snapshots["base"]), [])
+
+        # Снимок можно восстановить повторно: изменения после restore его не трогают
+        self.assertTrue(emulator.execute_line("touch /etc/extra"))
+        self.assertTrue(emulator.execute_line("restore base"))
+        self.assertIsNone(emulator.vfs.resolve("/etc/extra"))
+        self.assertFalse(emulator.execute_line("restore missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Проверка индекса grep для файлов, читаемых с диска при обращении
+
+Запуск: python -m unittest test_vfs_grep  (или python -m pytest)
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from main import VFSEmulator
+from vfs_content import HostFileContent
+from vfs_grep import GrepQuery, candidate_files
+from vfs_output import OutputSink
+
+
+class HostGrepIndexTest(unittest.TestCase):
+    """Содержимое на диске индексируется при первом чтении"""
+
+    lazy = True
+
+    def setUp(self):
+        self.host = tempfile.mkdtemp(prefix="vfs_grep_test_")
+        os.mkdir(os.path.join(self.host, "logs"))
+        self._write("logs/app.log", "start\nerror: disk full\n")
+        for number in range(5):
+            self._write(f"logs/other{number}.log", "start\nok\n")
+        self.output = io.StringIO()
+        self.emulator = VFSEmulator(vfs_path=self.host, lazy=self.lazy, output=OutputSink(self.output))
+
+    def tearDown(self):
+        shutil.rmtree(self.host, ignore_errors=True)
+
+    def _write(self, name, text):
+        with open(os.path.join(self.host, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def _candidates(self, pattern):
+        vfs = self.emulator.vfs
+        return sorted(path for path, item in candidate_files(vfs, vfs.root, "/", GrepQuery(pattern)))
+
+    def test_repeated_query_skips_known_files(self):
+        self.assertEqual(self._candidates("disk full"), ["/logs/app.log"])
+        self.assertEqual(len(self.emulator.vfs.text_index), 6)
+
+        reads = []
+        iter_chunks = HostFileContent.iter_chunks
+
+        def counted(content, *args):
+            reads.append(content.real_path)
+            return iter_chunks(content, *args)
+
+        with mock.patch.object(HostFileContent, "iter_chunks", counted):
+            self.assertEqual(self._candidates("disk full"), ["/logs/app.log"])
+        self.assertEqual(reads, [])
+
+    def test_rewritten_file_found_after_reload(self):
+        self.assertEqual(self._candidates("disk full"), ["/logs/app.log"])
+        self._write("logs/other3.log", "start\nerror: disk full again\n")
+        self.emulator.execute_line("reload")
+        self.assertEqual(self._candidates("disk full"), ["/logs/app.log", "/logs/other3.log"])
+
+
+if __name__ == "__main__":
+    unittest.main()
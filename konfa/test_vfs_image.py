@@ -0,0 +1,87 @@
+"""Проверка образа VFS: поврежденный образ дает ImageError, а не struct.error или мусор
+
+Запуск: python -m unittest test_vfs_image  (или python -m pytest)
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from main import VFSEmulator
+from vfs_image import HEADER, NODE, TYPE_FILE, ImageError, load_image, save_image
+from vfs_output import OutputSink
+
+# Смещения полей в записи узла NODE
+NAME_LEN_FIELD = 8
+COUNT_FIELD = 16
+CONTENT_LEN_FIELD = 28
+
+
+class CorruptImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix="vfs_image_test_")
+        self.path = os.path.join(self.work, "vfs.img")
+        emulator = VFSEmulator(output=OutputSink(io.StringIO()))
+        save_image(emulator.vfs, self.path)
+        with open(self.path, "rb") as f:
+            self.data = bytearray(f.read())
+        (_, _, self.node_count, self.nodes_offset, _, _, _, _, _) = HEADER.unpack_from(self.data, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.work, ignore_errors=True)
+
+    def _record_offset(self, index):
+        return self.nodes_offset + index * NODE.size
+
+    def _first_file(self):
+        for index in range(self.node_count):
+            if self.data[self._record_offset(index)] == TYPE_FILE:
+                return index
+        self.fail("в образе нет файлов")
+
+    def _patch(self, index, field, value):
+        offset = self._record_offset(index) + field
+        self.data[offset:offset + 4] = value.to_bytes(4, "little")
+        with open(self.path, "wb") as f:
+            f.write(self.data)
+
+    def _load_all(self):
+        tree, _ = load_image(self.path)
+        stack = [tree.root]
+        while stack:
+            node = stack.pop()
+            if node.type == "dir":
+                tree.ensure_loaded(node)
+                stack.extend(node.children.values())
+            else:
+                b"".join(bytes(chunk) for chunk in tree.content_of(node).iter_chunks())
+
+    def test_intact_image_loads(self):
+        self._load_all()
+
+    def test_truncated_image(self):
+        with open(self.path, "wb") as f:
+            f.write(self.data[:self.nodes_offset + NODE.size // 2])
+        with self.assertRaises(ImageError):
+            load_image(self.path)
+
+    def test_children_out_of_range(self):
+        self._patch(0, COUNT_FIELD, self.node_count + 5)
+        with self.assertRaises(ImageError):
+            self._load_all()
+
+    def test_name_out_of_strings(self):
+        self._patch(1, NAME_LEN_FIELD, 1 << 30)
+        with self.assertRaises(ImageError):
+            self._load_all()
+
+    def test_content_out_of_range(self):
+        self._patch(self._first_file(), CONTENT_LEN_FIELD, 1 << 30)
+        with self.assertRaises(ImageError):
+            self._load_all()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Проверка журнала изменений для VFS из директории на диске (--vfs-path с --journal)
+
+Запуск: python -m unittest test_vfs_journal  (или python -m pytest)
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from main import VFSEmulator
+from vfs_content import read_text
+from vfs_journal import Journal
+from vfs_output import OutputSink
+
+
+class HostJournalTest(unittest.TestCase):
+    """После контрольной точки источником остается директория, а не образ"""
+
+    lazy = False
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix="vfs_journal_test_")
+        self.host = os.path.join(self.work, "host")
+        os.makedirs(os.path.join(self.host, "data"))
+        self._write("data/big.bin", "x" * 200000)
+        self._write("data/note.txt", "note\n")
+        self.journal_path = os.path.join(self.work, "vfs.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.work, ignore_errors=True)
+
+    def _write(self, name, text, mode="w"):
+        with open(os.path.join(self.host, name), mode, encoding="utf-8") as f:
+            f.write(text)
+
+    def _start(self):
+        self.output = io.StringIO()
+        return VFSEmulator(vfs_path=self.host, lazy=self.lazy, output=OutputSink(self.output),
+                           journal=Journal(self.journal_path))
+
+    def _text(self, emulator, path):
+        return read_text(emulator.vfs.content_of(emulator.vfs.resolve(path)))
+
+    def test_restart_from_checkpoint_keeps_host_source(self):
+        emulator = self._start()
+        for line in ("mkdir /made", "mv /data/note.txt /made", "checkpoint", "touch /made/after"):
+            emulator.execute_line(line)
+        emulator.journal.close()
+        # Данные диска в контрольную точку не копируются
+        self.assertLess(os.path.getsize(emulator.journal.checkpoint_path), 100000)
+
+        self._write("data/new.txt", "new\n")
+        emulator = self._start()
+        try:
+            self.assertEqual(emulator.host_root, os.path.abspath(self.host))
+            self.assertEqual(self._text(emulator, "/data/new.txt"), "new\n")
+            self.assertEqual(self._text(emulator, "/made/note.txt"), "note\n")
+            self.assertIsNotNone(emulator.vfs.resolve("/made/after"))
+
+            self._write("data/new.txt", "more\n", mode="a")
+            self.assertIsNotNone(emulator.resync_vfs())
+            self.assertEqual(self._text(emulator, "/data/new.txt"), "new\nmore\n")
+        finally:
+            emulator.journal.close()
+
+    def test_checkpoint_after_swap_keeps_file_origin(self):
+        os.makedirs(os.path.join(self.host, "other"))
+        self._write("other/note.txt", "other\n")
+        emulator = self._start()
+        for line in ("mv /other /x", "mv /data /other", "checkpoint"):
+            emulator.execute_line(line)
+        emulator.journal.close()
+
+        self._write("new.txt", "new\n")
+        emulator = self._start()
+        try:
+            # Путь /other/note.txt на диске - другой файл: в образе ссылка на настоящий
+            self.assertEqual(self._text(emulator, "/other/note.txt"), "note\n")
+            self.assertEqual(self._text(emulator, "/x/note.txt"), "other\n")
+            # Перемещенные элементы диска не появляются заново по прежним путям
+            self.assertEqual(sorted(emulator.vfs.root.children), ["new.txt", "other", "x"])
+        finally:
+            emulator.journal.close()
+
+
+class LazyHostJournalTest(HostJournalTest):
+    lazy = True
+
+
+if __name__ == "__main__":
+    unittest.main()
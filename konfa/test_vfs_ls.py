@@ -0,0 +1,132 @@
+"""Проверка ls: порядок, страницы, -R и -c (вывод сравнивается целиком)
+
+Запуск: python -m unittest test_vfs_ls  (или python -m pytest)
+"""
+import io
+import textwrap
+import unittest
+
+from main import VFSEmulator
+from vfs_content import InlineContent
+from vfs_output import OutputSink
+from vfs_tree import VFSTree
+
+
+def build_tree():
+    """/a/{z, b/{y}}, /big (50 байт), /c (2 байта) - дети в порядке добавления"""
+    tree = VFSTree()
+    a = tree.add_dir(tree.root, "a")
+    tree.add_file(tree.root, "big", InlineContent(b"x" * 50))
+    tree.add_file(tree.root, "c", InlineContent(b"xx"))
+    tree.add_file(a, "z", InlineContent(b"1"))
+    b = tree.add_dir(a, "b")
+    tree.add_file(b, "y", InlineContent(b""))
+    return tree
+
+
+class LsOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.emulator = VFSEmulator(vfs=build_tree(), output=OutputSink(self.stream))
+
+    def assertOutput(self, line, expected):
+        self.emulator.output.flush()
+        self.stream.seek(0)
+        self.stream.truncate()
+        self.assertTrue(self.emulator.execute_line(line), line)
+        self.emulator.output.flush()
+        # Строки с ведущими пробелами отмечаются '|', чтобы dedent их не срезал
+        expected = textwrap.dedent(expected).strip("\n").replace("\n|", "\n")
+        self.assertEqual(self.stream.getvalue().strip("\n"), expected[1:] if expected[:1] == "|" else expected)
+
+    def test_recursive(self):
+        self.assertOutput("ls -R /", """
+            Содержимое директории /:
+              a/
+              big
+              c
+
+            Содержимое директории /a:
+              z
+              b/
+
+            Содержимое директории /a/b:
+              y
+            """)
+        # В конвейер -R передаются полные пути без заголовков
+        self.assertOutput("ls -R / | head -4", """
+            |  /a/
+            |  /big
+            |  /c
+            |  /a/z
+            """)
+
+    def test_count(self):
+        self.assertOutput("ls -c /", "Элементов в /: 3 (директорий: 1, файлов: 2)")
+        self.assertOutput("ls -R -c /", "Элементов в / и поддиректориях: 6 (директорий: 2, файлов: 4)")
+        self.assertTrue(self.emulator.execute_line("touch /a/b/new"))
+        self.assertOutput("ls -R -c /a", "Элементов в /a и поддиректориях: 4 (директорий: 1, файлов: 3)")
+
+    def test_sort_keys(self):
+        self.assertOutput("ls -S /", """
+            Содержимое директории /:
+              big
+              c
+              a/
+            """)
+        self.assertOutput("ls --sort name -r /", """
+            Содержимое директории /:
+              c
+              big
+              a/
+            """)
+        self.assertOutput("ls --sort type a", """
+            Содержимое директории /a:
+              b/
+              z
+            """)
+
+    def test_sorted_order_follows_changes(self):
+        self.assertOutput("ls --sort=name /a", """
+            Содержимое директории /a:
+              b/
+              z
+            """)
+        self.assertTrue(self.emulator.execute_line("touch /a/m"))
+        self.assertOutput("ls --sort=name /a", """
+            Содержимое директории /a:
+              b/
+              m
+              z
+            """)
+
+    def test_pages(self):
+        self.assertOutput("ls --sort name --limit 2 /", """
+            Содержимое директории /:
+              a/
+              big
+            -- показаны элементы 1-2, далее: ls / --sort name --offset 2 --limit 2
+            """)
+        self.assertOutput("ls / --sort name --offset 2 --limit 2", """
+            Содержимое директории /:
+              c
+            """)
+        self.assertOutput("ls -R --limit 3 --offset 2 /", """
+            Содержимое директории /:
+              c
+
+            Содержимое директории /a:
+              z
+              b/
+            -- показаны элементы 3-5, далее: ls -R / --offset 5 --limit 3
+            """)
+
+    def test_bad_options(self):
+        for line in ("ls --limit 0 /", "ls --offset -1 /", "ls --limit x /", "ls --sort date /", "ls --limit", "ls /big"):
+            with self.subTest(line=line):
+                self.assertFalse(self.emulator.execute_line(line))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Проверка разрешения путей: канонический вид и сброс кеша при изменении дерева
+
+Запуск: python -m unittest test_vfs_path  (или python -m pytest)
+"""
+import io
+import unittest
+
+from main import VFSEmulator
+from vfs_output import OutputSink
+from vfs_path import PathResolver, canonical_path
+
+CANONICAL = [
+    # (текущая директория, путь, ожидаемый результат)
+    ("/home", "", "/home"),
+    ("/home", ".", "/home"),
+    ("/home", "..", "/"),
+    ("/", "..", "/"),
+    ("/home/user1", "../user2", "/home/user2"),
+    ("/home", "user1/../user2/./notes.txt", "/home/user2/notes.txt"),
+    ("/home", "./user1", "/home/user1"),
+    ("/home", "//etc///hosts/", "/etc/hosts"),
+    ("/home", "/../../etc", "/etc"),
+    ("/home", "~", "/"),
+    ("/home", "~/etc", "/etc"),
+    ("/home", "~user", "/home/~user"),
+]
+
+
+class CanonicalPathTest(unittest.TestCase):
+
+    def test_components(self):
+        for cwd, path, expected in CANONICAL:
+            with self.subTest(cwd=cwd, path=path):
+                self.assertEqual(canonical_path(cwd, path), expected)
+
+    def test_home(self):
+        self.assertEqual(canonical_path("/", "~/docs", home="/home/user1"), "/home/user1/docs")
+
+
+class ResolverCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = VFSEmulator(output=OutputSink(io.StringIO()))
+        self.emulator.current_path = "/home/user1"
+        self.paths = self.emulator.paths
+
+    def resolve(self, path):
+        return self.emulator._resolve_path(path)
+
+    def test_repeated_path_is_resolved_once(self):
+        first = self.resolve("../user2/notes.txt")
+        for _ in range(100):
+            self.assertIs(self.resolve("../user2/notes.txt"), first)
+        self.assertEqual(first[0], "/home/user2/notes.txt")
+        self.assertEqual((self.paths.misses, self.paths.hits), (1, 100))
+
+    def test_mv_invalidates_cached_nodes(self):
+        _, moved = self.resolve("file1.txt")
+        self.assertIsNotNone(moved)
+        self.assertIsNone(self.resolve("../user2/file1.txt")[1])
+
+        self.assertTrue(self.emulator.execute_line("mv file1.txt ../user2"))
+        self.assertIsNone(self.resolve("file1.txt")[1])
+        self.assertIsNotNone(self.resolve("../user2/file1.txt")[1])
+
+    def test_restore_invalidates_cached_nodes(self):
+        self.assertTrue(self.emulator.execute_line("snapshot base"))
+        self.assertTrue(self.emulator.execute_line("mkdir new"))
+        self.assertIsNotNone(self.resolve("new")[1])
+        self.assertTrue(self.emulator.execute_line("restore base"))
+        self.emulator.current_path = "/home/user1"
+        self.assertIsNone(self.resolve("new")[1])
+
+    def test_cache_is_bounded(self):
+        resolver = PathResolver(maxsize=3)
+        tree = self.emulator.vfs
+        for name in ("a", "b", "c", "d"):
+            resolver.resolve(tree, "/", name)
+        resolver.resolve(tree, "/", "b")
+        self.assertEqual(len(resolver), 3)
+        self.assertEqual(resolver.hits, 1)
+        resolver.resolve(tree, "/", "a")
+        self.assertEqual(resolver.misses, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""Проверка конвейеров: фильтры строк и ранняя остановка команды, когда head получил свои строки
+
+Запуск: python -m unittest test_vfs_pipe  (или python -m pytest)
+"""
+import io
+import unittest
+
+from main import VFSEmulator
+from vfs_content import InlineContent
+from vfs_output import OutputSink
+from vfs_pipe import PipeClosed, PipeError, PipeSink, parse_filter, parse_pipeline
+from vfs_tree import VFSTree
+
+
+class Collected:
+    """Конец цепочки фильтров для проверки: строки в списке"""
+
+    def __init__(self):
+        self.lines = []
+        self.finished = False
+
+    def feed(self, line):
+        self.lines.append(line)
+        return True
+
+    def finish(self):
+        self.finished = True
+
+
+def run_filter(command, args, lines):
+    make_filter, paths = parse_filter(command, args)
+    collected = Collected()
+    stage = make_filter(collected)
+    for line in lines:
+        if not stage.feed(line):
+            break
+    stage.finish()
+    return collected.lines
+
+
+class FilterTest(unittest.TestCase):
+
+    def test_filters(self):
+        lines = ["b", "a", "b", "b", "10", "9"]
+        self.assertEqual(run_filter("head", ["-n", "2"], lines), ["b", "a"])
+        self.assertEqual(run_filter("head", ["-3"], lines), ["b", "a", "b"])
+        self.assertEqual(run_filter("tail", ["-n", "2"], lines), ["10", "9"])
+        self.assertEqual(run_filter("sort", ["-n"], lines[4:]), ["9", "10"])
+        self.assertEqual(run_filter("sort", ["-ru"], lines[:4]), ["b", "a"])
+        self.assertEqual(run_filter("uniq", [], lines), ["b", "a", "b", "10", "9"])
+        self.assertEqual(run_filter("uniq", ["-c"], lines[2:4]), ["      2 b"])
+
+    def test_parse_errors(self):
+        for command, args in (("head", ["-n", "x"]), ("head", ["-n"]), ("sort", ["-z"]), ("uniq", ["-r"])):
+            with self.subTest(command=command, args=args):
+                with self.assertRaises(PipeError):
+                    parse_filter(command, args)
+        self.assertEqual(parse_pipeline("find / -name 'a|b' | head"), [("find", ["/", "-name", "a|b"]), ("head", [])])
+        with self.assertRaises(ValueError):
+            parse_pipeline("find / | | head")
+
+    def test_sink_closes_after_head(self):
+        make_filter, _ = parse_filter("head", ["-n", "2"])
+        collected = Collected()
+        sink = PipeSink(OutputSink(io.StringIO()), make_filter(collected))
+        sink.line("one")
+        with self.assertRaises(PipeClosed):
+            sink.write("two\nthree\n")
+        with self.assertRaises(PipeClosed):
+            sink.line("four")
+        sink.finish()
+        self.assertEqual(collected.lines, ["one", "two"])
+        self.assertTrue(collected.finished)
+
+
+class EarlyCloseTest(unittest.TestCase):
+    """Команда перед head прекращает работу, а не выводит все в пустоту"""
+
+    def setUp(self):
+        tree = VFSTree()
+        content = InlineContent(b"x")
+        for d in range(20):
+            directory = tree.add_dir(tree.root, f"d{d}")
+            for f in range(50):
+                tree.add_file(directory, f"f{f}", content)
+        self.visited = 0
+        walk = tree.walk
+
+        def counting_walk(*args, **kwargs):
+            for item in walk(*args, **kwargs):
+                self.visited += 1
+                yield item
+
+        tree.walk = counting_walk
+        self.stream = io.StringIO()
+        self.emulator = VFSEmulator(vfs=tree, output=OutputSink(self.stream))
+
+    def output_lines(self):
+        self.emulator.output.flush()
+        return [line for line in self.stream.getvalue().splitlines() if line.startswith("  /")]
+
+    def test_find_stops_walking(self):
+        self.assertTrue(self.emulator.execute_line("find / -type f | head -3"))
+        self.assertEqual(self.output_lines(), ["  /d0/f0 (file)", "  /d0/f1 (file)", "  /d0/f2 (file)"])
+        self.assertLess(self.visited, 10)
+
+    def test_full_consumers_see_every_line(self):
+        self.assertTrue(self.emulator.execute_line("find / -type f | tail -n 1"))
+        self.assertEqual(self.output_lines(), ["  /d19/f49 (file)"])
+        self.assertEqual(self.visited, 1021)
+
+    def test_command_after_closed_pipeline_runs_normally(self):
+        self.assertTrue(self.emulator.execute_line("ls -R / | head -1"))
+        self.assertTrue(self.emulator.execute_line("ls /d3 --limit 1"))
+        self.emulator.output.flush()
+        self.assertIn("Содержимое директории /d3:", self.stream.getvalue())
+        self.assertFalse(self.emulator.execute_line("find / | cd /"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""Проверка синхронизации VFS с директорией на диске (reload, --watch)
+
+Запуск: python -m unittest test_vfs_sync  (или python -m pytest)
+"""
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import vfs_sync
+from main import VFSEmulator
+from vfs_content import read_text
+from vfs_output import OutputSink
+from vfs_sync import HostWatcher, exclusive_guard
+
+WATCH_INTERVAL = 0.05
+WATCH_TIMEOUT = 5.0
+
+
+class ResyncAppendTest(unittest.TestCase):
+    """Файл, дописанный на месте (mtime директории не меняется), находит обычная синхронизация"""
+
+    lazy = False
+
+    def setUp(self):
+        self.host = tempfile.mkdtemp(prefix="vfs_sync_test_")
+        os.mkdir(os.path.join(self.host, "logs"))
+        self.path = os.path.join(self.host, "logs", "app.log")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("first\n")
+        self.output = io.StringIO()
+        self.emulator = VFSEmulator(vfs_path=self.host, lazy=self.lazy, output=OutputSink(self.output))
+        # Чтение до изменения: содержимое загружено в VFS
+        self.assertEqual(self._vfs_text(), "first\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.host, ignore_errors=True)
+
+    def _vfs_text(self):
+        vfs = self.emulator.vfs
+        return read_text(vfs.content_of(vfs.resolve("/logs/app.log")))
+
+    def _append(self):
+        directory_mtime = os.stat(os.path.dirname(self.path)).st_mtime_ns
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("second\n")
+        # Дописывание не меняет состав директории и ее mtime
+        self.assertEqual(os.stat(os.path.dirname(self.path)).st_mtime_ns, directory_mtime)
+
+    def test_reload_picks_up_append(self):
+        self._append()
+        self.emulator.execute_line("reload")
+        self.emulator.output.flush()
+        self.assertIn("~1", self.output.getvalue())
+        self.assertEqual(self._vfs_text(), "first\nsecond\n")
+
+    def test_watcher_picks_up_append(self):
+        watcher = HostWatcher(self.emulator, WATCH_INTERVAL, exclusive_guard())
+        watcher.start()
+        try:
+            self._append()
+            deadline = time.monotonic() + WATCH_TIMEOUT
+            while self._vfs_text() != "first\nsecond\n" and time.monotonic() < deadline:
+                time.sleep(WATCH_INTERVAL)
+        finally:
+            watcher.stop()
+            watcher.join()
+        self.assertEqual(self._vfs_text(), "first\nsecond\n")
+        self.assertIn("[watch] VFS синхронизирована: +0 -0 ~1", self.output.getvalue())
+
+    def test_disk_check_runs_without_command_lock(self):
+        lock = threading.Lock()
+        free = []
+        check_directory = vfs_sync._check_directory
+
+        def checked(*args):
+            # Поток пула: блокировка команд свободна, пока диск проверяется
+            free.append(lock.acquire(timeout=WATCH_TIMEOUT))
+            if free[-1]:
+                lock.release()
+            return check_directory(*args)
+
+        self._append()
+        with mock.patch.object(vfs_sync, "_check_directory", checked):
+            stats = self.emulator.resync_vfs(guard=lambda command: lock)
+        self.assertTrue(free and all(free))
+        self.assertEqual(stats.modified, 1)
+        self.assertEqual(self._vfs_text(), "first\nsecond\n")
+
+    def test_reload_without_changes(self):
+        self.emulator.execute_line("reload")
+        self.emulator.output.flush()
+        self.assertIn("+0 -0 ~0", self.output.getvalue())
+
+
+class LazyResyncAppendTest(ResyncAppendTest):
+    lazy = True
+
+
+class MovedHostEntryTest(unittest.TestCase):
+    """Перемещенный mv элемент диска - объект VFS: синхронизация его не удаляет и не возвращает прежний"""
+
+    lazy = False
+
+    def setUp(self):
+        self.host = tempfile.mkdtemp(prefix="vfs_sync_test_")
+        os.mkdir(os.path.join(self.host, "a"))
+        with open(os.path.join(self.host, "a", "f"), "w", encoding="utf-8") as f:
+            f.write("data\n")
+        self.emulator = VFSEmulator(vfs_path=self.host, lazy=self.lazy, output=OutputSink(io.StringIO()))
+
+    def tearDown(self):
+        shutil.rmtree(self.host, ignore_errors=True)
+
+    def test_moved_directory_survives_reload(self):
+        for line in ("ls /a", "mv /a /z", "touch /z/mine"):
+            self.assertTrue(self.emulator.execute_line(line))
+        # Несвязанное изменение в той же директории диска: ее список перечитывается
+        with open(os.path.join(self.host, "new.txt"), "w", encoding="utf-8") as f:
+            f.write("new\n")
+        stats = self.emulator.resync_vfs()
+
+        vfs = self.emulator.vfs
+        self.assertEqual((stats.added, stats.removed), (1, 0))
+        self.assertEqual(sorted(vfs.root.children), ["new.txt", "z"])
+        self.assertEqual(sorted(vfs.resolve("/z").children), ["f", "mine"])
+        self.assertEqual(read_text(vfs.content_of(vfs.resolve("/z/f"))), "data\n")
+
+
+class LazyMovedHostEntryTest(MovedHostEntryTest):
+    lazy = True
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Проверка индекса имен VFSTree: родители узлов при повторяющихся и уникальных именах
+
+Запуск: python -m unittest test_vfs_tree  (или python -m pytest)
+"""
+import unittest
+
+from vfs_content import InlineContent
+from vfs_tree import VFSTree
+
+
+class NameIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = VFSTree()
+        self.a = self.tree.add_dir(self.tree.root, "a")
+        self.b = self.tree.add_dir(self.tree.root, "b")
+
+    def names(self, pattern):
+        return sorted(path for path, node in self.tree.find(self.tree.root, "/", glob=pattern))
+
+    def test_parent_of_unique_and_repeated_names(self):
+        first = self.tree.add_file(self.a, "x", InlineContent(b"1"))
+        self.assertIs(self.tree.parent_of(first), self.a)
+        second = self.tree.add_file(self.b, "x", InlineContent(b"2"))
+        self.assertIs(self.tree.parent_of(first), self.a)
+        self.assertIs(self.tree.parent_of(second), self.b)
+        self.assertEqual(self.names("x"), ["/a/x", "/b/x"])
+
+        self.tree.remove(self.a, "x")
+        self.assertIs(self.tree.parent_of(second), self.b)
+        self.assertEqual(self.names("x"), ["/b/x"])
+        self.tree.remove(self.b, "x")
+        self.assertEqual(self.names("x"), [])
+        self.assertEqual(list(self.tree.names_with_prefix("x")), [])
+
+    def test_copies_after_snapshot_replace_index_entries(self):
+        self.tree.add_file(self.a, "x", InlineContent(b"1"))
+        self.tree.add_file(self.b, "x", InlineContent(b"2"))
+        snapshot = self.tree.snapshot()
+
+        self.tree.move("/a/x", "/b", "y")
+        self.assertEqual(self.names("*"), ["/a", "/b", "/b/x", "/b/y"])
+        self.assertEqual(self.tree.path_of(self.tree.resolve("/b/y")), "/b/y")
+        self.assertEqual(self.tree.path_of(self.tree.resolve("/b/x")), "/b/x")
+
+        self.tree.restore(snapshot)
+        self.assertEqual(self.names("x"), ["/a/x", "/b/x"])
+        self.assertEqual(self.tree.path_of(self.tree.resolve("/a/x")), "/a/x")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+"""Загрузка VFS прямо из архива tar или zip (--vfs-path архив)
+
+Элементы архива читаются по порядку (tarfile - потоком, zipfile - по
+центральному каталогу), директории создаются по путям элементов, даже если
+отдельных записей для них в архиве нет. Содержимое файлов не распаковывается
+при загрузке:
+    tar без сжатия, zip без сжатия - диапазон байт архива (как большие файлы
+        на диске, vfs_content.HostFileContent);
+    zip со сжатием - сжатые байты элемента распаковываются при чтении;
+    tar.gz, tar.bz2, tar.xz - небольшие файлы (до INLINE_CONTENT_LIMIT)
+        читаются в память при проходе по архиву, большие распаковываются при
+        чтении с начала архива (произвольного доступа в таком потоке нет).
+Ссылки, устройства и элементы с '..' в пути пропускаются.
+"""
+import bz2
+import gzip
+import lzma
+import struct
+import tarfile
+import time
+import zipfile
+import zlib
+
+from vfs_content import CHUNK_SIZE, INLINE_CONTENT_LIMIT, HostFileContent, InlineContent
+from vfs_scan import ScanStats
+
+# Сигнатуры сжатия tar и функции открытия распаковывающего потока
+_COMPRESSED_TAR = ((b"\x1f\x8b", gzip.open), (b"BZh", bz2.open), (b"\xfd7zXZ\x00", lzma.open))
+# Локальный заголовок элемента zip: сигнатура, ..., длина имени и доп. поля в конце
+_ZIP_LOCAL_HEADER = struct.Struct("<4s22xHH")
+_ZIP_LOCAL_SIGNATURE = b"PK\x03\x04"
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def is_archive(path):
+    """Файл - архив zip или tar (в том числе сжатый)"""
+    try:
+        return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+    except OSError:
+        return False
+
+
+def _compressed_opener(path):
+    with open(path, "rb") as f:
+        magic = f.read(6)
+    for signature, opener in _COMPRESSED_TAR:
+        if magic.startswith(signature):
+            return opener
+    return None
+
+
+def _read_reversed(content, block_size):
+    """Блоки с конца для содержимого, которое можно читать только с начала"""
+    data = b"".join(bytes(chunk) for chunk in content.iter_chunks())
+    end = len(data)
+    while end > 0:
+        start = max(0, end - block_size)
+        yield data[start:end]
+        end = start
+
+
+class ZipMemberContent:
+    """Сжатый элемент zip: сжатые байты читаются с offset и распаковываются при чтении
+
+    method - метод сжатия zipfile.ZIP_*, None - элемент зашифрован.
+    """
+
+    __slots__ = ("real_path", "offset", "compressed_size", "length", "method", "__weakref__")
+
+    def __init__(self, real_path, offset, compressed_size, length, method):
+        self.real_path = real_path
+        self.offset = offset
+        self.compressed_size = compressed_size
+        self.length = length
+        self.method = method
+
+    @property
+    def size(self):
+        return self.length
+
+    def _decompressor(self):
+        if self.method is None:
+            raise OSError("зашифрованные элементы zip не поддерживаются")
+        if self.method == zipfile.ZIP_DEFLATED:
+            return zlib.decompressobj(-15)
+        if self.method == zipfile.ZIP_BZIP2:
+            return bz2.BZ2Decompressor()
+        raise OSError(f"неподдерживаемый метод сжатия zip: {self.method}")
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        decompressor = self._decompressor()
+        remaining = self.compressed_size
+        try:
+            with open(self.real_path, "rb") as f:
+                f.seek(self.offset)
+                while remaining > 0:
+                    data = f.read(min(chunk_size, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    data = decompressor.decompress(data)
+                    if data:
+                        yield data
+        except (zlib.error, ValueError, EOFError) as e:
+            raise OSError(f"поврежденный элемент архива: {e}")
+
+    def iter_blocks_reversed(self, block_size=CHUNK_SIZE):
+        return _read_reversed(self, block_size)
+
+
+class CompressedStreamContent:
+    """Диапазон байт распакованного потока (tar.gz и т.п.); чтение - распаковкой с начала архива"""
+
+    __slots__ = ("real_path", "opener", "offset", "length", "__weakref__")
+
+    def __init__(self, real_path, opener, offset, length):
+        self.real_path = real_path
+        self.opener = opener
+        self.offset = offset
+        self.length = length
+
+    @property
+    def size(self):
+        return self.length
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        remaining = self.length
+        try:
+            with self.opener(self.real_path, "rb") as f:
+                f.seek(self.offset)
+                while remaining > 0:
+                    data = f.read(min(chunk_size, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+        except (EOFError, lzma.LZMAError) as e:
+            raise OSError(f"поврежденный архив: {e}")
+
+    def iter_blocks_reversed(self, block_size=CHUNK_SIZE):
+        return _read_reversed(self, block_size)
+
+
+class _TreeBuilder:
+    """Создание узлов по путям элементов архива; недостающие директории создаются по пути"""
+
+    def __init__(self, tree, root, report):
+        self.tree = tree
+        self.report = report
+        self.dirs = {"": root}
+        self.stats = ScanStats()
+        self.skipped = 0
+
+    def _parts(self, name):
+        parts = [part for part in name.replace("\\", "/").split("/") if part and part != "."]
+        if ".." in parts:
+            self.report(f"Архив: элемент '{name}' пропущен (путь содержит '..')")
+            self.skipped += 1
+            return None
+        return parts
+
+    def directory(self, parts):
+        """Узел директории по компонентам пути (с созданием недостающих)"""
+        key = "/".join(parts)
+        node = self.dirs.get(key)
+        if node is not None:
+            return node
+        parent = self.directory(parts[:-1])
+        if parent is None:
+            return None
+        node = parent.children.get(parts[-1])
+        if node is None:
+            node = self.tree.add_dir(parent, parts[-1])
+            self.stats.entries += 1
+        elif node.type != "dir":
+            self.report(f"Архив: '{key}' - и файл, и директория; директория пропущена")
+            self.skipped += 1
+            return None
+        self.dirs[key] = node
+        return node
+
+    def add_dir(self, name):
+        parts = self._parts(name)
+        if parts:
+            self.directory(parts)
+
+    def add_file(self, name, content):
+        parts = self._parts(name)
+        if not parts:
+            return
+        parent = self.directory(parts[:-1])
+        if parent is None:
+            return
+        existing = parent.children.get(parts[-1])
+        if existing is not None:
+            if existing.type == "dir":
+                self.report(f"Архив: '{name}' - и файл, и директория; файл пропущен")
+                self.skipped += 1
+                return
+            # Повторный элемент с тем же путем заменяет прежний (как при распаковке)
+            self.stats.bytes += content.size - self.tree.file_size(existing)
+            self.tree.set_content(existing, content)
+            return
+        self.tree.add_file(parent, parts[-1], content)
+        self.stats.entries += 1
+        self.stats.bytes += content.size
+
+
+def _load_zip(builder, path):
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            if info.is_dir():
+                builder.add_dir(info.filename)
+                continue
+            # Данные элемента начинаются после локального заголовка, длина имени в нем может отличаться
+            f.seek(info.header_offset)
+            header = f.read(_ZIP_LOCAL_HEADER.size)
+            if len(header) < _ZIP_LOCAL_HEADER.size:
+                raise ArchiveError(f"элемент '{info.filename}' обрезан")
+            signature, name_len, extra_len = _ZIP_LOCAL_HEADER.unpack(header)
+            if signature != _ZIP_LOCAL_SIGNATURE:
+                raise ArchiveError(f"неверный заголовок элемента '{info.filename}'")
+            offset = info.header_offset + _ZIP_LOCAL_HEADER.size + name_len + extra_len
+            if info.flag_bits & 0x1:
+                content = ZipMemberContent(path, offset, info.compress_size, info.file_size, None)
+            elif info.compress_type == zipfile.ZIP_STORED:
+                content = HostFileContent(path, offset, info.file_size)
+            else:
+                content = ZipMemberContent(path, offset, info.compress_size, info.file_size, info.compress_type)
+            builder.add_file(info.filename, content)
+
+
+def _load_tar(builder, path):
+    opener = _compressed_opener(path)
+    # Без сжатия элементы пропускаются перемещением по файлу, со сжатием - распаковкой потока
+    with tarfile.open(path, "r|*" if opener else "r:") as archive:
+        for info in archive:
+            # Прочитанные заголовки не накапливаются: архивы бывают на миллионы элементов
+            archive.members = []
+            if info.isdir():
+                builder.add_dir(info.name)
+            elif not info.isfile():
+                builder.skipped += 1
+            elif opener is None:
+                builder.add_file(info.name, HostFileContent(path, info.offset_data, info.size))
+            elif info.size <= INLINE_CONTENT_LIMIT:
+                builder.add_file(info.name, InlineContent(archive.extractfile(info).read()))
+            else:
+                builder.add_file(info.name, CompressedStreamContent(path, opener, info.offset_data, info.size))
+
+
+def load_archive(tree, path, root, report=print):
+    """Загрузка архива path в узел root; возвращает ScanStats"""
+    builder = _TreeBuilder(tree, root, report)
+    started = time.perf_counter()
+    try:
+        if zipfile.is_zipfile(path):
+            _load_zip(builder, path)
+        else:
+            _load_tar(builder, path)
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError, zlib.error, lzma.LZMAError) as e:
+        raise ArchiveError(str(e) or type(e).__name__)
+    if builder.skipped:
+        report(f"Архив: пропущено элементов (ссылки, устройства, конфликты путей): {builder.skipped}")
+    # Итоги поддеревьев для du/tree: размеры элементов известны из заголовков
+    tree.usage(root)
+    builder.stats.seconds = time.perf_counter() - started
+    return builder.stats
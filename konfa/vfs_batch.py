@@ -0,0 +1,94 @@
+"""Параллельное выполнение многих скриптов над одной VFS (--run-scripts)
+
+VFS загружается один раз. Рабочие процессы получают ее без повторного
+сканирования: при старте через fork - как унаследованную память процесса,
+иначе (Windows) - из временного бинарного образа, который отображается в
+память. Каждый скрипт выполняется на собственной копии эмулятора
+(VFSEmulator.fork), поэтому скрипты не видят изменений друг друга.
+Вывод скриптов собирается и печатается в порядке списка скриптов.
+"""
+import glob
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+
+from vfs_image import save_image
+from vfs_output import OutputSink
+
+# Эмулятор с загруженной VFS в рабочем процессе и режим вывода
+_base = None
+_quiet = False
+
+
+def _init_inherited(quiet):
+    global _quiet
+    _quiet = quiet
+
+
+def _init_from_image(image_path, quiet):
+    global _base, _quiet
+    from main import VFSEmulator
+    _base = VFSEmulator(image_path=image_path, output=OutputSink(io.StringIO()))
+    _quiet = quiet
+
+
+def _run_one(script):
+    """Выполнение скрипта на копии эмулятора: (скрипт, успех, успешных, ошибочных, время, вывод)"""
+    stream = io.StringIO()
+    emulator = _base.fork(OutputSink(stream, quiet=_quiet))
+    started = time.perf_counter()
+    success = emulator.execute_script_file(script)
+    emulator.output.flush()
+    ok_count, error_count = emulator.last_script_counts
+    return script, success, ok_count, error_count, time.perf_counter() - started, stream.getvalue()
+
+
+def find_scripts(pattern):
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+
+def run_scripts(emulator, scripts, jobs=None, quiet=False):
+    """Выполнение scripts в jobs процессах; вывод и итоговый отчет - в emulator.output"""
+    global _base, _quiet
+    output = emulator.output
+    jobs = min(jobs or os.cpu_count() or 1, len(scripts))
+    started = time.perf_counter()
+    results = []
+
+    def collect(result_iter):
+        for result in result_iter:
+            results.append(result)
+            output.forward(result[5])
+            output.flush()
+
+    _base, _quiet = emulator, quiet
+    image_path = None
+    try:
+        if jobs == 1:
+            collect(map(_run_one, scripts))
+        elif "fork" in multiprocessing.get_all_start_methods():
+            # Рабочие процессы наследуют загруженное дерево (память копируется при записи)
+            output.flush()
+            with multiprocessing.get_context("fork").Pool(jobs, _init_inherited, (quiet,)) as pool:
+                collect(pool.imap(_run_one, scripts))
+        else:
+            fd, image_path = tempfile.mkstemp(prefix="vfs_batch_", suffix=".img")
+            os.close(fd)
+            save_image(emulator.vfs, image_path)
+            with multiprocessing.Pool(jobs, _init_from_image, (image_path, quiet)) as pool:
+                collect(pool.imap(_run_one, scripts))
+    finally:
+        _base = None
+        if image_path:
+            os.unlink(image_path)
+
+    failed = [result for result in results if not result[1]]
+    output.summary("=" * 50)
+    output.summary(f"Выполнено скриптов: {len(results)} (успешно: {len(results) - len(failed)}, "
+                   f"с ошибками: {len(failed)}), процессов: {jobs}, время: {time.perf_counter() - started:.2f} с")
+    for script, success, ok_count, error_count, seconds, text in results:
+        status = "OK  " if success else "FAIL"
+        output.summary(f"  [{status}] {script}: успешных команд {ok_count}, ошибочных {error_count} ({seconds:.3f} с)")
+    return not failed
@@ -0,0 +1,205 @@
+"""Содержимое файлов VFS
+
+Файл хранит не строку, а объект содержимого: небольшие данные - в памяти,
+большие - ссылкой на диапазон байт файла на диске или отображенного образа.
+Чтение идет блоками фиксированного размера, поэтому память не зависит
+от размера файла.
+
+Данные в памяти хранятся в BlobStore по хешу: одинаковое содержимое разных
+файлов (шаблоны, копии библиотек, пустые логи) хранится один раз.
+"""
+import codecs
+import functools
+import hashlib
+import os
+import threading
+import weakref
+
+CHUNK_SIZE = 64 * 1024
+# Файлы до этого размера при полной загрузке читаются в память
+INLINE_CONTENT_LIMIT = 64 * 1024
+
+
+def content_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class InlineContent:
+    """Содержимое, целиком хранящееся в памяти; digest - ключ в BlobStore (если сохранено там)"""
+
+    __slots__ = ("data", "digest", "__weakref__")
+
+    def __init__(self, data=b"", digest=None):
+        self.data = data
+        self.digest = digest
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        view = memoryview(self.data)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+
+    def iter_blocks_reversed(self, block_size=CHUNK_SIZE):
+        view = memoryview(self.data)
+        end = len(view)
+        while end > 0:
+            start = max(0, end - block_size)
+            yield view[start:end]
+            end = start
+
+
+class BlobStore:
+    """Хранилище содержимого по хешу
+
+    Объекты содержимого не изменяются: запись в файл - это новый объект из
+    intern(), поэтому общие данные копируются при записи. Хранилище ссылается
+    на объекты слабо: данные живут, пока на них ссылается хоть один файл
+    текущего дерева, снимка или копии (fork), и удаляются из хранилища, когда
+    пропадает последний такой файл - при rm/reload, замене содержимого,
+    restore или перезаписи снимка.
+    """
+
+    def __init__(self):
+        # хеш -> слабая ссылка на объект содержимого
+        self._blobs = {}
+        self.physical_bytes = 0
+        # Объекты освобождаются в том потоке, где пропала последняя ссылка на них
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def intern(self, data, digest=None):
+        """Общий объект содержимого для data"""
+        if digest is None:
+            digest = content_digest(data)
+        with self._lock:
+            ref = self._blobs.get(digest)
+            content = ref() if ref is not None else None
+            if content is None:
+                content = InlineContent(data, digest)
+                self._blobs[digest] = weakref.ref(content, functools.partial(self._released, digest, len(data)))
+                self.physical_bytes += len(data)
+            return content
+
+    def _released(self, digest, size, ref):
+        """На объект содержимого больше не ссылается ни один файл"""
+        with self._lock:
+            if self._blobs.get(digest) is ref:
+                del self._blobs[digest]
+            self.physical_bytes -= size
+
+
+class HostFileContent:
+    """Диапазон байт файла на диске; файл открывается только на время чтения"""
+
+    __slots__ = ("real_path", "offset", "_length", "__weakref__")
+
+    def __init__(self, real_path, offset=0, length=None):
+        self.real_path = real_path
+        self.offset = offset
+        self._length = length
+
+    @property
+    def size(self):
+        if self._length is None:
+            try:
+                self._length = max(0, os.path.getsize(self.real_path) - self.offset)
+            except OSError:
+                return 0
+        return self._length
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        remaining = self.size
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        with open(self.real_path, "rb") as f:
+            f.seek(self.offset)
+            while remaining > 0:
+                n = f.readinto(view[:min(chunk_size, remaining)])
+                if not n:
+                    break
+                remaining -= n
+                yield view[:n]
+
+    def iter_blocks_reversed(self, block_size=CHUNK_SIZE):
+        end = self.size
+        with open(self.real_path, "rb") as f:
+            while end > 0:
+                start = max(0, end - block_size)
+                f.seek(self.offset + start)
+                yield f.read(end - start)
+                end = start
+
+
+class MmapContent:
+    """Диапазон байт отображенного в память файла (образ VFS); чтение без копирования"""
+
+    __slots__ = ("mm", "offset", "length", "__weakref__")
+
+    def __init__(self, mm, offset, length):
+        self.mm = mm
+        self.offset = offset
+        self.length = length
+
+    @property
+    def size(self):
+        return self.length
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        view = memoryview(self.mm)
+        end = self.offset + self.length
+        for start in range(self.offset, end, chunk_size):
+            yield view[start:min(start + chunk_size, end)]
+
+    def iter_blocks_reversed(self, block_size=CHUNK_SIZE):
+        view = memoryview(self.mm)
+        end = self.offset + self.length
+        while end > self.offset:
+            start = max(self.offset, end - block_size)
+            yield view[start:end]
+            end = start
+
+
+def iter_text(content, chunk_size=CHUNK_SIZE):
+    """Потоковое декодирование содержимого в текст (UTF-8, ошибки заменяются)"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in content.iter_chunks(chunk_size):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_lines(content, chunk_size=CHUNK_SIZE):
+    """Строки содержимого по порядку (как content.split("\\n") без пустой строки в конце)"""
+    carry = ""
+    for text in iter_text(content, chunk_size):
+        parts = (carry + text).split("\n")
+        carry = parts.pop()
+        yield from parts
+    if carry:
+        yield carry
+
+
+def iter_lines_reversed(content, block_size=CHUNK_SIZE):
+    """Строки содержимого с конца к началу (как content.split("\\n") в обратном порядке)
+
+    Файл читается блоками с конца; в памяти держится только неполная строка.
+    """
+    carry = b""
+    for block in content.iter_blocks_reversed(block_size):
+        parts = (bytes(block) + carry).split(b"\n")
+        carry = parts[0]
+        for line in reversed(parts[1:]):
+            yield line.decode("utf-8", errors="replace")
+    yield carry.decode("utf-8", errors="replace")
+
+
+def read_text(content):
+    return "".join(iter_text(content))
@@ -0,0 +1,456 @@
+"""Поиск по содержимому файлов (grep) с триграммным индексом
+
+Из регулярного выражения извлекаются строки, обязательно входящие в любое
+совпадение, и их триграммы (три байта подряд). Индекс хранит для триграммы
+номера объектов содержимого, в которых она встречается; построчная проверка
+выполняется только для файлов, содержимое которых содержит все триграммы.
+
+Документ индекса - объект содержимого в памяти (vfs_content), а не файл.
+Объекты содержимого не изменяются: запись в файл создает новый объект, он
+попадает в индекс при следующем поиске, а объекты, на которые больше никто
+не ссылается, выпадают из индекса сами (слабые ссылки). Поэтому индекс общий
+для снимков и копий дерева и не требует обновления при изменениях.
+
+Содержимое, читаемое с диска при обращении (ленивая загрузка, файлы больше
+64 КБ), попадает в индекс при первом чтении: файл читается один раз для всех
+триграмм запроса, и при следующих запросах с ними файлы без совпадений не
+читаются. Изменение файла на диске индекс видит после синхронизации (reload,
+--watch): она заменяет объект содержимого.
+"""
+import array
+import bisect
+import itertools
+import re
+import sys
+import threading
+import weakref
+
+from vfs_content import HostFileContent, InlineContent, MmapContent, iter_lines
+
+# Триграмм одной ветки выражения, по которым отбираются файлы
+QUERY_MAX_TRIGRAMS = 8
+# Предел суммарной длины списков документов; сверх него вытесняются давно не использованные
+POSTINGS_MAX_ENTRIES = 16 * 1024 * 1024
+# Перенумерация документов, когда удаленных больше, чем живых
+COMPACT_MIN_DEAD = 1024
+# Размер блока чтения при проверке триграмм в файле на диске
+HOST_SCAN_CHUNK = 1024 * 1024
+# При -i эти символы совпадают и с символами вне ASCII (K - знак Кельвина, ſ, İ, ı)
+_UNSAFE_FOLD = frozenset("iksIKS")
+_REPEAT = re.compile(r"\{(\d*)(,?)(\d*)\}")
+
+
+def _skip_class(pattern, i):
+    """Позиция после класса символов, начинающегося в pattern[i] == '['"""
+    i += 1
+    if pattern[i:i + 1] == "^":
+        i += 1
+    if pattern[i:i + 1] == "]":
+        i += 1
+    while i < len(pattern) and pattern[i] != "]":
+        i += 2 if pattern[i] == "\\" else 1
+    return i + 1
+
+
+def _skip_group(pattern, i):
+    """Позиция после группы, начинающейся в pattern[i] == '('"""
+    depth = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == "[":
+            i = _skip_class(pattern, i)
+            continue
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if not depth:
+                return i + 1
+        i += 1
+    return i
+
+
+def required_literals(pattern):
+    """Строки, которые входят в любое совпадение pattern
+
+    Результат - список альтернатив (ветки '|' верхнего уровня), у каждой - список
+    строк. Разбор консервативный: группы, классы символов, спецпоследовательности
+    и необязательные символы только разрывают строки, поэтому найденные строки
+    присутствуют в совпадении всегда.
+    """
+    alternatives = []
+    literals = []
+    run = []
+    last_literal = False
+
+    def flush():
+        if run:
+            literals.append("".join(run))
+            run.clear()
+
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            i += 2
+            if not escaped.isalnum():
+                run.append(escaped)
+                last_literal = True
+                continue
+            # \d, \b, \x41, \N{...}, обратные ссылки: вместе с параметрами
+            if escaped == "N" and pattern[i:i + 1] == "{":
+                i = pattern.find("}", i) + 1 or len(pattern)
+            while i < len(pattern) and pattern[i].isalnum():
+                i += 1
+            flush()
+            last_literal = False
+            continue
+
+        repeat = _REPEAT.match(pattern, i) if ch == "{" else None
+        if ch in "*?+" or repeat:
+            optional = ch in "*?" or (repeat and not int(repeat.group(1) or 0))
+            if last_literal and optional:
+                run.pop()
+            flush()
+            last_literal = False
+            i += len(repeat.group(0)) if repeat else 1
+            if pattern[i:i + 1] in ("?", "+"):
+                # Ленивый или захватывающий повтор
+                i += 1
+            continue
+
+        if ch == "[":
+            i = _skip_class(pattern, i)
+        elif ch == "(":
+            i = _skip_group(pattern, i)
+        elif ch == "|":
+            flush()
+            alternatives.append(literals)
+            literals = []
+            i += 1
+        elif ch in ".^$)":
+            i += 1
+        else:
+            run.append(ch)
+            last_literal = True
+            i += 1
+            continue
+        flush()
+        last_literal = False
+
+    flush()
+    alternatives.append(literals)
+    return alternatives
+
+
+class GrepQuery:
+    """Регулярное выражение grep и триграммы, обязательные для совпадения
+
+    required - список веток выражения; у каждой - список требований, требование -
+    кортеж вариантов триграммы (при -i - все варианты регистра латиницы), из
+    которых хотя бы один должен быть в содержимом. None - сузить поиск по
+    индексу нельзя (в какой-то ветке нет строки из 3 байт).
+    """
+
+    def __init__(self, pattern, ignore_case=False):
+        self.regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        self.required = None
+        self.trigrams = []
+        if self.regex.flags & re.VERBOSE:
+            return
+        fold = bool(self.regex.flags & re.IGNORECASE)
+        alternatives = []
+        for literals in required_literals(pattern):
+            required = []
+            for literal in literals:
+                for part in _index_parts(literal, fold):
+                    for trigram in _literal_trigrams(part.encode("utf-8")):
+                        requirement = _case_variants(trigram) if fold else (trigram,)
+                        if requirement not in required:
+                            required.append(requirement)
+            if not required:
+                return
+            alternatives.append(required[:QUERY_MAX_TRIGRAMS])
+        self.required = alternatives
+        # Все триграммы запроса (с вариантами регистра) - для проверки файла за одно чтение
+        self.trigrams = list(dict.fromkeys(trigram for required in alternatives
+                                           for variants in required for trigram in variants))
+
+    def satisfied_by(self, present):
+        """Есть ли в наборе триграмм present все требования хотя бы одной ветки"""
+        return any(all(any(trigram in present for trigram in variants) for variants in required)
+                   for required in self.required)
+
+    def may_occur(self, content):
+        """Проверка требований по самому содержимому (без индекса); OSError - при чтении с диска"""
+        return self.satisfied_by(_present(content, self.trigrams))
+
+    def search_lines(self, content):
+        """Совпавшие строки содержимого: (номер строки, строка)"""
+        search = self.regex.search
+        for number, line in enumerate(iter_lines(content), 1):
+            if search(line):
+                yield number, line
+
+
+def _index_parts(literal, fold):
+    """Части строки, которые можно искать побайтно
+
+    Символ замены (U+FFFD) может означать некорректные байты файла, а при -i
+    регистр символов вне ASCII и i, k, s не определяется одним байтом.
+    """
+    part = []
+    for ch in literal:
+        if ch != "\ufffd" and not (fold and (ch >= "\x80" or ch in _UNSAFE_FOLD)):
+            part.append(ch)
+        elif part:
+            yield "".join(part)
+            part = []
+    if part:
+        yield "".join(part)
+
+
+def _literal_trigrams(data):
+    """Непересекающиеся триграммы строки и последняя: этого достаточно для отбора"""
+    starts = list(range(0, len(data) - 2, 3))
+    if starts and starts[-1] != len(data) - 3:
+        starts.append(len(data) - 3)
+    return [data[i:i + 3] for i in starts]
+
+
+def _case_variants(trigram):
+    """Все варианты регистра триграммы из символов ASCII"""
+    options = [sorted({byte, ord(chr(byte).lower()), ord(chr(byte).upper())}) for byte in trigram]
+    return tuple(bytes(variant) for variant in itertools.product(*options))
+
+
+def _contains(content, trigram):
+    """Поиск триграммы в содержимом в памяти; содержимое на диске здесь не читается"""
+    if isinstance(content, InlineContent):
+        return trigram in content.data
+    if isinstance(content, MmapContent):
+        return content.mm.find(trigram, content.offset, content.offset + content.length) != -1
+    return False
+
+
+def _present(content, trigrams):
+    """Какие из trigrams есть в содержимом; файл на диске читается один раз для всех"""
+    if not isinstance(content, HostFileContent):
+        return {trigram for trigram in trigrams if _contains(content, trigram)}
+    found = set()
+    pending = set(trigrams)
+    tail = b""
+    # Буфер блока выделяется на каждый файл: у небольших файлов - по их размеру
+    for chunk in content.iter_chunks(max(1, min(HOST_SCAN_CHUNK, content.size))):
+        # Два последних байта предыдущего блока: триграмма может лежать на границе
+        block = tail + bytes(chunk)
+        for trigram in [trigram for trigram in pending if trigram in block]:
+            found.add(trigram)
+            pending.discard(trigram)
+        if not pending:
+            break
+        tail = block[-2:]
+    return found
+
+
+class _Candidates:
+    """Результат поиска по индексу; документы с номером от limit или другой эпохи не проверялись"""
+
+    __slots__ = ("epoch", "limit", "docs")
+
+    def __init__(self, epoch, limit, docs):
+        self.epoch = epoch
+        self.limit = limit
+        self.docs = docs
+
+
+class TrigramIndex:
+    """Инвертированный индекс: триграмма -> номера документов (array)
+
+    Список документов триграммы строится при первом запросе с ней - проверкой
+    всех документов поиском подстроки (в C, без копирования данных), - и при
+    следующих запросах дополняется документами, добавленными после. Полное
+    построение заранее стоило бы операции Python на каждую пару (файл,
+    триграмма), то есть десятков секунд на сотни тысяч файлов. Документы на
+    диске проверяются одним чтением файла на все новые триграммы запроса.
+    """
+
+    def __init__(self):
+        # Объект содержимого -> номер документа и номер -> слабая ссылка на объект
+        self._docs = weakref.WeakKeyDictionary()
+        self._contents = []
+        # Номера документов на диске (по возрастанию): их проверка - чтение файла
+        self._host_docs = array.array("I")
+        # Триграмма -> [номера документов, число проверенных документов]; порядок - порядок использования
+        self._postings = {}
+        self._entries = 0
+        self._dead = 0
+        # Меняется при перенумерации: номера из прежних результатов недействительны
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    @property
+    def trigram_count(self):
+        return len(self._postings)
+
+    def memory_bytes(self):
+        """Оценка памяти индекса: списки документов и таблицы номеров"""
+        with self._lock:
+            return (sys.getsizeof(self._postings) + sys.getsizeof(self._contents) + sys.getsizeof(self._host_docs)
+                    + sum(sys.getsizeof(doc_ids) for doc_ids, scanned in self._postings.values())
+                    + sys.getsizeof(self._docs.data) + 2 * len(self._contents) * sys.getsizeof(weakref.ref(self)))
+
+    @staticmethod
+    def indexable(content):
+        return isinstance(content, (InlineContent, MmapContent, HostFileContent))
+
+    def candidates(self, query):
+        """Документы, в которых есть все требования хотя бы одной ветки запроса
+
+        Списки всех триграмм запроса дополняются и пересекаются до обхода
+        файлов: при обходе проверяется только принадлежность результату.
+        """
+        with self._lock:
+            if query.required is None:
+                return _Candidates(self._epoch, len(self._contents), None)
+            self._update(query.trigrams)
+            found = set()
+            for required in query.required:
+                postings = sorted((self._lookup(variants) for variants in required), key=len)
+                docs = set(postings[0])
+                for doc_ids in postings[1:]:
+                    if not docs:
+                        break
+                    docs.intersection_update(doc_ids)
+                found |= docs
+            self._evict()
+            return _Candidates(self._epoch, len(self._contents), found)
+
+    def may_match(self, content, query, candidates):
+        """Может ли содержимое совпасть с запросом; новое содержимое добавляется в индекс"""
+        if query.required is None or not self.indexable(content):
+            return True
+        doc = self._docs.get(content)
+        if doc is None:
+            return self._add(content, query)
+        if candidates.epoch != self._epoch or doc >= candidates.limit:
+            return self._may_occur(content, query)
+        return doc in candidates.docs
+
+    @staticmethod
+    def _may_occur(content, query):
+        try:
+            return query.may_occur(content)
+        except OSError:
+            # Ошибку чтения покажет сам поиск
+            return True
+
+    def _lookup(self, variants):
+        if len(variants) == 1:
+            return self._postings[variants[0]][0]
+        docs = set()
+        for trigram in variants:
+            docs.update(self._postings[trigram][0])
+        return docs
+
+    def _entry(self, trigram):
+        entry = self._postings.pop(trigram, None)
+        if entry is None:
+            entry = [array.array("I"), 0]
+        self._postings[trigram] = entry
+        return entry
+
+    def _update(self, trigrams):
+        """Дополнение списков trigrams документами, добавленными после их построения"""
+        entries = [self._entry(trigram) for trigram in trigrams]
+        contents = self._contents
+        count = len(contents)
+        scanned = [entry[1] for entry in entries]
+        before = sum(len(entry[0]) for entry in entries)
+        # Документы в памяти - по триграмме (поиск в C), документы на диске - ниже, одним чтением
+        for trigram, entry in zip(trigrams, entries):
+            if entry[1] < count:
+                entry[0].extend(doc for doc in range(entry[1], count) if _contains(contents[doc](), trigram))
+                entry[1] = count
+        host_docs = self._host_docs
+        for doc in host_docs[bisect.bisect_left(host_docs, min(scanned, default=count)):]:
+            content = contents[doc]()
+            if content is None:
+                continue
+            pending = [(trigram, entry) for trigram, entry, start in zip(trigrams, entries, scanned) if start <= doc]
+            try:
+                present = _present(content, [trigram for trigram, entry in pending])
+            except OSError:
+                # Непрочитанный файл остается кандидатом, ошибку покажет сам поиск
+                present = {trigram for trigram, entry in pending}
+            for trigram, entry in pending:
+                if trigram in present:
+                    entry[0].append(doc)
+        self._entries += sum(len(entry[0]) for entry in entries) - before
+
+    def _evict(self):
+        while self._entries > POSTINGS_MAX_ENTRIES and len(self._postings) > 1:
+            doc_ids, scanned = self._postings.pop(next(iter(self._postings)))
+            self._entries -= len(doc_ids)
+
+    def _add(self, content, query):
+        """Новый документ; результат - проверка запроса по нему
+
+        Триграммы запроса проверяются одним чтением и сразу попадают в их
+        списки, если те проверены до этого документа включительно, поэтому файл
+        на диске не читается повторно при следующем запросе с теми же триграммами.
+        """
+        try:
+            present = _present(content, query.trigrams)
+        except OSError:
+            # Ошибку чтения покажет сам поиск; документ проверят следующие запросы
+            present = None
+        with self._lock:
+            if content not in self._docs:
+                doc = self._docs[content] = len(self._contents)
+                self._contents.append(weakref.ref(content, self._released))
+                if isinstance(content, HostFileContent):
+                    self._host_docs.append(doc)
+                if present is not None:
+                    for trigram in query.trigrams:
+                        entry = self._postings.get(trigram)
+                        if entry is not None and entry[1] == doc:
+                            if trigram in present:
+                                entry[0].append(doc)
+                                self._entries += 1
+                            entry[1] = doc + 1
+                if self._dead > max(COMPACT_MIN_DEAD, len(self._docs)):
+                    self._compact()
+        return present is None or query.satisfied_by(present)
+
+    def _released(self, ref):
+        self._dead += 1
+
+    def _compact(self):
+        """Перенумерация без документов, на которые больше нет ссылок; списки строятся заново"""
+        # Эпоха меняется до замены номеров: читатели без блокировки не смешают старые и новые
+        self._epoch += 1
+        live = [content for content in (ref() for ref in self._contents) if content is not None]
+        self._docs = weakref.WeakKeyDictionary((content, doc) for doc, content in enumerate(live))
+        self._contents = [weakref.ref(content, self._released) for content in live]
+        self._host_docs = array.array("I", (doc for doc, content in enumerate(live)
+                                            if isinstance(content, HostFileContent)))
+        self._postings = {}
+        self._entries = 0
+        self._dead = 0
+
+
+def candidate_files(tree, node, path, query):
+    """Файлы node или его поддерева, которые могут содержать совпадение: (путь, узел)"""
+    index = tree.text_index
+    candidates = index.candidates(query)
+    for file_path, item, depth in tree.walk(node, path):
+        if item.type == "file" and index.may_match(tree.content_of(item), query, candidates):
+            yield file_path, item
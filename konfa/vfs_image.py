@@ -0,0 +1,296 @@
+"""Бинарный образ VFS
+
+Формат файла (все числа little-endian):
+    заголовок   - сигнатура, версия, число узлов, смещения и размеры секций
+    узлы        - таблица записей фиксированного размера в порядке обхода в ширину,
+                  дети каждой директории лежат подряд, запись 0 - корень
+    строки      - имена узлов в UTF-8 (одинаковые имена хранятся один раз)
+    содержимое  - байты содержимого файлов
+
+При загрузке файл отображается в память (mmap), а записи узлов
+декодируются только при первом обращении к директории или файлу.
+
+Образ контрольной точки журнала для VFS из директории на диске (host_root)
+не копирует данные диска: файл, прочитанный с диска, записывается ссылкой -
+путем на диске, непрочитанная ленивая директория - только путем. У узлов
+сохраняется отметка состояния (stamp), поэтому после загрузки образ
+синхронизируется с диском как обычная VFS из директории (vfs_sync). Данные
+записываются только у файлов, созданных в VFS, и у прочитанных в память
+файлов, которые сами или вместе с директорией перемещены командой mv: путь
+в VFS у них больше не путь на диске. Имена перемещенных элементов диска
+(DirNode.hidden) записываются в список детей директории записями TYPE_HIDDEN.
+"""
+import mmap
+import os
+import struct
+from collections import deque
+
+from vfs_content import HostFileContent, MmapContent
+from vfs_tree import HostLoader, VFSTree
+
+IMAGE_MAGIC = b"VFSIMG\x00\x01"
+IMAGE_VERSION = 2
+
+# сигнатура, версия, число узлов, (смещение, размер) узлов, строк и содержимого
+HEADER = struct.Struct("<8sII6Q")
+# тип, флаги, смещение и длина имени, первый ребенок и число детей (у ссылок на диск - смещение
+# и длина пути в строках), смещение и длина содержимого, отметка (младшие и старшие 64 бита)
+NODE = struct.Struct("<BB2xIIIIQQQQ")
+# Версия 1: без флагов и отметок
+NODE_V1 = struct.Struct("<B3xIIIIQQ")
+
+TYPE_DIR = 1
+TYPE_FILE = 2
+# Ссылки на диск (только в образах с host_root)
+TYPE_HOST_DIR = 3
+TYPE_HOST_FILE = 4
+# Имя элемента диска, перемещенного из директории (DirNode.hidden); узла не создает
+TYPE_HIDDEN = 5
+
+# У записи сохранена отметка состояния на диске (stamp)
+FLAG_STAMP = 1
+_STAMP_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+class ImageError(Exception):
+    pass
+
+
+def save_image(tree, image_path, host_root=None):
+    """Запись всего дерева в образ; ленивые узлы при этом дочитываются
+
+    host_root - директория на диске, из которой загружено дерево: ее файлы и
+    непрочитанные директории записываются ссылками, без данных и без чтения.
+    """
+    tmp_path = image_path + ".tmp"
+    names = {}
+    strings = bytearray()
+    records = bytearray()
+    blob_offset = HEADER.size
+    blob_size = 0
+    # Одинаковое содержимое (общий объект из хранилища) записывается в образ один раз
+    written = {}
+
+    def string(text):
+        offset = names.get(text)
+        data = text.encode("utf-8")
+        if offset is None:
+            offset = names[text] = len(strings)
+            strings.extend(data)
+        return offset, len(data)
+
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+
+        # Обход в ширину: индексы детей директории получаются последовательными
+        # located - узел на своем месте на диске: он и все предки прочитаны с диска и не перемещались
+        queue = deque([(tree.root, "", host_root is not None)])
+        next_index = 1
+        count = 0
+        while queue:
+            node, path, located = queue.popleft()
+            count += 1
+            if isinstance(node, str):
+                records += NODE.pack(TYPE_HIDDEN, 0, *string(node), 0, 0, 0, 0, 0, 0)
+                continue
+            name_offset, name_len = string(node.name)
+            stamp = node.stamp if located else None
+            located = stamp is not None
+            if stamp is None:
+                flags = stamp_low = stamp_high = 0
+            else:
+                flags, stamp_low, stamp_high = FLAG_STAMP, stamp & _STAMP_MASK, stamp >> 64
+
+            if node.type == "dir":
+                if host_root is not None and not node.loaded and isinstance(node.source, str):
+                    records += NODE.pack(TYPE_HOST_DIR, 0, name_offset, name_len, *string(node.source), 0, 0, 0, 0)
+                    continue
+                tree.ensure_loaded(node)
+                children = list(node.children.values())
+                queue.extend((child, f"{path}/{child.name}", located) for child in children)
+                if located and node.hidden:
+                    # Скрытые имена нужны только синхронизации, то есть директориям на своем месте на диске
+                    hidden = sorted(node.hidden)
+                    children += hidden
+                    queue.extend((name, path, False) for name in hidden)
+                records += NODE.pack(TYPE_DIR, flags, name_offset, name_len, next_index, len(children), 0, 0,
+                                     stamp_low, stamp_high)
+                next_index += len(children)
+                continue
+
+            host_path = _host_path(node, host_root, path, located) if host_root is not None else None
+            if host_path is not None:
+                records += NODE.pack(TYPE_HOST_FILE, flags, name_offset, name_len, *string(host_path), 0, 0,
+                                     stamp_low, stamp_high)
+                continue
+            content = tree.content_of(node)
+            blob = written.get(id(content))
+            if blob is None:
+                length = 0
+                for chunk in content.iter_chunks():
+                    f.write(chunk)
+                    length += len(chunk)
+                blob = written[id(content)] = (content, blob_offset + blob_size, length)
+                blob_size += length
+            records += NODE.pack(TYPE_FILE, flags, name_offset, name_len, 0, 0, blob[1], blob[2],
+                                 stamp_low, stamp_high)
+
+        nodes_offset = blob_offset + blob_size
+        f.write(records)
+        strings_offset = nodes_offset + len(records)
+        f.write(strings)
+
+        f.seek(0)
+        f.write(HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, count,
+                            nodes_offset, len(records), strings_offset, len(strings),
+                            blob_offset, blob_size))
+
+    os.replace(tmp_path, image_path)
+    return count
+
+
+def _host_path(node, host_root, path, located):
+    """Путь на диске файла, прочитанного с host_root; None - данные пишутся в образ
+
+    У ленивых файлов и файлов больше INLINE_CONTENT_LIMIT путь известен. У
+    прочитанных в память он совпадает с путем в VFS, только пока ни файл, ни
+    его директории не перемещались (located); иначе путь в VFS указывал бы на
+    другой файл диска.
+    """
+    if isinstance(node.source, str):
+        return node.source
+    if isinstance(node.content, HostFileContent):
+        return node.content.real_path
+    if not located:
+        return None
+    host_path = os.path.join(host_root, path.lstrip("/"))
+    return host_path if os.path.isfile(host_path) else None
+
+
+class ImageLoader:
+    """Ленивое декодирование узлов из отображенного в память образа; source узла - номер записи
+
+    Узлы-ссылки на диск (source - путь) читаются с диска, как при ленивой загрузке из директории.
+    """
+
+    def __init__(self, image_path):
+        self._contents = {}
+        self.host = HostLoader()
+        with open(image_path, "rb") as f:
+            try:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ImageError("пустой файл образа")
+
+        if self.mm.size() < HEADER.size:
+            raise ImageError("файл слишком мал для образа VFS")
+        (magic, version, self.node_count,
+         self.nodes_offset, nodes_size, self.strings_offset, self.strings_size,
+         self.blob_offset, self.blob_size) = HEADER.unpack_from(self.mm, 0)
+        if magic != IMAGE_MAGIC:
+            raise ImageError("неверная сигнатура образа VFS")
+        if version not in (1, IMAGE_VERSION):
+            raise ImageError(f"неподдерживаемая версия образа: {version}")
+        self.node = NODE if version == IMAGE_VERSION else NODE_V1
+        size = self.mm.size()
+        if (not self.node_count or nodes_size != self.node_count * self.node.size
+                or self.nodes_offset + nodes_size > size or self.strings_offset + self.strings_size > size
+                or self.blob_offset + self.blob_size > size):
+            raise ImageError("образ поврежден")
+
+    def _record(self, index):
+        """(тип, флаги, смещение и длина имени, первый ребенок и число детей,
+        смещение и длина содержимого, отметка или None)"""
+        if not 0 <= index < self.node_count:
+            raise ImageError("образ поврежден: ссылка на несуществующий узел")
+        record = self.node.unpack_from(self.mm, self.nodes_offset + index * self.node.size)
+        if self.node is NODE_V1:
+            node_type, name_offset, name_len, first, count, offset, length = record
+            return node_type, 0, name_offset, name_len, first, count, offset, length, None
+        node_type, flags, name_offset, name_len, first, count, offset, length, stamp_low, stamp_high = record
+        stamp = (stamp_high << 64) | stamp_low if flags & FLAG_STAMP else None
+        return node_type, flags, name_offset, name_len, first, count, offset, length, stamp
+
+    def _name(self, offset, length):
+        if offset + length > self.strings_size:
+            raise ImageError("образ поврежден: строка вне секции строк")
+        start = self.strings_offset + offset
+        try:
+            return self.mm[start:start + length].decode("utf-8")
+        except UnicodeDecodeError:
+            raise ImageError("образ поврежден: имя не в UTF-8")
+
+    def attach_root(self, tree):
+        node_type, _, _, _, first, count, _, _, stamp = self._record(0)
+        if node_type not in (TYPE_DIR, TYPE_HOST_DIR):
+            raise ImageError("образ поврежден: корень не директория")
+        tree.attach_lazy(tree.root, self._name(first, count) if node_type == TYPE_HOST_DIR else 0)
+        tree.root.stamp = stamp
+
+    def list_children(self, tree, node):
+        if isinstance(node.source, str):
+            self.host.list_children(tree, node)
+            return
+        _, _, _, _, first, count, _, _, _ = self._record(node.source)
+        # Обход в ширину: дети лежат после родителя, поэтому ссылки назад означали бы цикл
+        if first <= node.source or first + count > self.node_count:
+            raise ImageError("образ поврежден: неверный список детей")
+        hidden = []
+        for index in range(first, first + count):
+            node_type, _, name_offset, name_len, first_child, child_count, _, _, stamp = self._record(index)
+            name = self._name(name_offset, name_len)
+            if node_type == TYPE_HIDDEN:
+                hidden.append(name)
+                continue
+            if node_type == TYPE_DIR:
+                child = tree.add_dir(node, name)
+                tree.attach_lazy(child, index)
+            elif node_type == TYPE_HOST_DIR:
+                child = tree.add_dir(node, name)
+                tree.attach_lazy(child, self._name(first_child, child_count))
+            elif node_type == TYPE_HOST_FILE:
+                child = tree.add_lazy_file(node, name, self._name(first_child, child_count))
+            elif node_type == TYPE_FILE:
+                child = tree.add_lazy_file(node, name, index)
+            else:
+                raise ImageError(f"образ поврежден: неизвестный тип узла {node_type}")
+            child.stamp = stamp
+        if hidden:
+            node.hidden = frozenset(hidden)
+
+    def open_content(self, node):
+        if isinstance(node.source, str):
+            return HostFileContent(node.source)
+        _, _, _, _, _, _, offset, length, _ = self._record(node.source)
+        if offset < self.blob_offset or offset + length > self.blob_offset + self.blob_size:
+            raise ImageError("образ поврежден: содержимое вне секции содержимого")
+        # Файлы с общим блоком образа получают общий объект содержимого
+        key = (offset, length)
+        content = self._contents.get(key)
+        if content is None:
+            content = self._contents[key] = MmapContent(self.mm, offset, length)
+        return content
+
+
+def load_image(image_path):
+    """Открытие образа: в памяти создается только корень, остальное - по требованию"""
+    loader = ImageLoader(image_path)
+    tree = VFSTree()
+    tree.loader = loader
+    loader.attach_root(tree)
+    return tree, loader.node_count
+
+
+def expand_image(tree):
+    """Декодирование всех директорий образа; директории-ссылки на диск остаются ленивыми
+
+    Нужно перед синхронизацией с диском: она проверяет только прочитанные директории.
+    """
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        if not node.loaded:
+            if isinstance(node.source, str):
+                continue
+            tree.ensure_loaded(node)
+        stack.extend(child for child in node.children.values() if child.type == "dir")
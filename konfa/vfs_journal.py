@@ -0,0 +1,281 @@
+"""Журнал изменений VFS (--journal) с контрольными точками
+
+Каждое изменение дерева (mkdir, touch, mv) дописывается в конец журнала
+одной строкой JSON. Первая строка журнала - заголовок со ссылкой на
+контрольную точку: образ VFS (vfs_image), в котором уже учтены все
+предыдущие изменения. При следующем запуске загружается контрольная точка
+(или исходная VFS, если ее еще нет) и применяются только записи после нее,
+поэтому время восстановления пропорционально числу изменений с последней
+контрольной точки, а не размеру дерева и не длине выполненных скриптов.
+
+Каждые checkpoint_every записей (и после restore и load-image) журнал
+сжимается: дерево сохраняется в новый образ, а журнал атомарно заменяется
+одним заголовком. Сбой на любом шаге оставляет либо прежнюю пару (образ,
+журнал), либо новую.
+
+Если VFS загружена из директории на диске, источником остается директория:
+заголовок хранит ее путь (host), а образ контрольной точки - только ссылки
+на прочитанные с диска файлы и директории (vfs_image, host_root). При
+запуске образ синхронизируется с директорией, поэтому изменения на диске
+(reload, --watch) в журнал не пишутся и контрольных точек не требуют.
+
+Режимы записи на диск (sync):
+    always - каждая запись сбрасывается на диск (fsync) сразу;
+    batch  - записи копятся и сбрасываются пачкой: при BATCH_RECORDS записях
+             или через BATCH_SECONDS после первой из них (при сбое системы
+             теряется не больше этого окна);
+    none   - записи передаются ОС сразу, fsync не вызывается (переживают
+             падение процесса, но не системы).
+"""
+import glob
+import json
+import os
+import threading
+
+from vfs_image import save_image
+
+JOURNAL_VERSION = 1
+SYNC_MODES = ("always", "batch", "none")
+BATCH_RECORDS = 256
+BATCH_SECONDS = 0.05
+DEFAULT_CHECKPOINT_EVERY = 10000
+
+
+class JournalError(Exception):
+    pass
+
+
+def _fsync_path(path):
+    """fsync файла или директории по пути (директории - только там, где это поддерживается)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    def __init__(self, path, sync="batch", checkpoint_every=DEFAULT_CHECKPOINT_EVERY):
+        if sync not in SYNC_MODES:
+            raise ValueError(f"неизвестный режим записи журнала: {sync}")
+        self.path = path
+        self.sync = sync
+        self.checkpoint_every = checkpoint_every
+        # Полный путь к текущей контрольной точке (None - журнал применяется к исходной VFS)
+        self.checkpoint_path = None
+        # Директория на диске - источник VFS контрольной точки (None - образ содержит все данные)
+        self.checkpoint_host = None
+        self.seq = 0
+        # Записей после контрольной точки
+        self.records_since_checkpoint = 0
+        self.checkpoints = 0
+        self._file = None
+        self._pending = []
+        self._timer = None
+        self._lock = threading.RLock()
+
+    @property
+    def checkpoint_due(self):
+        return bool(self.checkpoint_every) and self.records_since_checkpoint >= self.checkpoint_every
+
+    def open(self):
+        """Чтение журнала: (путь к контрольной точке или None, записи после нее)
+
+        Оборванная последняя строка (сбой во время записи) отбрасывается;
+        поврежденные строки в середине - JournalError.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        header = None
+        records = []
+        if os.path.exists(self.path):
+            header, records, valid_size = self._read()
+            size = os.path.getsize(self.path)
+            if header is None and size:
+                raise JournalError("файл не является журналом VFS")
+            if valid_size != size:
+                with open(self.path, "r+b") as f:
+                    f.truncate(valid_size)
+
+        if header is None:
+            self._rewrite(None, 0)
+        else:
+            checkpoint = header.get("checkpoint")
+            self.checkpoint_path = os.path.join(directory, checkpoint) if checkpoint else None
+            self.checkpoint_host = header.get("host") if checkpoint else None
+            if self.checkpoint_path and not os.path.exists(self.checkpoint_path):
+                raise JournalError(f"нет файла контрольной точки '{self.checkpoint_path}'")
+            self.seq = records[-1].get("seq", 0) if records else header.get("seq", 0)
+            self.records_since_checkpoint = len(records)
+
+        self._remove_orphans()
+        self._file = open(self.path, "ab")
+        return self.checkpoint_path, records
+
+    def _read(self):
+        header = None
+        records = []
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            lines = f.read().split(b"\n")
+        # После последнего '\n' - пустая строка или оборванная запись, она отбрасывается
+        lines.pop()
+        for number, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict):
+                if header is None:
+                    raise JournalError("файл не является журналом VFS")
+                if number == len(lines):
+                    # Последняя строка могла быть записана не полностью
+                    break
+                raise JournalError(f"строка {number} повреждена")
+            if header is None:
+                if record.get("journal") != JOURNAL_VERSION:
+                    raise JournalError("файл не является журналом VFS или его версия не поддерживается")
+                header = record
+            else:
+                records.append(record)
+            valid_size += len(line) + 1
+        return header, records, valid_size
+
+    def _remove_orphans(self):
+        """Образы, оставшиеся от прерванного сжатия журнала"""
+        for image_path in glob.glob(glob.escape(self.path) + ".*.img"):
+            if os.path.abspath(image_path) != os.path.abspath(self.checkpoint_path or ""):
+                try:
+                    os.remove(image_path)
+                except OSError:
+                    pass
+
+    def append(self, record):
+        """Запись изменения (словарь с полем op) в журнал"""
+        with self._lock:
+            self.seq += 1
+            record = dict(record, seq=self.seq)
+            self._pending.append(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.records_since_checkpoint += 1
+            if self.sync != "batch" or len(self._pending) >= BATCH_RECORDS:
+                self._write()
+            elif self._timer is None:
+                self._timer = threading.Timer(BATCH_SECONDS, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Сброс накопленных записей на диск"""
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending or self._file is None:
+            return
+        self._file.write(b"".join(self._pending))
+        self._pending.clear()
+        self._file.flush()
+        if self.sync != "none":
+            os.fsync(self._file.fileno())
+
+    def checkpoint(self, tree, host_root=None):
+        """Сжатие журнала: дерево сохраняется в новую контрольную точку, журнал очищается
+
+        host_root - директория на диске, из которой загружено дерево: данные с
+        нее в образ не копируются (см. save_image).
+        """
+        with self._lock:
+            self._write()
+            image_path = f"{self.path}.{self.seq}.img"
+            count = save_image(tree, image_path, host_root)
+            if self.sync != "none":
+                _fsync_path(image_path)
+            self._file.close()
+            self._file = None
+            try:
+                self._rewrite(os.path.basename(image_path), self.seq, host_root)
+            finally:
+                self._file = open(self.path, "ab")
+            self.checkpoint_host = host_root
+
+            old_checkpoint, self.checkpoint_path = self.checkpoint_path, image_path
+            if old_checkpoint and os.path.abspath(old_checkpoint) != os.path.abspath(image_path):
+                try:
+                    os.remove(old_checkpoint)
+                except OSError:
+                    pass
+            self.records_since_checkpoint = 0
+            self.checkpoints += 1
+            return count
+
+    def _rewrite(self, checkpoint, seq, host=None):
+        """Атомарная замена журнала одним заголовком"""
+        header = {"journal": JOURNAL_VERSION, "checkpoint": checkpoint, "seq": seq}
+        if host is not None:
+            header["host"] = host
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n")
+            f.flush()
+            if self.sync != "none":
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if self.sync != "none":
+            _fsync_path(os.path.dirname(os.path.abspath(self.path)))
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._write()
+            self._file.close()
+            self._file = None
+
+
+def _split(path):
+    parent_path, _, name = path.rstrip("/").rpartition("/")
+    return parent_path or "/", name
+
+
+def apply_record(tree, record):
+    """Повтор одной записи журнала над деревом; JournalError - запись неприменима"""
+    op = record.get("op")
+    path = record.get("path")
+    if op not in ("mkdir", "touch", "mv") or not isinstance(path, str) or not path.startswith("/"):
+        raise JournalError(f"неизвестная запись: {record}")
+
+    parent_path, name = _split(path)
+    if op == "mv":
+        node = tree.resolve(path)
+        target_path, new_name = record.get("to"), record.get("name")
+        new_parent = tree.resolve(target_path) if isinstance(target_path, str) else None
+        if node is None or node is tree.root or not new_name:
+            raise JournalError(f"mv: нет '{path}'")
+        if new_parent is None or new_parent.type != "dir":
+            raise JournalError(f"mv: нет директории '{target_path}'")
+        if f"{target_path.rstrip('/')}/".startswith(f"{path.rstrip('/')}/"):
+            raise JournalError(f"mv: '{path}' нельзя переместить в собственную поддиректорию")
+        tree.ensure_loaded(new_parent)
+        if new_parent.children.get(new_name, node) is not node:
+            raise JournalError(f"mv: '{target_path.rstrip('/')}/{new_name}' уже существует")
+        tree.move(path, target_path, new_name)
+        return
+
+    parent = tree.resolve(parent_path)
+    if parent is None or parent.type != "dir" or not name:
+        raise JournalError(f"{op}: нет директории '{parent_path}'")
+    tree.ensure_loaded(parent)
+    if name in parent.children:
+        raise JournalError(f"{op}: '{path}' уже существует")
+    parent = tree.resolve(parent_path, for_write=True)
+    if op == "mkdir":
+        tree.add_dir(parent, name)
+    else:
+        tree.add_file(parent, name)
@@ -0,0 +1,72 @@
+"""Вывод эмулятора
+
+Все команды пишут через OutputSink: текст накапливается в буфере и
+записывается в поток крупными блоками. В тихом режиме выводятся только
+ошибки и итоги выполнения скриптов. Запись и сброс буфера выполняются под
+блокировкой: при --watch в тот же вывод пишет поток синхронизации.
+"""
+import sys
+import threading
+
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+
+class OutputSink:
+    # Вывод передается следующей команде конвейера (vfs_pipe.PipeSink): без заголовков
+    piped = False
+
+    def __init__(self, stream=None, quiet=False, buffer_size=OUTPUT_BUFFER_SIZE):
+        self.stream = stream if stream is not None else sys.stdout
+        self.quiet = quiet
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+        # RLock: _append сбрасывает заполненный буфер, уже владея блокировкой
+        self._lock = threading.RLock()
+
+    def _append(self, text):
+        with self._lock:
+            self._parts.append(text)
+            self._size += len(text)
+            if self._size >= self.buffer_size:
+                self.flush()
+
+    def write(self, text):
+        """Обычный вывод без перевода строки (например, содержимое файла)"""
+        if not self.quiet:
+            self._append(text)
+
+    def line(self, text=""):
+        if not self.quiet:
+            self._append(text + "\n")
+
+    def error(self, text):
+        """Сообщение об ошибке - выводится и в тихом режиме"""
+        self._append(text + "\n")
+
+    def summary(self, text=""):
+        """Итоговая информация - выводится и в тихом режиме"""
+        self._append(text + "\n")
+
+    def forward(self, text):
+        """Вывод, уже отфильтрованный другим OutputSink (например, в рабочем процессе)"""
+        self._append(text)
+
+    def flush(self):
+        with self._lock:
+            if self._parts:
+                self.stream.write("".join(self._parts))
+                self._parts = []
+                self._size = 0
+            self.stream.flush()
+
+    def close(self):
+        self.flush()
+        if self.stream not in (sys.stdout, sys.stderr):
+            self.stream.close()
+
+
+def open_output(path=None, quiet=False):
+    """Вывод в файл (--output) или на экран"""
+    stream = open(path, "w", encoding="utf-8") if path else None
+    return OutputSink(stream, quiet=quiet)
@@ -0,0 +1,86 @@
+"""Разрешение путей эмулятора: канонический путь и кеш узлов
+
+Путь приводится к каноническому виду по компонентам: '.', '..' (выше корня
+остается корень), повторные '/' и '~' в начале (домашняя директория - по
+умолчанию корень VFS). Результат разрешения - (канонический путь, узел) -
+хранится в LRU-кеше с ключом (текущая директория, путь в том виде, как он
+введен), поэтому повторяющиеся в скрипте пути разбираются и ищутся в дереве
+один раз.
+
+Кеш действителен, пока не изменилась структура дерева: VFSTree.version
+увеличивается при создании, копировании (копирование при записи),
+перемещении и удалении узлов и при restore. При несовпадении версии или
+смене дерева (load-image) кеш очищается целиком.
+"""
+import collections
+
+PATH_CACHE_SIZE = 4096
+
+
+def canonical_path(cwd, path, home="/"):
+    """Абсолютный путь без '.', '..', '~' и повторных '/'; cwd - канонический путь"""
+    if not path or path == ".":
+        return cwd
+    if path == "~" or path.startswith("~/"):
+        path = home + path[1:]
+    parts = [] if path.startswith("/") else [part for part in cwd.split("/") if part]
+    for part in path.split("/"):
+        if not part or part == ".":
+            continue
+        if part == "..":
+            if parts:
+                parts.pop()
+        else:
+            parts.append(part)
+    return "/" + "/".join(parts)
+
+
+class PathResolver:
+    """LRU-кеш (текущая директория, путь) -> (канонический путь, узел или None)
+
+    Свой у каждого эмулятора (сеансы сервера не делят кеш между потоками).
+    """
+
+    def __init__(self, maxsize=PATH_CACHE_SIZE, home="/"):
+        self.maxsize = maxsize
+        self.home = home
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+        self._tree = None
+        self._version = None
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _check(self, tree):
+        if tree is not self._tree or tree.version != self._version:
+            self._cache.clear()
+            self._tree = tree
+            self._version = tree.version
+
+    def normalize(self, cwd, path):
+        """Канонический путь (без поиска узла, например для создаваемых объектов)"""
+        entry = self._cache.get((cwd, path))
+        if entry is not None:
+            return entry[0]
+        return canonical_path(cwd, path, self.home)
+
+    def resolve(self, tree, cwd, path):
+        """(канонический путь, узел или None) для path относительно cwd"""
+        self._check(tree)
+        key = (cwd, path)
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        canonical = canonical_path(cwd, path, self.home)
+        entry = (canonical, tree.resolve(canonical))
+        # Поиск мог прочитать ленивые директории: прежние записи (в том числе "нет узла") устарели
+        self._check(tree)
+        self._cache[key] = entry
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return entry
@@ -0,0 +1,307 @@
+"""Конвейеры команд: команда1 | фильтр | фильтр ...
+
+Вывод первой команды не накапливается: OutputSink заменяется на PipeSink,
+который режет вывод на строки и по одной передает их цепочке фильтров
+(head, tail, wc, sort, uniq). Каждый фильтр передает строки следующему, а
+последний - в настоящий вывод. Когда фильтру больше не нужны строки (head
+получил N строк), PipeSink прерывает команду исключением PipeClosed, как
+SIGPIPE в оболочке: find перестает обходить дерево, cat - читать файл.
+
+Память: head, wc и uniq хранят O(1) строк, tail -n N - последние N строк,
+sort - все строки (сортировка требует полного ввода).
+"""
+import collections
+import shlex
+
+# Фильтры, которые могут читать вывод предыдущей команды конвейера
+FILTER_COMMANDS = ("head", "tail", "wc", "sort", "uniq")
+DEFAULT_LINES = 10
+_WC_FLAGS = "lwc"
+
+
+class PipeError(Exception):
+    pass
+
+
+class PipeClosed(BaseException):
+    """Следующей команде конвейера больше не нужен ввод
+
+    Наследуется от BaseException, чтобы обработчики `except Exception` внутри
+    команд (например, выполнение скрипта) не приняли его за ошибку.
+    """
+
+
+def split_pipeline(line):
+    """Части строки между символами '|' вне кавычек (экранированный \\| - обычный символ)"""
+    parts = []
+    start = 0
+    quote = None
+    i = 0
+    while i < len(line):
+        ch = line[i]
+        if ch == "\\" and quote != "'":
+            i += 2
+            continue
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "|":
+            parts.append(line[start:i])
+            start = i + 1
+        i += 1
+    parts.append(line[start:])
+    return parts
+
+
+def parse_pipeline(line):
+    """Команды конвейера: [(команда, аргументы), ...]; пустая строка - []
+
+    ValueError - ошибка разбора (незакрытая кавычка, пустая команда между '|').
+    """
+    segments = split_pipeline(line)
+    stages = []
+    for segment in segments:
+        parts = shlex.split(segment)
+        if not parts:
+            if len(segments) == 1:
+                return []
+            raise ValueError("пустая команда в конвейере")
+        stages.append((parts[0], parts[1:]))
+    return stages
+
+
+class LineFilter:
+    """Фильтр строк; feed возвращает False, когда больше строк не нужно"""
+
+    def __init__(self, downstream):
+        self.downstream = downstream
+
+    def feed(self, line):
+        return self.downstream.feed(line)
+
+    def finish(self):
+        """Конец ввода: вывод накопленных строк"""
+        self.downstream.finish()
+
+    def _emit_all(self, lines):
+        for line in lines:
+            if not self.downstream.feed(line):
+                break
+        self.downstream.finish()
+
+
+class HeadFilter(LineFilter):
+    def __init__(self, downstream, count=DEFAULT_LINES):
+        super().__init__(downstream)
+        self.remaining = count
+
+    def feed(self, line):
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return self.downstream.feed(line) and self.remaining > 0
+
+
+class TailFilter(LineFilter):
+    def __init__(self, downstream, count=DEFAULT_LINES):
+        super().__init__(downstream)
+        self.lines = collections.deque(maxlen=count)
+
+    def feed(self, line):
+        self.lines.append(line)
+        return True
+
+    def finish(self):
+        self._emit_all(self.lines)
+
+
+class WcFilter(LineFilter):
+    """Строки, слова и байты (в UTF-8, с переводами строк)"""
+
+    def __init__(self, downstream, flags=_WC_FLAGS):
+        super().__init__(downstream)
+        self.flags = flags
+        self.lines = self.words = self.bytes = 0
+
+    def feed(self, line):
+        self.lines += 1
+        self.words += len(line.split())
+        self.bytes += len(line.encode("utf-8")) + 1
+        return True
+
+    def finish(self):
+        counts = {"l": self.lines, "w": self.words, "c": self.bytes}
+        self._emit_all([" ".join(str(counts[flag]) for flag in _WC_FLAGS if flag in self.flags)])
+
+
+def _numeric_key(line):
+    """Ключ sort -n: число в начале строки, строки без числа - как 0"""
+    text = line.lstrip()
+    end = 1 if text[:1] in "+-" else 0
+    while end < len(text) and (text[end].isdigit() or text[end] == "."):
+        end += 1
+    try:
+        return float(text[:end]), line
+    except ValueError:
+        return 0.0, line
+
+
+class SortFilter(LineFilter):
+    def __init__(self, downstream, reverse=False, numeric=False, unique=False):
+        super().__init__(downstream)
+        self.reverse = reverse
+        self.numeric = numeric
+        self.unique = unique
+        self.lines = []
+
+    def feed(self, line):
+        self.lines.append(line)
+        return True
+
+    def finish(self):
+        lines = set(self.lines) if self.unique else self.lines
+        self._emit_all(sorted(lines, key=_numeric_key if self.numeric else None, reverse=self.reverse))
+
+
+class UniqFilter(LineFilter):
+    """Повторяющиеся подряд строки выводятся один раз (-c - с числом повторов)"""
+
+    def __init__(self, downstream, count=False):
+        super().__init__(downstream)
+        self.count = count
+        self.previous = None
+        self.repeats = 0
+
+    def _emit_previous(self):
+        if self.count:
+            return self.downstream.feed(f"{self.repeats:7d} {self.previous}")
+        return self.downstream.feed(self.previous)
+
+    def feed(self, line):
+        if line == self.previous:
+            self.repeats += 1
+            return True
+        if self.previous is not None and not self._emit_previous():
+            return False
+        self.previous = line
+        self.repeats = 1
+        return True
+
+    def finish(self):
+        if self.previous is not None:
+            self._emit_previous()
+        self.downstream.finish()
+
+
+class OutputLines:
+    """Конец цепочки фильтров: строки выводятся через OutputSink"""
+
+    def __init__(self, output):
+        self.output = output
+
+    def feed(self, line):
+        self.output.line(line)
+        return True
+
+    def finish(self):
+        pass
+
+
+def _line_count(value):
+    try:
+        count = int(value)
+    except ValueError:
+        count = -1
+    if count < 0:
+        raise PipeError(f"неверное число строк: '{value}'")
+    return count
+
+
+def parse_filter(command, args):
+    """Разбор аргументов фильтра: (функция downstream -> LineFilter, пути к файлам)"""
+    paths = []
+    count = DEFAULT_LINES
+    flags = set()
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if command in ("head", "tail") and arg == "-n":
+            if i + 1 >= len(args):
+                raise PipeError("отсутствует аргумент для '-n'")
+            count = _line_count(args[i + 1])
+            i += 2
+            continue
+        if command in ("head", "tail") and arg[:1] == "-" and arg[1:].isdigit():
+            count = int(arg[1:])
+        elif arg[:1] == "-" and len(arg) > 1:
+            allowed = {"wc": _WC_FLAGS, "sort": "rnu", "uniq": "c"}.get(command, "")
+            unknown = set(arg[1:]) - set(allowed)
+            if unknown:
+                raise PipeError(f"неизвестный ключ '-{''.join(sorted(unknown))}'")
+            flags.update(arg[1:])
+        else:
+            paths.append(arg)
+        i += 1
+
+    if command == "head":
+        return lambda downstream: HeadFilter(downstream, count), paths
+    if command == "tail":
+        return lambda downstream: TailFilter(downstream, count), paths
+    if command == "wc":
+        return lambda downstream: WcFilter(downstream, "".join(sorted(flags)) or _WC_FLAGS), paths
+    if command == "sort":
+        return lambda downstream: SortFilter(downstream, "r" in flags, "n" in flags, "u" in flags), paths
+    if command == "uniq":
+        return lambda downstream: UniqFilter(downstream, "c" in flags), paths
+    raise PipeError("команда не читает вывод конвейера")
+
+
+class PipeSink:
+    """Вывод команды внутри конвейера: строки передаются фильтрам
+
+    Ошибки и итоги идут мимо конвейера в исходный вывод (как stderr).
+    """
+
+    piped = True
+
+    def __init__(self, output, downstream):
+        self.output = output
+        self.downstream = downstream
+        self.quiet = False
+        self.closed = False
+        self._partial = ""
+
+    def write(self, text):
+        if self.closed:
+            raise PipeClosed()
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        feed = self.downstream.feed
+        for line in lines:
+            if not feed(line):
+                self.closed = True
+                raise PipeClosed()
+
+    def line(self, text=""):
+        self.write(text + "\n")
+
+    def error(self, text):
+        self.output.error(text)
+
+    def summary(self, text=""):
+        self.output.summary(text)
+
+    def forward(self, text):
+        self.write(text)
+
+    def flush(self):
+        self.output.flush()
+
+    def finish(self):
+        """Конец вывода команды: последняя строка без перевода строки и итоги фильтров"""
+        if not self.closed and self._partial:
+            self.closed = not self.downstream.feed(self._partial)
+        self._partial = ""
+        self.downstream.finish()
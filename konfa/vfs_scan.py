@@ -0,0 +1,120 @@
+"""Параллельная полная загрузка директории с диска
+
+Списки директорий (os.scandir) и чтение небольших файлов (вместе с хешем
+для хранилища содержимого) выполняются в пуле потоков, а узлы дерева
+создаются только в основном потоке по мере готовности результатов.
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from vfs_content import INLINE_CONTENT_LIMIT, HostFileContent, InlineContent, content_digest
+from vfs_tree import file_stamp
+
+# Сколько небольших файлов читается одной задачей пула
+READ_BATCH_SIZE = 64
+
+
+class ScanStats:
+    """Итоги загрузки: число объектов, суммарный размер файлов, время"""
+
+    def __init__(self):
+        self.entries = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def summary(self):
+        seconds = max(self.seconds, 1e-9)
+        return (f"{self.entries} объектов, {self.bytes} байт за {self.seconds:.2f} с "
+                f"({self.entries / seconds:.0f} объектов/с, {self.bytes / seconds / 1024 ** 2:.1f} МБ/с)")
+
+
+def list_directory(real_path):
+    """mtime директории и ее элементы: (имя, путь, это_директория, размер, mtime)
+
+    Тип берется из DirEntry; mtime директории читается до списка элементов.
+    """
+    items = []
+    try:
+        mtime = os.stat(real_path).st_mtime_ns
+        with os.scandir(real_path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                    if is_dir:
+                        size = file_mtime = None
+                    else:
+                        st = entry.stat()
+                        size, file_mtime = st.st_size, st.st_mtime_ns
+                except OSError:
+                    is_dir, size, file_mtime = False, None, None
+                items.append((entry.name, entry.path, is_dir, size, file_mtime))
+    except OSError as e:
+        return None, items, e
+    return mtime, items, None
+
+
+def read_files(paths):
+    contents = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            contents.append(InlineContent(data, content_digest(data)))
+        except OSError:
+            # Нечитаемый файл остается ссылкой на диск, ошибка будет показана при чтении
+            contents.append(None)
+    return contents
+
+
+def scan_host_directory(tree, real_path, root, workers=None, report=print):
+    """Полная загрузка real_path в узел root; workers - размер пула (None - по числу CPU)"""
+    stats = ScanStats()
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(list_directory, real_path): ("dir", root, real_path)}
+
+        def flush(batch):
+            pending[pool.submit(read_files, [node.content.real_path for node in batch])] = ("read", batch, None)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, target, path = pending.pop(future)
+
+                if kind == "read":
+                    for node, content in zip(target, future.result()):
+                        if content is not None:
+                            tree.set_content(node, content)
+                    continue
+
+                mtime, items, error = future.result()
+                target.stamp = mtime
+                if error is not None:
+                    report(f"Ошибка сканирования {path}: {error}")
+
+                batch = []
+                for name, item_path, is_dir, size, file_mtime in items:
+                    stats.entries += 1
+                    if is_dir:
+                        child = tree.add_dir(target, name)
+                        pending[pool.submit(list_directory, item_path)] = ("dir", child, item_path)
+                        continue
+
+                    node = tree.add_file(target, name, HostFileContent(item_path, 0, size))
+                    if size is not None:
+                        node.stamp = file_stamp(size, file_mtime)
+                        stats.bytes += size
+                        if size <= INLINE_CONTENT_LIMIT:
+                            batch.append(node)
+                            if len(batch) >= READ_BATCH_SIZE:
+                                flush(batch)
+                                batch = []
+                if batch:
+                    flush(batch)
+
+    # Итоги поддеревьев для du/tree: размеры файлов уже известны, диск не читается
+    tree.usage(root)
+    stats.seconds = time.perf_counter() - started
+    return stats
@@ -0,0 +1,123 @@
+"""Компиляция скриптов эмулятора
+
+Скрипт один раз разбирается в список шагов (комментарий, команда с уже
+разобранными аргументами и фильтрами конвейера или ошибка разбора). Результат кешируется в памяти
+и на диске (__vfscache__ рядом со скриптом) с ключом по пути, размеру и
+времени изменения файла, поэтому повторный запуск неизмененного скрипта
+не выполняет лексический разбор. Кеш на диске хранится в JSON: при чтении
+не выполняется код, даже если файл в __vfscache__ подменен (например, в /tmp).
+"""
+import json
+import os
+
+from vfs_pipe import parse_pipeline
+
+SCRIPT_CACHE_DIR = "__vfscache__"
+SCRIPT_CACHE_VERSION = 3
+
+STEP_COMMENT = 0
+STEP_COMMAND = 1
+STEP_PARSE_ERROR = 2
+
+# абсолютный путь -> (подпись файла, шаги)
+_memory_cache = {}
+
+
+class ScriptStep:
+    """Шаг скрипта: для команды - имя, аргументы и фильтры конвейера ((имя, аргументы), ...),
+    для комментария и ошибки - текст"""
+
+    __slots__ = ("line_num", "kind", "line", "command", "args", "filters")
+
+    def __init__(self, line_num, kind, line, command=None, args=(), filters=()):
+        self.line_num = line_num
+        self.kind = kind
+        self.line = line
+        self.command = command
+        self.args = args
+        self.filters = filters
+
+    def to_tuple(self):
+        return self.line_num, self.kind, self.line, self.command, self.args, self.filters
+
+
+def parse_script(lines):
+    """Разбор строк скрипта в шаги; пустые строки пропускаются"""
+    steps = []
+    for line_num, line in enumerate(lines, 1):
+        line = line.strip()
+
+        if not line:
+            continue
+        if line.startswith('#'):
+            steps.append(ScriptStep(line_num, STEP_COMMENT, line[1:].strip()))
+            continue
+
+        try:
+            (command, args), *filters = parse_pipeline(line)
+        except ValueError as e:
+            steps.append(ScriptStep(line_num, STEP_PARSE_ERROR, line, args=(str(e),)))
+            continue
+        steps.append(ScriptStep(line_num, STEP_COMMAND, line, command, args, tuple(filters)))
+    return steps
+
+
+def _signature(stat):
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _disk_cache_path(script_path):
+    directory, name = os.path.split(script_path)
+    return os.path.join(directory, SCRIPT_CACHE_DIR, name + ".json")
+
+
+def _step_from_row(row):
+    """Шаг из строки JSON-кеша (списки вместо кортежей)"""
+    line_num, kind, line, command, args, filters = row
+    return ScriptStep(line_num, kind, line, command, list(args),
+                      tuple((name, list(filter_args)) for name, filter_args in filters))
+
+
+def _load_disk_cache(script_path, signature):
+    try:
+        with open(_disk_cache_path(script_path), "r", encoding="utf-8") as f:
+            version, cached_signature, rows = json.load(f)
+        if version != SCRIPT_CACHE_VERSION or tuple(cached_signature) != signature:
+            return None
+        return [_step_from_row(row) for row in rows]
+    except (OSError, ValueError, TypeError):
+        # Нет кеша, поврежденный или чужой формат - скрипт разбирается заново
+        return None
+
+
+def _save_disk_cache(script_path, signature, steps):
+    cache_path = _disk_cache_path(script_path)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([SCRIPT_CACHE_VERSION, signature, [step.to_tuple() for step in steps]],
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Кеш на диске необязателен (например, директория только для чтения)
+        pass
+
+
+def compile_script(script_path):
+    """Шаги скрипта с использованием кеша в памяти и на диске"""
+    script_path = os.path.abspath(script_path)
+    signature = _signature(os.stat(script_path))
+
+    cached = _memory_cache.get(script_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    steps = _load_disk_cache(script_path, signature)
+    if steps is None:
+        with open(script_path, 'r', encoding='utf-8') as f:
+            steps = parse_script(f)
+        _save_disk_cache(script_path, signature, steps)
+
+    _memory_cache[script_path] = (signature, steps)
+    return steps
@@ -0,0 +1,205 @@
+"""Режим сервера (--serve): много сеансов над одной загруженной VFS
+
+Сервер asyncio принимает соединения по TCP (хост:порт) или Unix-сокету.
+Каждое соединение - отдельный сеанс (VFSEmulator.new_session) со своей
+текущей директорией, историей и выводом, но с общим деревом. Команды
+выполняются в пуле потоков: читающие - одновременно, изменяющие дерево
+(mkdir, touch, mv, snapshot, restore, reload, checkpoint) - по одной,
+без параллельных читателей. reload проверяет диск без блокировки и берет
+ее только на применение найденных изменений.
+"""
+import asyncio
+import contextlib
+import os
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from vfs_output import OutputSink
+
+# Команды, изменяющие общее дерево
+MUTATING_COMMANDS = frozenset({"mkdir", "touch", "mv", "snapshot", "restore", "reload", "checkpoint"})
+# Команды без блокировки: шаги скрипта блокируются по отдельности, reload проверяет диск
+# без блокировки и берет блокировку записи только на применение изменений
+UNGUARDED_COMMANDS = frozenset({"run-script", "reload"})
+# Команды, недоступные в сеансах (заменили бы дерево только у одного сеанса)
+SESSION_DISABLED_COMMANDS = frozenset({"load-image"})
+
+SESSION_BUFFER_SIZE = 64 * 1024
+# Очередь ожидающих соединений: сотни клиентов могут подключаться одновременно
+SERVER_BACKLOG = 1024
+
+
+class ReadWriteLock:
+    """Блокировка читатели/писатель с приоритетом писателя"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    def guard(self, command):
+        """Контекстный менеджер для VFSEmulator.command_guard"""
+        if command in UNGUARDED_COMMANDS:
+            return contextlib.nullcontext()
+        if command in MUTATING_COMMANDS:
+            return _Guard(self.acquire_write, self.release_write)
+        return _Guard(self.acquire_read, self.release_read)
+
+
+class _Guard:
+    __slots__ = ("_release", "_acquire")
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, *exc_info):
+        self._release()
+
+
+class SocketStream:
+    """Поток для OutputSink сеанса: запись из рабочего потока в соединение asyncio"""
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def write(self, text):
+        self.loop.call_soon_threadsafe(self.writer.write, text.encode("utf-8"))
+
+    def flush(self):
+        # Ожидание отправки: большой вывод (cat) не накапливается в памяти сервера
+        asyncio.run_coroutine_threadsafe(self.writer.drain(), self.loop).result()
+
+    def close(self):
+        """Соединение закрывает сам сеанс"""
+
+
+def parse_address(address):
+    """'хост:порт' или ':порт' - TCP, иначе путь к Unix-сокету"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return "tcp", (host or "127.0.0.1", int(port))
+    return "unix", address
+
+
+class VFSServer:
+    def __init__(self, emulator, address, workers=None):
+        self.emulator = emulator
+        self.address = address
+        self.lock = ReadWriteLock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vfs-session")
+        self.sessions = 0
+        self.total_sessions = 0
+
+    def _open_session(self, output):
+        session = self.emulator.new_session(output)
+        session.command_guard = self.lock.guard
+        for name in SESSION_DISABLED_COMMANDS:
+            session.commands[name] = self._disabled_command(session, name)
+        session.print_welcome()
+        session.output.write(session.prompt_text())
+        session.output.flush()
+        return session
+
+    @staticmethod
+    def _disabled_command(session, name):
+        def handler(args, original_input):
+            session.error(f"{name}: команда недоступна в режиме сервера")
+            return False
+        return handler
+
+    @staticmethod
+    def _execute(session, user_input):
+        try:
+            session.execute_line(user_input)
+        except ConnectionError:
+            raise
+        except Exception as e:
+            session.error(f"Неожиданная ошибка: {e}")
+        if session.running:
+            session.output.write(session.prompt_text())
+        session.output.flush()
+
+    async def _handle_session(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        output = OutputSink(SocketStream(loop, writer), buffer_size=SESSION_BUFFER_SIZE)
+        self.sessions += 1
+        self.total_sessions += 1
+        try:
+            session = await loop.run_in_executor(self.pool, self._open_session, output)
+            while session.running:
+                line = await reader.readline()
+                if not line:
+                    break
+                user_input = line.decode("utf-8", errors="replace")
+                await loop.run_in_executor(self.pool, self._execute, session, user_input)
+        except (ConnectionError, ValueError):
+            # Клиент отключился или прислал слишком длинную строку
+            pass
+        finally:
+            self.sessions -= 1
+            writer.close()
+
+    async def serve(self):
+        kind, target = parse_address(self.address)
+        if kind == "tcp":
+            server = await asyncio.start_server(self._handle_session, *target, backlog=SERVER_BACKLOG)
+        else:
+            _remove_stale_socket(target)
+            server = await asyncio.start_unix_server(self._handle_session, target, backlog=SERVER_BACKLOG)
+
+        self.emulator.echo(f"Сервер VFS запущен: {self.address} ({self.emulator.vfs.node_count} объектов)")
+        self.emulator.output.flush()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if kind == "unix":
+                _remove_stale_socket(target)
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            self.emulator.echo(f"Сервер остановлен, обслужено сеансов: {self.total_sessions}")
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _remove_stale_socket(path):
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except OSError:
+        pass
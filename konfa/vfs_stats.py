@@ -0,0 +1,126 @@
+"""Статистика выполнения команд
+
+Для каждой команды считаются вызовы, ошибки и гистограмма задержек
+(логарифмические корзины: 8 корзин на каждое удвоение, от 1 мкс), по которой
+оцениваются p50/p95/p99 при постоянном объеме памяти.
+"""
+import contextlib
+import cProfile
+import math
+import os
+
+BUCKETS_PER_DOUBLING = 8
+MIN_LATENCY = 1e-6
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= MIN_LATENCY:
+            bucket = 0
+        else:
+            bucket = int(math.log2(seconds / MIN_LATENCY) * BUCKETS_PER_DOUBLING) + 1
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """Оценка перцентиля: верхняя граница корзины (не больше максимума)"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(MIN_LATENCY * 2 ** (bucket / BUCKETS_PER_DOUBLING), self.max)
+        return self.max
+
+
+class CommandStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+
+    def to_dict(self):
+        latency = self.latency
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_s": latency.total,
+            "p50_s": latency.percentile(50),
+            "p95_s": latency.percentile(95),
+            "p99_s": latency.percentile(99),
+            "max_s": latency.max,
+        }
+
+
+class EmulatorStats:
+    """Статистика сеанса: команды и загрузка VFS"""
+
+    def __init__(self):
+        self.commands = {}
+        self.load_seconds = None
+        self.load_nodes = None
+        self.load_source = None
+
+    def record(self, command, seconds, ok):
+        stats = self.commands.get(command)
+        if stats is None:
+            stats = self.commands[command] = CommandStats()
+        stats.calls += 1
+        if not ok:
+            stats.errors += 1
+        stats.latency.record(seconds)
+
+    def record_load(self, source, seconds, nodes):
+        self.load_source = source
+        self.load_seconds = seconds
+        self.load_nodes = nodes
+
+    def reset(self):
+        self.commands = {}
+
+    def to_dict(self, node_count=None):
+        return {
+            "vfs": {
+                "source": self.load_source,
+                "load_s": self.load_seconds,
+                "loaded_nodes": self.load_nodes,
+                "nodes": node_count,
+            },
+            "commands": {name: stats.to_dict() for name, stats in sorted(self.commands.items())},
+        }
+
+
+@contextlib.contextmanager
+def cprofile_run(profile_path):
+    """Профилирование одного запуска скрипта через cProfile с сохранением в файл pstats"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+
+def cprofile_hook(profile_path):
+    """Хук для VFSEmulator.script_profiler: принимает путь скрипта, возвращает контекст"""
+    return lambda script_file: cprofile_run(profile_path)
+
+
+def process_memory():
+    """Резидентная память процесса (RSS) в байтах; None - недоступно (нет /proc)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
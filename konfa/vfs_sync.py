@@ -0,0 +1,267 @@
+"""Синхронизация загруженной VFS с директорией на диске (reload, --watch)
+
+У объектов, прочитанных с диска, хранится отметка состояния (stamp): mtime
+директории или размер и mtime файла (file_stamp). При синхронизации
+проверяется mtime каждой директории; список элементов перечитывается только
+у изменившихся. Отметки уже загруженных файлов сравниваются при каждой
+синхронизации (один stat на файл), поэтому дописанный или перезаписанный на
+месте файл находят и reload, и --watch. reload --full дополнительно
+сравнивает содержимое файлов, хранящихся в памяти, с диском (изменение без
+смены размера и mtime). Изменения применяются через копирование при записи,
+поэтому снимки сохраняют прежнее состояние. Объекты, созданные в VFS (mkdir,
+touch) или перемещенные командой mv, не затрагиваются, а элементы диска,
+перемещенные mv, не добавляются заново по прежнему пути.
+
+Синхронизация идет в два этапа. Проверка диска (scan_host_changes: stat
+директорий и файлов, чтение изменившихся списков) выполняется в пуле
+потоков по снимку дерева и не держит блокировку команд, поэтому --watch
+не останавливает команды и сеансы сервера на время обхода. Блокировка
+берется только на применение найденного (apply_host_changes).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from vfs_content import INLINE_CONTENT_LIMIT, HostFileContent, InlineContent
+from vfs_scan import list_directory, read_files, scan_host_directory
+from vfs_tree import file_stamp
+
+
+class SyncStats:
+    def __init__(self):
+        self.added = 0
+        self.removed = 0
+        self.modified = 0
+        self.dirs = 0
+        self.files = 0
+        self.seconds = 0.0
+
+    def changed(self):
+        return bool(self.added or self.removed or self.modified)
+
+    def summary(self):
+        return (f"+{self.added} -{self.removed} ~{self.modified}; проверено директорий: {self.dirs}, "
+                f"файлов: {self.files} за {self.seconds:.3f} с")
+
+
+def _is_local(node):
+    """Объект создан в VFS, а не прочитан с диска"""
+    return node.stamp is None and node.loaded
+
+
+def _file_content(path, size, lazy):
+    if not lazy and size is not None and size <= INLINE_CONTENT_LIMIT:
+        content = read_files([path])[0]
+        if content is not None:
+            return content
+    return HostFileContent(path, 0, size)
+
+
+def _content_changed(content, path):
+    """Содержимое в памяти отличается от файла на диске (reload --full)
+
+    Содержимое-ссылка на диск (HostFileContent) и так читается с диска.
+    """
+    if not isinstance(content, InlineContent):
+        return False
+    try:
+        with open(path, "rb") as f:
+            return f.read() != content.data
+    except OSError:
+        return False
+
+
+def _file_changed(child, path, size, mtime, full):
+    return file_stamp(size, mtime) != child.stamp or (full and _content_changed(child.content, path))
+
+
+class HostChanges:
+    """Результат проверки диска (scan_host_changes): изменения, которые осталось применить к дереву"""
+
+    def __init__(self):
+        # Директории с другим составом: (путь в VFS, путь на диске, прежняя отметка, mtime, элементы)
+        self.dirs = []
+        # Измененные файлы: (путь в VFS, путь на диске, прежняя отметка, размер, mtime)
+        self.files = []
+        self.stats = SyncStats()
+
+    def __bool__(self):
+        return bool(self.dirs or self.files)
+
+
+def _check_directory(host_path, stamp, files, full):
+    """Проверка одной директории диска (в пуле потоков): (mtime, элементы, измененные файлы, ошибка)
+
+    files - (имя, узел) файлов диска в директории. Если mtime совпадает с
+    stamp, элементы - None, а файлы проверяются по одному stat; иначе
+    читается список директории. Ошибка stat директории - с элементами None
+    (директорию удалили: это увидит проверка родителя), ошибка чтения списка - с [].
+    """
+    try:
+        mtime = os.stat(host_path).st_mtime_ns
+    except OSError as e:
+        return None, None, [], e
+    changed = []
+    if mtime == stamp:
+        for name, child in files:
+            path = os.path.join(host_path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if _file_changed(child, path, st.st_size, st.st_mtime_ns, full):
+                changed.append((name, path, child.stamp, st.st_size, st.st_mtime_ns))
+        return mtime, None, changed, None
+
+    mtime, items, error = list_directory(host_path)
+    if error is not None:
+        return None, [], [], error
+    host = {item[0]: item for item in items}
+    for name, child in files:
+        entry = host.get(name)
+        if entry is not None and not entry[2] and _file_changed(child, entry[1], entry[3], entry[4], full):
+            changed.append((name, entry[1], child.stamp, entry[3], entry[4]))
+    return mtime, items, changed, None
+
+
+def scan_host_changes(root, real_path, full=False, workers=None, report=print):
+    """Сравнение прочитанной части дерева с директорией real_path без изменения дерева
+
+    root - корень снимка (VFSTree.snapshot): его узлы не меняются, поэтому
+    проверка идет без блокировки команд. Директории проверяются в пуле потоков.
+    """
+    changes = HostChanges()
+    stats = changes.stats
+    started = time.perf_counter()
+
+    # Обход по уровням: директории одного уровня проверяются в пуле, по готовности
+    # всего уровня из их результатов собирается следующий
+    level = [("/", real_path, root)] if root.loaded else []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while level:
+            tasks = []
+            for vfs_path, host_path, node in level:
+                files = [(name, child) for name, child in node.children.items()
+                         if child.type == "file" and child.stamp is not None]
+                stats.dirs += 1
+                stats.files += len(files)
+                tasks.append((host_path, node.stamp, files, full))
+            results = pool.map(_check_directory, *zip(*tasks))
+
+            next_level = []
+            for (vfs_path, host_path, node), (mtime, items, changed, error) in zip(level, results):
+                if error is not None:
+                    if node is root or items is not None:
+                        report(f"Ошибка синхронизации {host_path}: {error}")
+                    continue
+                prefix = vfs_path if vfs_path != "/" else ""
+                changes.files.extend((f"{prefix}/{name}", path, stamp, size, file_mtime)
+                                     for name, path, stamp, size, file_mtime in changed)
+                host_dirs = None
+                if items is not None:
+                    changes.dirs.append((vfs_path, host_path, node.stamp, mtime, items))
+                    host_dirs = {item[0] for item in items if item[2]}
+                for name, child in node.children.items():
+                    # Непрочитанная ленивая директория будет прочитана с диска при обращении
+                    if (child.type == "dir" and child.loaded and not _is_local(child)
+                            and (host_dirs is None or name in host_dirs)):
+                        next_level.append((f"{prefix}/{name}", os.path.join(host_path, name), child))
+            level = next_level
+
+    stats.seconds = time.perf_counter() - started
+    return changes
+
+
+def apply_host_changes(tree, changes, lazy=False, workers=None, report=print):
+    """Применение изменений, найденных scan_host_changes, к дереву (под блокировкой команд)
+
+    Директория или файл, измененные в VFS после проверки (другая отметка,
+    перемещение, замена дерева), пропускаются: их проверит следующая синхронизация.
+    """
+    stats = changes.stats
+    started = time.perf_counter()
+
+    for vfs_path, host_path, stamp, mtime, items in changes.dirs:
+        directory = tree.resolve(vfs_path)
+        if directory is None or directory.type != "dir" or not directory.loaded or directory.stamp != stamp:
+            continue
+        directory = tree.resolve(vfs_path, for_write=True)
+        host = {item[0]: item for item in items}
+
+        for name, child in list(directory.children.items()):
+            if _is_local(child):
+                continue
+            entry = host.get(name)
+            if entry is None or entry[2] != (child.type == "dir"):
+                stats.removed += tree.remove(directory, name)
+
+        hidden = directory.hidden or ()
+        for name, item_path, is_dir, size, file_mtime in items:
+            if name in directory.children or name in hidden:
+                continue
+            if is_dir:
+                child = tree.add_dir(directory, name)
+                stats.added += 1
+                if lazy:
+                    tree.attach_lazy(child, item_path)
+                else:
+                    stats.added += scan_host_directory(tree, item_path, child, workers, report).entries
+            else:
+                if lazy:
+                    child = tree.add_lazy_file(directory, name, item_path)
+                else:
+                    child = tree.add_file(directory, name, _file_content(item_path, size, lazy))
+                if size is not None:
+                    child.stamp = file_stamp(size, file_mtime)
+                stats.added += 1
+        directory.stamp = mtime
+
+    for vfs_path, host_path, stamp, size, mtime in changes.files:
+        node = tree.resolve(vfs_path)
+        if node is None or node.type != "file" or node.stamp != stamp:
+            continue
+        _modify(tree, vfs_path, host_path, size, mtime, lazy)
+        stats.modified += 1
+
+    stats.seconds += time.perf_counter() - started
+    return stats
+
+
+def resync_host_directory(tree, real_path, lazy=False, full=False, workers=None, report=print):
+    """Применение изменений директории real_path к дереву, загруженному из нее (без параллельных команд)"""
+    changes = scan_host_changes(tree.root, real_path, full, workers, report)
+    return apply_host_changes(tree, changes, lazy, workers, report)
+
+
+def _modify(tree, vfs_path, host_path, size, mtime, lazy):
+    node = tree.resolve(vfs_path, for_write=True)
+    tree.set_content(node, _file_content(host_path, size, lazy))
+    node.stamp = file_stamp(size, mtime)
+
+
+def exclusive_guard():
+    """command_guard для интерактивного режима с --watch: команды и синхронизация по очереди"""
+    lock = threading.RLock()
+    return lambda command: lock
+
+
+class HostWatcher(threading.Thread):
+    """Периодическая синхронизация (--watch) в фоновом потоке; блокировка команд - только на применение"""
+
+    def __init__(self, emulator, interval, guard):
+        super().__init__(name="vfs-watch", daemon=True)
+        self.emulator = emulator
+        self.interval = interval
+        self.guard = guard
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            stats = self.emulator.resync_vfs(guard=self.guard)
+            if stats is not None and stats.changed():
+                self.emulator.echo(f"\n[watch] VFS синхронизирована: {stats.summary()}")
+                self.emulator.output.flush()
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,807 @@
+import bisect
+import fnmatch
+import itertools
+import os
+import sys
+import threading
+
+from vfs_content import BlobStore, HostFileContent, InlineContent
+from vfs_grep import TrigramIndex
+
+# Поколения узлов: узел изменяется на месте, только если его поколение
+# совпадает с поколением дерева, иначе он общий со снимком и копируется
+_generations = itertools.count(1)
+# Номера inode общие для всех деревьев: копия узла сохраняет номер оригинала
+_inodes = itertools.count(1)
+
+
+# Ключи ordered_children: по имени, по размеру (большие первыми), директории перед файлами
+ORDER_KEYS = ("name", "size", "type")
+
+
+def _child_name(node):
+    return node.name
+
+
+def file_stamp(size, mtime_ns):
+    """Отметка состояния файла на диске одним числом (вместо кортежа размер, mtime)"""
+    return (size << 64) | (mtime_ns & 0xFFFFFFFFFFFFFFFF)
+
+
+# Корзина индекса имен: пара (узел, родитель), если узел с таким именем один,
+# иначе словарь узел -> родитель. Большинство имен на диске уникальны, а пара
+# в четыре раза меньше словаря из одного элемента.
+
+def _bucket_add(index, node, parent):
+    """Запись родителя узла в индекс; True - имя новое"""
+    bucket = index.get(node.name)
+    if bucket is None or (type(bucket) is tuple and bucket[0] is node):
+        index[node.name] = (node, parent)
+        return bucket is None
+    if type(bucket) is tuple:
+        index[node.name] = {bucket[0]: bucket[1], node: parent}
+    else:
+        bucket[node] = parent
+    return False
+
+
+def _bucket_remove(index, node):
+    """Удаление узла из индекса; True - узлов с таким именем больше нет"""
+    bucket = index[node.name]
+    if type(bucket) is tuple:
+        del index[node.name]
+        return True
+    del bucket[node]
+    if len(bucket) == 1:
+        index[node.name] = next(iter(bucket.items()))
+    return False
+
+
+def _bucket_nodes(bucket):
+    if bucket is None:
+        return ()
+    return (bucket[0],) if type(bucket) is tuple else list(bucket)
+
+
+class VFSNode:
+    """Узел дерева VFS (inode): директория (DirNode) или файл (FileNode)
+
+    Узлов в дереве миллионы, поэтому у них нет __dict__ (только слоты), тип -
+    атрибут класса, а не поле узла, поля директории есть только у директорий,
+    имена интернированы (одинаковые имена в разных директориях - одна строка),
+    а номер inode выдается только при первом обращении (сравнение снимков).
+    """
+
+    __slots__ = ("_ino", "name", "gen", "source", "stamp")
+
+    @property
+    def ino(self):
+        if self._ino is None:
+            self._ino = next(_inodes)
+        return self._ino
+
+    def is_dir(self):
+        return self.type == "dir"
+
+
+class DirNode(VFSNode):
+    __slots__ = ("children", "loaded", "usage", "order", "hidden")
+    type = "dir"
+    content = None
+
+    def __init__(self, name, gen, ino=None):
+        self._ino = ino
+        self.name = name
+        self.gen = gen
+        # Источник для ленивой загрузки; loaded=False - список элементов еще не прочитан
+        self.source = None
+        # Состояние на диске для reload: mtime директории или file_stamp() файла;
+        # None - объект создан в VFS (mkdir, touch) или еще не прочитан
+        self.stamp = None
+        # Словарь имя -> узел
+        self.children = {}
+        self.loaded = True
+        # Итоги поддерева (байт в файлах, файлов, директорий); None - не подсчитаны
+        self.usage = None
+        # Упорядоченные списки детей: ключ сортировки -> кортеж узлов; None - не построены
+        self.order = None
+        # Имена элементов диска, перемещенных отсюда командой mv (frozenset):
+        # синхронизация не добавляет их заново; None - таких нет
+        self.hidden = None
+
+
+class FileNode(VFSNode):
+    __slots__ = ("content",)
+    type = "file"
+    children = None
+    loaded = True
+    usage = None
+
+    def __init__(self, name, gen, content=None, ino=None):
+        self._ino = ino
+        self.name = name
+        self.gen = gen
+        self.source = None
+        self.stamp = None
+        # Объект содержимого (vfs_content); None - ленивый файл еще не открыт
+        self.content = content
+
+
+class VFSSnapshot:
+    """Неизменяемое состояние дерева: корень и счетчики на момент снимка"""
+
+    __slots__ = ("root", "node_count", "unloaded_dirs")
+
+    def __init__(self, root, node_count, unloaded_dirs):
+        self.root = root
+        self.node_count = node_count
+        self.unloaded_dirs = unloaded_dirs
+
+
+class _LoadState:
+    """Ленивая загрузка, общая у версий дерева (fork): блокировка и счетчик прочитанных общих директорий"""
+
+    __slots__ = ("lock", "shared_loads")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.shared_loads = 0
+
+
+class VFSTree:
+    """Дерево inode: директории ссылаются на детей по имени
+
+    Ссылки на родителя хранятся в индексе имен дерева, а не в узлах, поэтому
+    поддеревья могут быть общими у нескольких версий дерева (снимки, fork).
+    Изменения копируют только узлы на пути от корня (копирование при записи).
+    """
+
+    def __init__(self):
+        self.node_count = 0
+        self.gen = next(_generations)
+        # Счетчик изменений структуры (узлы созданы, заменены копиями, перемещены, удалены):
+        # по нему кеш путей (vfs_path) узнает, что найденные узлы устарели
+        self.version = 0
+        # Индекс имен: имя -> (узел, родитель) или {узел: родитель} в порядке добавления;
+        # None - индекс еще не построен (после restore/fork), строится при первом обращении
+        self.name_index = {}
+        self._sorted_names = None
+        # Загрузчик ленивых узлов и число еще не прочитанных директорий
+        self.loader = None
+        # Куда сообщать об ошибках загрузки (эмулятор подставляет свой вывод)
+        self.report = print
+        self.unloaded_dirs = 0
+        # Содержимое файлов в памяти (общее для всех версий дерева)
+        self.blobs = BlobStore()
+        # Триграммный индекс содержимого для grep (тоже общий: объекты содержимого не изменяются)
+        self.text_index = TrigramIndex()
+        # Ленивая загрузка может идти из нескольких потоков (сеансы сервера) и версий дерева (fork)
+        self._loading = _LoadState()
+        self._shared_loads_seen = 0
+        self.root = self._new_node("", "dir")
+
+    def _new_node(self, name, node_type, parent=None, content=None):
+        # Новый узел получает поколение родителя: дети ленивой общей директории остаются общими
+        name = sys.intern(name)
+        gen = parent.gen if parent is not None else self.gen
+        node = DirNode(name, gen) if node_type == "dir" else FileNode(name, gen, content)
+        self.node_count += 1
+        self.version += 1
+        if parent is not None:
+            parent.children[name] = node
+            parent.order = None
+            self._index_add(node, parent)
+        return node
+
+    def add_dir(self, parent, name):
+        """Новая директория; parent - из resolve(..., for_write=True) или читаемая ленивая директория"""
+        return self._new_node(name, "dir", parent)
+
+    def add_file(self, parent, name, content=None):
+        return self._new_node(name, "file", parent, self._store(content if content is not None else InlineContent()))
+
+    def _store(self, content):
+        """Данные в памяти сохраняются в хранилище (одинаковые - один раз), остальное - как есть"""
+        if isinstance(content, InlineContent):
+            return self.blobs.intern(content.data, content.digest)
+        return content
+
+    def set_content(self, node, content):
+        """Замена содержимого файла; node - из resolve(..., for_write=True) или только что созданный"""
+        node.content = self._store(content)
+
+    def content_usage(self):
+        """Содержимое в памяти по прочитанной части дерева: (логический размер, число файлов)"""
+        logical = 0
+        files = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            for child in node.children.values():
+                if child.type == "dir":
+                    if child.loaded:
+                        stack.append(child)
+                elif isinstance(child.content, InlineContent):
+                    logical += child.content.size
+                    files += 1
+        return logical, files
+
+    def memory_usage(self):
+        """Оценка памяти структуры по прочитанной части дерева (sys.getsizeof), байт по категориям
+
+        Общие с другими версиями дерева узлы учитываются один раз; данные файлов
+        (BlobStore) и индекс grep - отдельными строками.
+        """
+        usage = dict.fromkeys(("nodes", "children", "names", "stamps", "contents", "name_index"), 0)
+        dirs = files = 0
+        names = set()
+        contents = set()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            usage["nodes"] += sys.getsizeof(node)
+            if node.stamp is not None:
+                usage["stamps"] += sys.getsizeof(node.stamp)
+            if id(node.name) not in names:
+                names.add(id(node.name))
+                usage["names"] += sys.getsizeof(node.name)
+            if node.type == "dir":
+                dirs += 1
+                usage["children"] += sys.getsizeof(node.children)
+                if node.hidden:
+                    usage["children"] += sys.getsizeof(node.hidden)
+                if node.order:
+                    # Упорядоченные списки детей для ls
+                    usage["children"] += sys.getsizeof(node.order) + sum(map(sys.getsizeof, node.order.values()))
+                if node.usage is not None:
+                    usage["stamps"] += sys.getsizeof(node.usage) + sum(map(sys.getsizeof, node.usage))
+                if node.loaded:
+                    stack.extend(node.children.values())
+            else:
+                files += 1
+                content = node.content
+                if content is not None and id(content) not in contents:
+                    contents.add(id(content))
+                    usage["contents"] += sys.getsizeof(content) + sys.getsizeof(getattr(content, "digest", None))
+        if self.name_index is not None:
+            usage["name_index"] = sys.getsizeof(self.name_index) + sum(map(sys.getsizeof, self.name_index.values()))
+        usage["dirs"] = dirs
+        usage["files"] = files
+        usage["unique_names"] = len(names)
+        return usage
+
+    @classmethod
+    def from_paths(cls, table):
+        """Построение дерева из словаря путь -> описание (формат стандартной VFS)"""
+        tree = cls()
+
+        def build(node, path):
+            for name in table[path]["children"]:
+                child_path = f"{path}/{name}" if path != "/" else f"/{name}"
+                entry = table[child_path]
+                if entry["type"] == "dir":
+                    build(tree.add_dir(node, name), child_path)
+                else:
+                    tree.add_file(node, name, InlineContent(entry.get("content", "").encode("utf-8")))
+
+        build(tree.root, "/")
+        return tree
+
+    # === Индекс имен ===
+
+    def _index_add(self, node, parent):
+        if self.name_index is None:
+            return
+        if _bucket_add(self.name_index, node, parent):
+            self._sorted_names = None
+
+    def _index_remove(self, node):
+        if self.name_index is None:
+            return
+        if _bucket_remove(self.name_index, node):
+            self._sorted_names = None
+
+    def _ensure_index(self):
+        """Построение индекса обходом прочитанной части дерева (после restore/fork)
+
+        Заодно пересчитываются число узлов и непрочитанных директорий: общие
+        ленивые директории могли быть прочитаны через другую версию дерева.
+        """
+        self._check_shared_loads()
+        if self.name_index is not None:
+            return
+        with self._loading.lock:
+            if self.name_index is not None:
+                return
+            index = {}
+            count = 1
+            unloaded = 0
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                if not node.loaded:
+                    unloaded += 1
+                if not node.children:
+                    continue
+                for child in node.children.values():
+                    _bucket_add(index, child, node)
+                    count += 1
+                    if child.type == "dir":
+                        stack.append(child)
+            self.node_count = count
+            self.unloaded_dirs = unloaded
+            self._sorted_names = None
+            self.name_index = index
+
+    def _check_shared_loads(self):
+        """Сброс индекса имен, если общие директории прочитаны через другую версию дерева
+
+        Прочитанная общая директория заполняется на месте, и ее новые дети есть
+        только в индексе дерева, которое ее прочитало. Остальные версии строят
+        индекс и счетчики узлов заново при следующем обращении.
+        """
+        shared_loads = self._loading.shared_loads
+        if shared_loads != self._shared_loads_seen:
+            self._shared_loads_seen = shared_loads
+            self.name_index = None
+            self._sorted_names = None
+
+    def parent_of(self, node):
+        if node is self.root:
+            return None
+        self._ensure_index()
+        bucket = self.name_index[node.name]
+        return bucket[1] if type(bucket) is tuple else bucket[node]
+
+    def names_with_prefix(self, prefix):
+        """Имена из индекса, начинающиеся с prefix (бинарный поиск по отсортированному списку)"""
+        self._ensure_index()
+        if self._sorted_names is None:
+            self._sorted_names = sorted(self.name_index)
+        names = self._sorted_names
+        i = bisect.bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            yield names[i]
+            i += 1
+
+    def _matching_names(self, substring=None, glob=None):
+        self._ensure_index()
+        if glob is not None:
+            prefix = glob
+            for i, ch in enumerate(glob):
+                if ch in "*?[":
+                    prefix = glob[:i]
+                    break
+            else:
+                # Шаблон без спецсимволов - точное совпадение
+                return [glob] if glob in self.name_index else []
+            names = self.names_with_prefix(prefix) if prefix else list(self.name_index)
+            return [n for n in names if fnmatch.fnmatchcase(n, glob)]
+        return [n for n in self.name_index if substring in n]
+
+    def depth_under(self, node, ancestor):
+        """Глубина node относительно ancestor или None, если узел вне поддерева"""
+        depth = 0
+        while node is not ancestor:
+            node = self.parent_of(node)
+            if node is None:
+                return None
+            depth += 1
+        return depth
+
+    def find(self, start, start_path, substring=None, glob=None, regex=None,
+             node_type=None, size_test=None, maxdepth=None):
+        """Поиск в поддереве start; результаты (путь, узел) выдаются по мере нахождения
+
+        При поиске по имени кандидаты берутся из индекса имен, иначе
+        обходится только запрошенное поддерево.
+        """
+        def accept(path, node):
+            if node_type and node.type != node_type:
+                return False
+            if size_test and not size_test(self.file_size(node) if node.type == "file" else 0):
+                return False
+            return regex is None or regex.fullmatch(path) is not None
+
+        if substring or glob is not None:
+            self._ensure_index()
+        if (substring or glob is not None) and not self.unloaded_dirs:
+            for name in self._matching_names(substring, glob):
+                for node in _bucket_nodes(self.name_index.get(name)):
+                    depth = self.depth_under(node, start)
+                    if depth is None or (maxdepth is not None and depth > maxdepth):
+                        continue
+                    path = self.path_of(node)
+                    if accept(path, node):
+                        yield path, node
+            return
+
+        for path, node, depth in self.walk(start, start_path, maxdepth):
+            if substring and substring not in node.name:
+                continue
+            if glob is not None and (node is self.root or not fnmatch.fnmatchcase(node.name, glob)):
+                continue
+            if accept(path, node):
+                yield path, node
+
+    # === Разрешение путей ===
+
+    def resolve(self, path, for_write=False):
+        """Поиск узла по абсолютному пути обходом компонентов
+
+        for_write=True - узлы на пути заменяются собственными копиями дерева,
+        и результат можно изменять (добавлять детей, переименовывать). Итоги
+        поддеревьев и упорядоченные списки детей на пути сбрасываются и будут
+        пересчитаны при запросе.
+        """
+        self._check_shared_loads()
+        node = self._own(self.root, None) if for_write else self.root
+        if for_write:
+            node.usage = node.order = None
+        for part in path.split("/"):
+            if not part:
+                continue
+            if node.type != "dir":
+                return None
+            self.ensure_loaded(node)
+            child = node.children.get(part)
+            if child is None:
+                return None
+            if for_write:
+                node = self._own(child, node)
+                if node.type == "dir":
+                    node.usage = node.order = None
+            else:
+                node = child
+        return node
+
+    def path_of(self, node):
+        """Полный путь узла по ссылкам на родителей из индекса"""
+        parts = []
+        while node is not self.root:
+            parts.append(node.name)
+            node = self.parent_of(node)
+        return "/" + "/".join(reversed(parts))
+
+    def walk(self, node, path, maxdepth=None):
+        """Обход поддерева в глубину (прямой порядок): тройки (путь, узел, глубина)
+
+        Директории глубже maxdepth не раскрываются.
+        """
+        stack = [(path, node, 0)]
+        while stack:
+            path, node, depth = stack.pop()
+            yield path, node, depth
+            if node.type == "dir" and (maxdepth is None or depth < maxdepth):
+                self.ensure_loaded(node)
+                prefix = path if path != "/" else ""
+                stack.extend((f"{prefix}/{child.name}", child, depth + 1)
+                             for child in reversed(node.children.values()))
+
+    def usage(self, node):
+        """Итоги поддерева директории: (байт в файлах, файлов, директорий), без самой node
+
+        Итоги хранятся в узлах. Изменения сбрасывают их только на пути от корня
+        (resolve(..., for_write=True)), поэтому пересчитываются лишь измененные
+        директории, а для остальных и для общих со снимками узлов берутся готовые.
+        """
+        if node.usage is not None:
+            return node.usage
+        stack = [(node, False)]
+        while stack:
+            item, counted = stack.pop()
+            if not counted:
+                self.ensure_loaded(item)
+                stack.append((item, True))
+                stack.extend((child, False) for child in item.children.values()
+                             if child.type == "dir" and child.usage is None)
+                continue
+            total = files = dirs = 0
+            for child in item.children.values():
+                if child.type == "dir":
+                    child_total, child_files, child_dirs = child.usage
+                    total += child_total
+                    files += child_files
+                    dirs += child_dirs + 1
+                else:
+                    total += self.file_size(child)
+                    files += 1
+            item.usage = (total, files, dirs)
+        return node.usage
+
+    def ordered_children(self, node, key=None):
+        """Дети директории по ключу ORDER_KEYS (None - в порядке добавления)
+
+        Отсортированный кортеж хранится в узле до изменения директории (как итоги
+        поддерева), поэтому повторный ls большой директории не сортирует заново.
+        Общие со снимками узлы не меняются, и порядок у них тоже общий.
+        """
+        self.ensure_loaded(node)
+        if key is None:
+            return node.children.values()
+        order = node.order
+        if order is None:
+            order = node.order = {}
+        items = order.get(key)
+        if items is None:
+            if key == "size":
+                sort_key = lambda child: (-self.file_size(child) if child.type == "file" else 0, child.name)
+            elif key == "type":
+                sort_key = lambda child: (child.type != "dir", child.name)
+            else:
+                sort_key = _child_name
+            items = order[key] = tuple(sorted(node.children.values(), key=sort_key))
+        return items
+
+    # === Изменения ===
+
+    def _own(self, node, parent):
+        """Узел, который можно изменять в этом дереве: общий со снимком узел копируется
+
+        parent - уже собственный родитель узла (None для корня). Копия директории
+        получает копию словаря детей, сами дети остаются общими.
+        """
+        if node.gen == self.gen:
+            return node
+        self.version += 1
+        if node.type == "dir":
+            copy = DirNode(node.name, self.gen, node.ino)
+            copy.loaded = node.loaded
+            copy.usage = node.usage
+            copy.hidden = node.hidden
+            copy.children = dict(node.children)
+            if self.name_index is not None:
+                for child in copy.children.values():
+                    _bucket_add(self.name_index, child, copy)
+        else:
+            copy = FileNode(node.name, self.gen, node.content, node.ino)
+        copy.source = node.source
+        copy.stamp = node.stamp
+        if parent is None:
+            self.root = copy
+        else:
+            parent.children[node.name] = copy
+            parent.order = None
+            if self.name_index is not None:
+                _bucket_remove(self.name_index, node)
+                _bucket_add(self.name_index, copy, parent)
+        return copy
+
+    def move(self, path, new_parent_path, new_name):
+        """Перемещение/переименование узла по путям: копируются только узлы на путях от корня
+
+        Перемещенный узел становится объектом VFS (stamp=None): по новому пути
+        на диске его нет, и синхронизация (vfs_sync) не должна ни удалять его,
+        ни сравнивать с чужим файлом. Ленивая директория для этого читается:
+        непрочитанная без отметки считается еще не загруженной с диска. Имя
+        элемента диска запоминается в прежней директории (hidden), чтобы
+        синхронизация не вернула его туда.
+        """
+        parent_path, _, name = path.rstrip("/").rpartition("/")
+        old_parent = self.resolve(parent_path or "/", for_write=True)
+        new_parent = self.resolve(new_parent_path, for_write=True)
+        node = self._own(old_parent.children[name], old_parent)
+        if node.stamp is not None or (not node.loaded and isinstance(node.source, str)):
+            old_parent.hidden = (old_parent.hidden or frozenset()) | {name}
+        if node.type == "dir":
+            self.ensure_loaded(node)
+        node.stamp = None
+        del old_parent.children[name]
+        old_parent.order = new_parent.order = None
+        self._index_remove(node)
+        node.name = new_name = sys.intern(new_name)
+        new_parent.children[new_name] = node
+        self._index_add(node, new_parent)
+        self.version += 1
+        return node
+
+    def remove(self, parent, name):
+        """Удаление узла вместе с поддеревом; parent - из resolve(..., for_write=True)"""
+        self._check_shared_loads()
+        node = parent.children.pop(name)
+        parent.order = None
+        self.version += 1
+        removed = 0
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            removed += 1
+            self._index_remove(item)
+            if item.type == "dir":
+                if item.loaded:
+                    stack.extend(item.children.values())
+                else:
+                    self.unloaded_dirs -= 1
+        self.node_count -= removed
+        return removed
+
+    # === Снимки ===
+
+    def snapshot(self):
+        """Снимок за O(1): текущие узлы становятся общими, изменения дальше их копируют"""
+        snapshot = VFSSnapshot(self.root, self.node_count, self.unloaded_dirs)
+        self.gen = next(_generations)
+        return snapshot
+
+    def restore(self, snapshot):
+        """Возврат к снимку за O(1); снимок остается неизменным и доступен повторно"""
+        self.root = snapshot.root
+        self.node_count = snapshot.node_count
+        self.unloaded_dirs = snapshot.unloaded_dirs
+        self.gen = next(_generations)
+        self.version += 1
+        self.name_index = None
+        self._sorted_names = None
+
+    def fork(self):
+        """Независимая версия дерева за O(1): узлы общие до первого изменения в любой из версий"""
+        other = VFSTree()
+        other.restore(self.snapshot())
+        other.blobs = self.blobs
+        other.text_index = self.text_index
+        other.loader = self.loader
+        other.report = self.report
+        other._loading = self._loading
+        other._shared_loads_seen = self._loading.shared_loads
+        return other
+
+    def diff(self, snapshot):
+        """Отличия текущего дерева от снимка: (вид, путь, узел, старый_путь)
+
+        Вид: "+" создан, "-" удален, "~" изменен, ">" перемещен (тот же inode
+        по другому пути). Общие со снимком поддеревья не обходятся, поэтому
+        время зависит от объема изменений, а не от размера дерева.
+        """
+        added = []
+        removed = []
+        changed = []
+        pending = [("", "", snapshot.root, self.root)]
+        expanded = set()
+        scanned_added = scanned_removed = 0
+        while pending:
+            for old_prefix, new_prefix, old, new in pending:
+                _diff_dirs(old_prefix, new_prefix, old, new, added, removed, changed)
+            # В созданных и удаленных директориях ищутся перемещенные узлы
+            # (вложенные новые и удаленные узлы отдельно не выводятся)
+            removed_by_ino = {node.ino: node for path, node in removed}
+            added_by_ino = {node.ino: node for path, node in added}
+            for path, node in added[scanned_added:]:
+                if node.type == "dir" and node.ino not in removed_by_ino:
+                    _find_moved(path, node, removed_by_ino, added)
+            for path, node in removed[scanned_removed:]:
+                if node.type == "dir" and node.ino not in added_by_ino:
+                    _find_moved(path, node, added_by_ino, removed)
+            scanned_added, scanned_removed = len(added), len(removed)
+            # Перемещенные директории сравниваются по содержимому на новом месте
+            removed_by_ino = {node.ino: (path, node) for path, node in removed}
+            pending = []
+            for path, node in added:
+                if node.type != "dir" or node.ino in expanded or node.ino not in removed_by_ino:
+                    continue
+                old_path, old = removed_by_ino[node.ino]
+                if old is not node:
+                    expanded.add(node.ino)
+                    pending.append((old_path, path, old, node))
+
+        removed_paths = {node.ino: path for path, node in removed}
+        moved = {node.ino for path, node in added if node.ino in removed_paths}
+        result = [("-", path, node, None) for path, node in removed if node.ino not in moved]
+        for path, node in added:
+            if node.ino in moved:
+                result.append((">", path, node, removed_paths[node.ino]))
+            else:
+                result.append(("+", path, node, None))
+        result.extend(("~", path, node, None) for path, node in changed)
+        result.sort(key=lambda item: item[1])
+        return result
+
+    # === Ленивая загрузка ===
+
+    def attach_lazy(self, node, source):
+        """Регистрация директории, содержимое которой еще не прочитано
+
+        source - ссылка на данные для self.loader (путь на диске, номер записи образа).
+        """
+        node.source = source
+        node.loaded = False
+        self.unloaded_dirs += 1
+
+    def add_lazy_file(self, parent, name, source):
+        """Файл, содержимое которого будет открыто через self.loader при первом обращении"""
+        node = self._new_node(name, "file", parent)
+        node.source = source
+        return node
+
+    def ensure_loaded(self, node):
+        """Чтение списка элементов ленивой директории при первом обращении"""
+        if node.loaded:
+            return
+        with self._loading.lock:
+            if node.loaded:
+                return
+            self._check_shared_loads()
+            try:
+                self.loader.list_children(self, node)
+            finally:
+                # Флаг ставится после чтения, чтобы другие потоки не увидели неполный список
+                node.loaded = True
+                self.unloaded_dirs -= 1
+                if node.gen != self.gen:
+                    # Директория общая с другими версиями дерева: их индексы имен устарели
+                    self._loading.shared_loads += 1
+                    self._shared_loads_seen = self._loading.shared_loads
+
+    def content_of(self, node):
+        """Объект содержимого файла; у ленивых файлов создается загрузчиком при первом обращении"""
+        if node.content is None:
+            node.content = self.loader.open_content(node)
+        return node.content
+
+    def file_size(self, node):
+        """Размер файла в байтах без чтения содержимого"""
+        return self.content_of(node).size
+
+
+def _diff_dirs(old_prefix, new_prefix, old, new, added, removed, changed):
+    """Сравнение двух версий директории; одинаковые объекты узлов пропускаются"""
+    stack = [(old_prefix, new_prefix, old, new)]
+    while stack:
+        old_prefix, new_prefix, old, new = stack.pop()
+        old_children = old.children
+        new_children = new.children
+        for name, old_child in old_children.items():
+            new_child = new_children.get(name)
+            if new_child is old_child:
+                continue
+            old_path = f"{old_prefix}/{name}"
+            new_path = f"{new_prefix}/{name}"
+            if new_child is None or new_child.ino != old_child.ino:
+                removed.append((old_path, old_child))
+                if new_child is not None:
+                    added.append((new_path, new_child))
+            elif new_child.type == "dir":
+                stack.append((old_path, new_path, old_child, new_child))
+            elif new_child.content is not old_child.content:
+                changed.append((new_path, new_child))
+        for name, new_child in new_children.items():
+            if name not in old_children:
+                added.append((f"{new_prefix}/{name}", new_child))
+
+
+def _find_moved(prefix, node, other_side, found):
+    """Узлы поддерева node, которые есть на другой стороне сравнения (other_side: inode -> узел)"""
+    stack = [(prefix, node)]
+    while stack:
+        prefix, node = stack.pop()
+        for name, child in node.children.items():
+            path = f"{prefix}/{name}"
+            if child.ino in other_side:
+                found.append((path, child))
+            elif child.type == "dir":
+                stack.append((path, child))
+
+
+class HostLoader:
+    """Ленивое чтение директорий и файлов с диска; source узла - реальный путь"""
+
+    def list_children(self, tree, node):
+        try:
+            # mtime берется до чтения списка, чтобы reload заметил изменения во время чтения
+            node.stamp = os.stat(node.source).st_mtime_ns
+            with os.scandir(node.source) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        tree.attach_lazy(tree.add_dir(node, entry.name), entry.path)
+                    else:
+                        child = tree.add_lazy_file(node, entry.name, entry.path)
+                        try:
+                            st = entry.stat()
+                            child.stamp = file_stamp(st.st_size, st.st_mtime_ns)
+                        except OSError:
+                            pass
+        except OSError as e:
+            tree.report(f"Ошибка сканирования {node.source}: {e}")
+
+    def open_content(self, node):
+        return HostFileContent(node.source)
+